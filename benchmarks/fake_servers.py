@@ -0,0 +1,182 @@
+# benchmarks/fake_servers.py
+
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from aiohttp import web
+
+
+class FakeUpstreams:
+    """
+    Local stand-ins for every HTTP API the bot talks to, served from one port.
+
+    The responses reproduce the shapes the checkers read, under these prefixes:
+
+        /discourse/<forum>/posts.json                 Discourse latest posts, paged with ?before=
+        /stackexchange/2.3/filters/create, /questions Stack Exchange API
+        /subsquare/<network>/api/gov2/referendums     Subsquare referenda list and single referenda
+        /polkassembly/api/v1/posts/on-chain-post      Polkassembly referendum details
+        /_matrix/client/v3/rooms/<room>/send/...      Matrix homeserver message sends
+
+    Every response is delayed by `latency` seconds, and a share `error_rate` of them fails
+    (HTTP 503 upstream, M_LIMIT_EXCEEDED from the homeserver). New items only appear when
+    `publish()` is called, so a benchmark decides how much work every cycle has.
+    """
+
+    def __init__(self, vocabulary: List[str], keywords: List[str], latency: float = 0.02, error_rate: float = 0.0,
+                 keyword_rate: float = 0.2, seed: int = 0):
+        self.vocabulary = vocabulary
+        self.keywords = keywords
+        self.latency = latency
+        self.error_rate = error_rate
+        self.keyword_rate = keyword_rate
+        self.random = random.Random(seed)
+        self.requests = Counter()
+        self.errors = Counter()
+        self.messages_sent = 0
+        self.posts: Dict[str, List[Dict]] = {}
+        self.questions: Dict[str, List[Dict]] = {}
+        self.referenda: Dict[str, List[Dict]] = {}
+        self._next_post_id = 1
+        self._runner = None
+        self.url = None
+
+    def _text(self, words: int = 60) -> str:
+        text = self.random.choices(self.vocabulary, k=words)
+        if self.random.random() < self.keyword_rate:
+            text[self.random.randrange(words)] = self.random.choice(self.keywords)
+        return " ".join(text)
+
+    def publish(self, forums: List[str], sites: List[str], networks: List[str], count: int) -> None:
+        """Create `count` new items on every forum, site and network."""
+        for forum in forums:
+            posts = self.posts.setdefault(forum, [])
+            for _ in range(count):
+                posts.append({
+                    "id": self._next_post_id,
+                    "created_at": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+                    "topic_title": self._text(8),
+                    "cooked": f"<p>{self._text()}</p>",
+                    "topic_id": self._next_post_id,
+                    "post_number": 1,
+                    "username": "bench",
+                })
+                self._next_post_id += 1
+        for site in sites:
+            questions = self.questions.setdefault(site, [])
+            for _ in range(count):
+                questions.append({
+                    "question_id": len(questions) + 1,
+                    "title": self._text(8),
+                    "body_markdown": self._text(),
+                    "tags": self.random.choices(self.vocabulary, k=3),
+                    "link": f"https://{site}.example/q/{len(questions) + 1}",
+                    "creation_date": int(time.time()),
+                    "owner": {"display_name": "bench"},
+                })
+        for network in networks:
+            referenda = self.referenda.setdefault(network, [])
+            for _ in range(count):
+                referenda.append({
+                    "referendumIndex": len(referenda),
+                    "createdAt": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                    "title": self._text(8),
+                    "content": self._text(),
+                })
+
+    async def _respond(self, kind: str, handler):
+        self.requests[kind] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.error_rate:
+            self.errors[kind] += 1
+            if kind == "matrix":
+                return web.json_response({"errcode": "M_LIMIT_EXCEEDED", "error": "Too many requests", "retry_after_ms": 50}, status=429)
+            return web.json_response({"error": "unavailable"}, status=503)
+        return handler()
+
+    async def discourse_posts(self, request: web.Request) -> web.Response:
+        def handler():
+            posts = self.posts.get(request.match_info["forum"], [])
+            before = request.query.get("before")
+            if before is not None:
+                posts = [post for post in posts if post["id"] < int(before)]
+            return web.json_response({"latest_posts": list(reversed(posts[-50:]))})
+        return await self._respond("discourse", handler)
+
+    async def stackexchange_filter(self, request: web.Request) -> web.Response:
+        return await self._respond("stackexchange", lambda: web.json_response({"items": [{"filter": "!bench"}]}))
+
+    async def stackexchange_questions(self, request: web.Request) -> web.Response:
+        def handler():
+            todate = int(request.query.get("todate", 2 ** 62))
+            questions = [q for q in self.questions.get(request.query["site"], [])
+                         if int(request.query["fromdate"]) <= q["creation_date"] <= todate]
+            questions.reverse()
+            page, page_size = int(request.query.get("page", 1)), int(request.query.get("pagesize", 30))
+            items = questions[(page - 1) * page_size:page * page_size]
+            return web.json_response({"items": items, "has_more": len(questions) > page * page_size,
+                                      "quota_max": 10000, "quota_remaining": 9999})
+        return await self._respond("stackexchange", handler)
+
+    async def subsquare_referenda(self, request: web.Request) -> web.Response:
+        def handler():
+            referenda = list(reversed(self.referenda.get(request.match_info["network"], [])))
+            page, page_size = int(request.query.get("page", 1)), int(request.query.get("pageSize", 100))
+            items = [{k: v for k, v in referendum.items() if k != "content"} for referendum in referenda[(page - 1) * page_size:page * page_size]]
+            return web.json_response({"items": items, "total": len(referenda)})
+        return await self._respond("subsquare", handler)
+
+    async def subsquare_referendum(self, request: web.Request) -> web.Response:
+        def handler():
+            referenda = self.referenda.get(request.match_info["network"], [])
+            index = int(request.match_info["index"])
+            if index >= len(referenda):
+                return web.json_response({"error": "not found"}, status=404)
+            return web.json_response(referenda[index])
+        return await self._respond("subsquare", handler)
+
+    async def polkassembly_post(self, request: web.Request) -> web.Response:
+        def handler():
+            referenda = self.referenda.get(request.headers.get("x-network"), [])
+            index = int(request.query["postId"])
+            if index >= len(referenda):
+                return web.json_response({"title": None})
+            etag = f'"{request.headers.get("x-network")}-{index}"'
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304)
+            referendum = referenda[index]
+            return web.json_response({"title": referendum["title"], "content": referendum["content"]}, headers={"ETag": etag})
+        return await self._respond("polkassembly", handler)
+
+    async def matrix_send(self, request: web.Request) -> web.Response:
+        def handler():
+            self.messages_sent += 1
+            return web.json_response({"event_id": f"$bench{self.messages_sent}"})
+        return await self._respond("matrix", handler)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_get("/discourse/{forum}/posts.json", self.discourse_posts)
+        app.router.add_get("/stackexchange/2.3/filters/create", self.stackexchange_filter)
+        app.router.add_get("/stackexchange/2.3/questions", self.stackexchange_questions)
+        app.router.add_get("/subsquare/{network}/api/gov2/referendums", self.subsquare_referenda)
+        app.router.add_get("/subsquare/{network}/api/gov2/referendums/{index}", self.subsquare_referendum)
+        app.router.add_get("/polkassembly/api/v1/posts/on-chain-post", self.polkassembly_post)
+        app.router.add_put("/_matrix/client/v3/rooms/{room}/send/{event_type}/{txn_id}", self.matrix_send)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,226 @@
+# benchmarks/run_benchmark.py
+"""
+Measure how a polling cycle scales with the number of users, against local fake upstreams.
+
+Every run builds a synthetic config with the given number of users, each subscribed to
+a few of the fake forums, Stack Exchange sites and governance networks, and drives the
+real SubscriptionRouter, checkers and delivery queue through several cycles. A cycle
+publishes new items upstream, checks every source once and waits until every matching
+alert was delivered to the fake homeserver.
+
+Usage:
+    python -m benchmarks.run_benchmark --users 1,10,100,1000 --cycles 5 --latency 0.02
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import random
+import resource
+import statistics
+import tempfile
+import time
+
+from nio import AsyncClient
+
+from data_checkers.discourse_checker import DiscourseChecker
+from data_checkers.governance_checker import GovernanceChecker
+from data_checkers.router import SubscriptionRouter
+from data_checkers.stackexchange_checker import StackExchangeChecker
+from matrix.delivery import setup_delivery_queue
+from open_governance.enrichment import setup_referendum_enricher
+from open_governance.substrate_pool import setup_substrate_pool
+from utils.http_client import setup_http_client
+from utils.seen_store import setup_seen_store
+from utils.state import setup_state_store
+
+from benchmarks.fake_servers import FakeUpstreams
+
+checker_classes = {
+    "discourse": DiscourseChecker,
+    "governance": GovernanceChecker,
+    "stackexchange": StackExchangeChecker,
+}
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def build_config(args, users: int, upstream_url: str, data_dir: str, vocabulary, rng) -> dict:
+    forums = [f"forum{i}" for i in range(args.forums)]
+    sites = [f"site{i}" for i in range(args.sites)]
+    networks = [f"network{i}" for i in range(args.networks)]
+    config = {
+        "global_check_interval": 60,
+        "http": {"cache_ttl": args.cache_ttl, "max_concurrency": args.max_concurrency},
+        "state": {"path": f"{data_dir}/last_check.json"},
+        "seen_store": {"path": f"{data_dir}/seen.db"},
+        "delivery": {"outbox_path": f"{data_dir}/outbox.db", "retry_delay": 0.1, "max_retry_delay": 1},
+        "users": [],
+    }
+    for i in range(users):
+        keywords = rng.sample(vocabulary, args.keywords)
+        forum_names = [forums[(i + offset) % len(forums)] for offset in range(min(2, len(forums)))]
+        config["users"].append({
+            "name": f"user{i}",
+            "matrix_room_id": f"!room{i}:bench",
+            "checkers": [
+                {
+                    "checker_type": "discourse",
+                    "forums": [
+                        {
+                            "name": forum,
+                            "discourse_url": f"{upstream_url}/discourse/{forum}",
+                            "discourse_api_key": "bench",
+                            "discourse_api_user": "bench",
+                            "keywords": keywords,
+                        }
+                        for forum in forum_names
+                    ],
+                },
+                {
+                    "checker_type": "stackexchange",
+                    "stack_exchange_site": sites[i % len(sites)],
+                    "stack_exchange_api_key": "bench",
+                    "stack_exchange_api_url": f"{upstream_url}/stackexchange/2.3",
+                    "keywords": keywords,
+                },
+                {
+                    "checker_type": "governance",
+                    "substrate_wss": "ws://127.0.0.1:9944",
+                    "network": networks[i % len(networks)],
+                    "subsquare_url": f"{upstream_url}/subsquare/{networks[i % len(networks)]}",
+                    "polkassembly_url": f"{upstream_url}/polkassembly",
+                    "keywords": keywords,
+                },
+            ],
+        })
+    return config, forums, sites, networks
+
+
+async def run_cycle(router, max_parallel: int) -> int:
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def check(source_key):
+        async with semaphore:
+            await router.check_source(source_key)
+
+    results = await asyncio.gather(*(check(key) for key in router.feeds), return_exceptions=True)
+    return sum(1 for result in results if isinstance(result, Exception))
+
+
+async def wait_for_delivery(delivery, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while len(delivery.outbox) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def run_benchmark(args, users: int, logger) -> dict:
+    rng = random.Random(args.seed)
+    vocabulary = [f"word{i}" for i in range(args.vocabulary)]
+    upstream = FakeUpstreams(vocabulary, vocabulary[:args.vocabulary // 10], latency=args.latency,
+                             error_rate=args.error_rate, keyword_rate=args.keyword_rate, seed=args.seed)
+    upstream_url = await upstream.start()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        config, forums, sites, networks = build_config(args, users, upstream_url, data_dir, vocabulary, rng)
+        http_client = setup_http_client(config, logger)
+        seen_store = setup_seen_store(config, logger)
+        setup_state_store(config, logger)
+        substrate_pool = setup_substrate_pool(config, logger)
+        setup_referendum_enricher(config, logger)
+        client = AsyncClient(upstream_url, "@bench:bench")
+        client.access_token = "bench"
+        delivery = setup_delivery_queue(config, client, logger)
+        delivery.start()
+
+        try:
+            setup_started = time.perf_counter()
+            router = SubscriptionRouter(config, checker_classes, logger)
+            setup_duration = time.perf_counter() - setup_started
+
+            # Initialize the cursors of every source before measuring.
+            upstream.publish(forums, sites, networks, args.new_items)
+            await run_cycle(router, args.max_parallel)
+            await wait_for_delivery(delivery)
+            upstream.requests.clear()
+            upstream.errors.clear()
+            messages_before = upstream.messages_sent
+
+            latencies = []
+            failures = 0
+            for _ in range(args.cycles):
+                # Keep creation times strictly after the previous cycle's cursor.
+                await asyncio.sleep(1)
+                upstream.publish(forums, sites, networks, args.new_items)
+                started = time.perf_counter()
+                failures += await run_cycle(router, args.max_parallel)
+                await wait_for_delivery(delivery)
+                latencies.append(time.perf_counter() - started)
+        finally:
+            delivery.stop()
+            delivery.outbox.close()
+            await client.close()
+            await http_client.close()
+            seen_store.close()
+            substrate_pool.close()
+            await upstream.stop()
+
+    messages = upstream.messages_sent - messages_before
+    return {
+        "users": users,
+        "sources": len(router.feeds),
+        "setup_s": round(setup_duration, 4),
+        "cycle_p50_s": round(statistics.median(latencies), 4),
+        "cycle_p99_s": round(percentile(latencies, 0.99), 4),
+        "messages_per_s": round(messages / sum(latencies), 1),
+        "messages_per_cycle": messages / args.cycles,
+        "requests_per_cycle": {kind: count / args.cycles for kind, count in sorted(upstream.requests.items())},
+        "upstream_errors": dict(upstream.errors),
+        "failed_checks": failures,
+        # ru_maxrss is in kilobytes on Linux and never decreases, so runs are reported in increasing size.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", default="1,10,100,1000", help="Comma-separated user counts to run")
+    parser.add_argument("--forums", type=int, default=5)
+    parser.add_argument("--sites", type=int, default=2)
+    parser.add_argument("--networks", type=int, default=2)
+    parser.add_argument("--keywords", type=int, default=5, help="Keywords per user")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="Distinct words in generated items")
+    parser.add_argument("--keyword-rate", type=float, default=0.2, help="Share of items seeded with a popular keyword")
+    parser.add_argument("--new-items", type=int, default=20, help="New items per source per cycle")
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds every fake response is delayed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of fake responses that fail")
+    parser.add_argument("--max-parallel", type=int, default=4, help="Sources checked at the same time")
+    parser.add_argument("--max-concurrency", type=int, default=20, help="Concurrent upstream HTTP requests")
+    parser.add_argument("--cache-ttl", type=float, default=0, help="HTTP response cache TTL")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # nio logs every rate-limited send, which the error rate makes routine.
+    logging.getLogger("nio").setLevel(logging.ERROR)
+    logger = logging.getLogger("benchmark")
+
+    results = []
+    for users in sorted(int(count) for count in args.users.split(",")):
+        result = asyncio.run(run_benchmark(args, users, logger))
+        results.append(result)
+        print(json.dumps(result))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,108 @@
 # data_checkers/__init__.py
 
+import os
+
+from utils.http_client import get_http_client
+
+
+class SourceConfigError(Exception):
+    """A source config stanza that cannot be used, e.g. because a setting or secret is missing."""
+
+
+def resolve_secret(source_config, key, env_setting, default_env=None):
+    """
+    Return the source config with the secret `key` read from the environment.
+
+    The environment variable is named by the stanza's `env_setting`, or `default_env`. If
+    that variable is not set, a secret written in the stanza itself is used instead.
+
+    Raises:
+        SourceConfigError: If the secret is in neither place.
+    """
+    env_name = source_config.get(env_setting, default_env)
+    if env_name and env_name in os.environ:
+        return dict(source_config, **{key: os.environ[env_name]})
+    if env_setting in source_config:
+        raise SourceConfigError(f"environment variable {env_name} is not set")
+    if key not in source_config:
+        raise SourceConfigError(f"missing {key}, or {env_setting} naming the environment variable that holds it")
+    return source_config
+
+
+class FeedItem:
+    """A new item of an upstream source, as handed to the router for matching and delivery."""
+
+    __slots__ = ("item_id", "title", "text", "link", "author", "created_at", "marker")
+
+    def __init__(self, item_id, title, text, link, author=None, created_at=None, marker=None):
+        self.item_id = item_id
+        self.title = title
+        self.text = text
+        self.link = link
+        self.author = author
+        self.created_at = created_at
+        # Ordered value used for the seen-store high-water mark, if the source has one.
+        self.marker = marker
+
 class DataChecker:
-    def __init__(self, client, matrix_room_id, checker_config, logger):
-        self.client = client
-        self.matrix_room_id = matrix_room_id
+    """
+    Polls one upstream source, e.g. one Discourse forum, for every user subscribed to it.
+
+    A checker only fetches new items; matching them against keywords and delivering
+    them to rooms is done by the SubscriptionRouter.
+    """
+
+    checker_type = None
+    # Settings a source config stanza cannot do without.
+    required_settings = ()
+
+    def __init__(self, source_config, logger):
+        self.source_config = source_config
         self.logger = logger
+        self.http = get_http_client()
+
+    @staticmethod
+    def sources(checker_config):
+        """Return the (source key, source config) pairs a user's checker config subscribes to."""
+        raise NotImplementedError
+
+    @classmethod
+    def prepare(cls, source_config):
+        """
+        Return the source config to create the checker with, validated and with its secrets resolved.
+
+        Called for every subscriber's stanza on startup and config reload, so a bad stanza only
+        disables its own subscription.
+
+        Raises:
+            SourceConfigError: If a required setting or secret is missing, or the keywords are not a list of strings.
+        """
+        missing = [key for key in ("keywords",) + tuple(cls.required_settings) if key not in source_config]
+        if missing:
+            raise SourceConfigError(f"missing {', '.join(missing)}")
+        keywords = source_config["keywords"]
+        if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+            raise SourceConfigError("keywords must be a list of strings")
+        return source_config
+
+    async def fetch_new_items(self, last_check, min_marker=None):
+        """
+        Return the items created since `last_check`.
+
+        `min_marker` is the high-water mark every subscriber already has; sources with ordered
+        markers may stop reading at or below it.
+        """
+        raise NotImplementedError
+
+    async def iter_new_items(self, last_check, min_marker=None):
+        """
+        Yield the items created since `last_check` in batches, as they are fetched.
+
+        Sources that read many pages override this to hand every page to the router as soon
+        as it arrives, instead of collecting all of them first.
+        """
+        yield await self.fetch_new_items(last_check, min_marker)
 
+    def format_message(self, item, matched_keywords):
+        """Return the Matrix message content announcing `item`."""
+        raise NotImplementedError
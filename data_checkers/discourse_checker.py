@@ -1,68 +1,162 @@
 # data_checkers/discourse_checker.py
 
-import requests
+import hashlib
+import html
+from collections import namedtuple
 from datetime import datetime
-from data_checkers import DataChecker
+from data_checkers import DataChecker, FeedItem, resolve_secret
+from utils.utils import strip_html
+
+# Posts older than `before` and newer than the floor, a post ID or else a time, that were not read yet,
+# and the newest post read since they were left out.
+_PostGap = namedtuple("_PostGap", ["before", "newest", "min_marker", "since"])
 
 class DiscourseChecker(DataChecker):
-    def __init__(self, client, matrix_room_id, checker_config, logger, last_check):
-        super().__init__(client, matrix_room_id, checker_config, logger)
-        self.discourse_url = checker_config["discourse_url"]
-        self.discourse_api_key = checker_config["discourse_api_key"]
-        self.discourse_api_user = checker_config["discourse_api_user"]
-        self.keywords = checker_config["keywords"]
-        self.last_check = last_check
-
-    async def check_new_data(self):
-        self.logger.debug("Checking new data for DiscourseChecker")
-        for keyword in self.keywords:
-            await self.search_discourse_posts(keyword)
-
-    async def search_discourse_posts(self, keyword):
-        self.logger.debug(f"Searching {self.discourse_url} posts for keyword: {keyword}")
-        url = f"{self.discourse_url}/search.json"
+    checker_type = "discourse"
+    required_settings = ("discourse_url", "discourse_api_user")
+
+    def __init__(self, source_config, logger):
+        super().__init__(source_config, logger)
+        self.discourse_url = source_config["discourse_url"]
+        self.discourse_api_key = source_config["discourse_api_key"]
+        self.discourse_api_user = source_config["discourse_api_user"]
+        self.max_pages = source_config.get("max_pages", 10)
+        # The posts a scan cut short by max_pages did not read yet.
+        self._gap = None
+
+    @classmethod
+    def prepare(cls, source_config):
+        return resolve_secret(super().prepare(source_config), "discourse_api_key", "discourse_api_key_env")
+
+    @staticmethod
+    def sources(checker_config):
+        return [(DiscourseChecker.source_key(forum), forum) for forum in checker_config["forums"]]
+
+    @staticmethod
+    def source_key(forum):
+        """
+        Return the key of a forum as seen with the stanza's credentials.
+
+        What a forum returns depends on who asks, e.g. posts of private categories, so only
+        stanzas with the same API user and key share a source. The key is identified by the
+        environment variable holding it, or by a digest of a key written in the config.
+        """
+        credential = forum.get("discourse_api_key_env")
+        if credential is None:
+            credential = hashlib.sha256(str(forum.get("discourse_api_key")).encode()).hexdigest()[:12]
+        return f"discourse:{forum['discourse_url']}:{forum.get('discourse_api_user')}:{credential}"
+
+    async def fetch_new_items(self, last_check, min_marker=None):
+        """
+        Tail the forum's latest posts, paging backwards until the last post already routed.
+
+        A scan that runs out of `max_pages` first leaves a gap of unread posts. It is remembered
+        and read by the next scans, after the posts that arrived in the meantime, and until it
+        is closed the posts get no marker, so the high-water mark stays below the gap.
+
+        Args:
+            last_check (datetime): The time of the last check, only used before any post ID was recorded.
+            min_marker (float, optional): The ID of the newest post already routed.
+
+        Returns:
+            List[FeedItem]: The new posts, newest first.
+        """
+        self.logger.debug(f"Fetching latest posts of {self.discourse_url}")
+        gap = self._gap
+        if gap is None:
+            # last_check is a naive local time.
+            gap_floor = (min_marker, last_check.astimezone())
+            items, resume, _ = await self._read_posts(None, gap_floor, self.max_pages)
+            newest = items[0] if items else None
+        else:
+            gap_floor = (gap.min_marker, gap.since)
+            # The posts that arrived since the last scan, then as much of the gap as the pages left allow.
+            items, resume, pages = await self._read_posts(None, (gap.newest.item_id, None), self.max_pages)
+            newest = items[0] if items else gap.newest
+            if resume is None:
+                older, resume, _ = await self._read_posts(gap.before, gap_floor, self.max_pages - pages)
+                items += older
+                if resume is None and newest is gap.newest:
+                    # The router only raises the high-water mark to the markers it is handed, so the newest post
+                    # read while the gap was open is handed back. The outbox and seen-item store keep it from being sent twice.
+                    newest.marker = newest.item_id
+                    items.insert(0, newest)
+
+        if resume is None:
+            self._gap = None
+        else:
+            self._gap = _PostGap(resume, newest, *gap_floor)
+            self.logger.warning(f"Stopped paging {self.discourse_url} after {self.max_pages} pages, "
+                                f"continuing before post {resume} with the next check")
+            for item in items:
+                item.marker = None
+
+        self.logger.debug(f"Found {len(items)} new posts on {self.discourse_url}")
+        return items
+
+    async def _read_posts(self, before, floor, max_pages):
+        """
+        Page backwards through the latest posts, down to a post already routed.
+
+        Args:
+            before (int): The post ID to start paging before, or None for the newest posts.
+            floor (Tuple): The ID of the newest post already routed, or else the time of the last check.
+            max_pages (int): The maximum number of pages to read.
+
+        Returns:
+            Tuple: The new posts newest first, the post ID to continue paging before if
+            `max_pages` ran out first or else None, and the number of pages read.
+        """
+        url = f"{self.discourse_url}/posts.json"
         headers = {
             "Api-Key": self.discourse_api_key,
             "Api-Username": self.discourse_api_user,
             "Content-Type": "application/json",
         }
-        data = {
-                "q": f"{keyword} after:{self.last_check.strftime('%Y-%m-%d')} in:open",
+        min_marker, since = floor
+
+        items = []
+        for page in range(max_pages):
+            params = {"before": before} if before is not None else None
+            response = await self.http.get_json(url, params=params, headers=headers, vary=("Api-Key", "Api-Username"))
+            if response.status != 200:
+                self.logger.error("Failed to fetch latest posts from Discourse.")
+                response.raise_for_status()
+
+            posts = response.data["latest_posts"]
+            reached_cursor = False
+            for post in posts:
+                created_at = datetime.fromisoformat(post["created_at"].replace("Z", "+00:00"))
+                if min_marker is not None:
+                    if post["id"] <= min_marker:
+                        reached_cursor = True
+                        continue
+                elif created_at < since:
+                    reached_cursor = True
+                    continue
+                items.append(FeedItem(
+                    item_id=post["id"],
+                    title=post.get("topic_title", ""),
+                    text=strip_html(post.get("cooked")),
+                    link=f"{self.discourse_url}/t/{post['topic_id']}/{post['post_number']}",
+                    author=post["username"],
+                    created_at=created_at,
+                    marker=post["id"],
+                ))
+
+            if reached_cursor or not posts:
+                return items, None, page + 1
+            before = min(post["id"] for post in posts)
+        return items, before, max_pages
+
+    def format_message(self, item, matched_keywords):
+        post_abstract = item.text[:250] + "..." if len(item.text) > 250 else item.text
+        # The text is unescaped by strip_html, so it has to be escaped again for the HTML body.
+        formatted_message = (f"🔍 <strong>Discourse ({html.escape(self.discourse_url)}, {html.escape(', '.join(matched_keywords))})</strong><br>"
+                             f"<strong>{html.escape(item.author)}</strong> - {html.escape(post_abstract)}<br><a href='{html.escape(item.link)}'>Read more</a>")
+        return {
+            "msgtype": "m.text",
+            "format": "org.matrix.custom.html",
+            "formatted_body": formatted_message,
+            "body": f"{item.author} - {post_abstract}\n{item.link}"
         }
-    
-        req = requests.Request('GET', url, headers=headers, params=data)
-        prepared_req = req.prepare()
-    
-        self.logger.debug(f"Search URL: {prepared_req.url}")
-    
-        response = requests.get(url, headers=headers, params=data)
-        if response.status_code == 200:
-            results = response.json()
-            posts = results["posts"]
-            #self.logger.debug(f"Posts: {posts}")
-    
-            if posts:
-                self.logger.debug(f"Found {len(posts)} new posts with keyword: {keyword}")
-                for post in posts:
-                    post_abstract = post['blurb'][:250] + "..." if len(post['blurb']) > 250 else post['blurb']
-                    post_link = f"{self.discourse_url}/t/{post['topic_id']}/{post['post_number']}"
-                    formatted_message = f"🔍 <strong>Discourse ({self.discourse_url}, {keyword})</strong><br><strong>{post['username']}</strong> - {post_abstract}<br><a href='{post_link}'>Read more</a>"
-                    self.logger.debug(f"Sending post to Matrix room: {post_link}")
-    
-                    try:
-                        response = await self.client.room_send(
-                            self.matrix_room_id,
-                            "m.room.message",
-                            {
-                                "msgtype": "m.text",
-                                "format": "org.matrix.custom.html",
-                                "formatted_body": formatted_message,
-                                "body": f"{post['username']} - {post_abstract}\n{post_link}"
-                            }
-                        )
-                        #self.logger.debug(f"Matrix room_send response: {response}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to send message to Matrix room: {str(e)}")
-        else:
-            self.logger.error("Failed to fetch search results from Discourse.")
-    
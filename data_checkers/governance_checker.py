@@ -1,44 +1,72 @@
 from open_governance.open_governance import OpenGovernance2
-from data_checkers import DataChecker
+from data_checkers import DataChecker, FeedItem
 import markdown
 
 class GovernanceChecker(DataChecker):
-    def __init__(self, client, matrix_room_id, checker_config, logger, last_check):
-        super().__init__(client, matrix_room_id, checker_config, logger)
-        self.substrate_wss = checker_config["substrate_wss"]
-        self.network = checker_config["network"]
-        self.keywords = checker_config["keywords"]
-        self.last_check = last_check
-        self.open_governance = OpenGovernance2(self.substrate_wss, self.network, logger)
-
-    async def check_new_data(self):
+    checker_type = "governance"
+    required_settings = ("substrate_wss", "network")
+
+    def __init__(self, source_config, logger):
+        super().__init__(source_config, logger)
+        self.substrate_wss = source_config["substrate_wss"]
+        self.network = source_config["network"]
+        self.open_governance = OpenGovernance2(
+            self.substrate_wss,
+            self.network,
+            logger,
+            subsquare_url=source_config.get("subsquare_url"),
+            polkassembly_url=source_config.get("polkassembly_url", "https://api.polkassembly.io"),
+        )
+
+    @staticmethod
+    def sources(checker_config):
+        return [(f"governance:{checker_config['network']}", checker_config)]
+
+    async def fetch_new_items(self, last_check, min_marker=None):
+        items = []
+        async for page in self.iter_new_items(last_check, min_marker):
+            items.extend(page)
+        return items
+
+    async def iter_new_items(self, last_check, min_marker=None):
         self.logger.debug("Checking new data for GovernanceChecker")
-        new_referendums = self.open_governance.check_referendums(self.keywords, self.last_check)
-    
-        if new_referendums:
-            self.logger.debug(f"Found {len(new_referendums)} new referendums")
-            for index, referendum_info in new_referendums.items():
-                title = referendum_info["title"]
-                url = referendum_info["successful_url"]
-                matched_keyword = referendum_info["matched_keyword"]
-                content_blurb = referendum_info["content"][:250] + "..." if len(referendum_info["content"]) > 250 else referendum_info["content"]
-    
-                # Convert mixed content to HTML
-                content_blurb_html = markdown.markdown(content_blurb)
-    
-                plain_text_message = f"New Governance Referendum: {title}\nMatched keyword: {matched_keyword}\nContent: {content_blurb}\nReferendum ID: {index}\nURL: {url}"
-                html_message = f"<strong>New Governance Referendum:</strong> {title}<br>Matched keyword: {matched_keyword}<br>Content: {content_blurb_html}<br>Referendum ID: {index}<br>URL: {url}"
-    
-                await self.client.room_send(
-                    self.matrix_room_id,
-                    "m.room.message",
-                    {
-                        "msgtype": "m.text",
-                        "format": "org.matrix.custom.html",
-                        "formatted_body": html_message,
-                        "body": plain_text_message
-                    }
-                )
-                self.logger.debug(f"Posted new referendum message to Matrix room: {title} - {url}")
-        else:
-            self.logger.debug("No new referendums found")
+        async for referenda in self.open_governance.iter_new_referenda(
+                last_check, min_index=int(min_marker) if min_marker is not None else None):
+            yield self.to_items(referenda)
+
+    async def fetch_items_by_index(self, indexes):
+        """Fetch the referenda with the given indexes, as reported by a ReferendaSubscription."""
+        self.logger.debug(f"Checking submitted referendums {indexes} for GovernanceChecker")
+        return self.to_items(await self.open_governance.fetch_referenda(indexes))
+
+    def to_items(self, referenda):
+        return [
+            FeedItem(
+                item_id=referendum.index,
+                title=referendum.title or "",
+                text=referendum.content or "",
+                link=self.open_governance.referendum_url(referendum.index),
+                created_at=referendum.created_at,
+                marker=referendum.index,
+            )
+            for referendum in referenda
+        ]
+
+    def format_message(self, item, matched_keywords):
+        title = item.title
+        url = item.link
+        matched_keyword = ", ".join(matched_keywords)
+        content_blurb = item.text[:250] + "..." if len(item.text) > 250 else item.text
+
+        # Convert mixed content to HTML
+        content_blurb_html = markdown.markdown(content_blurb)
+
+        plain_text_message = f"New Governance Referendum: {title}\nMatched keyword: {matched_keyword}\nContent: {content_blurb}\nReferendum ID: {item.item_id}\nURL: {url}"
+        html_message = f"<strong>New Governance Referendum:</strong> {title}<br>Matched keyword: {matched_keyword}<br>Content: {content_blurb_html}<br>Referendum ID: {item.item_id}<br>URL: {url}"
+
+        return {
+            "msgtype": "m.text",
+            "format": "org.matrix.custom.html",
+            "formatted_body": html_message,
+            "body": plain_text_message
+        }
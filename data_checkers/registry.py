@@ -0,0 +1,43 @@
+# data_checkers/registry.py
+
+import importlib
+from collections.abc import Mapping
+from typing import Dict, Optional
+
+# The class of every checker type, as "module:class". A module is only imported once a configured source needs it,
+# so e.g. substrate-interface is never loaded by a bot that only watches Discourse forums.
+CHECKERS = {
+    "discourse": "data_checkers.discourse_checker:DiscourseChecker",
+    "governance": "data_checkers.governance_checker:GovernanceChecker",
+    "stackexchange": "data_checkers.stackexchange_checker:StackExchangeChecker",
+}
+
+
+class CheckerRegistry(Mapping):
+    """
+    Checker class by checker type, imported on first lookup.
+
+    A checker whose module fails to import, e.g. because an optional dependency is not
+    installed, is reported once and looked up as None, so only its sources are skipped.
+    """
+
+    def __init__(self, logger, checkers: Dict[str, str] = None):
+        self.logger = logger
+        self.checkers = dict(CHECKERS if checkers is None else checkers)
+        self._classes = {}
+
+    def __getitem__(self, checker_type: str) -> Optional[type]:
+        if checker_type not in self._classes:
+            module_name, class_name = self.checkers[checker_type].split(":")
+            try:
+                self._classes[checker_type] = getattr(importlib.import_module(module_name), class_name)
+            except (ImportError, AttributeError) as e:
+                self.logger.error(f"Checker type {checker_type} is unavailable, loading {self.checkers[checker_type]} failed: {str(e)}")
+                self._classes[checker_type] = None
+        return self._classes[checker_type]
+
+    def __iter__(self):
+        return iter(self.checkers)
+
+    def __len__(self) -> int:
+        return len(self.checkers)
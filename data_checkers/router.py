@@ -0,0 +1,288 @@
+# data_checkers/router.py
+
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from matrix.delivery import get_delivery_queue
+from utils import metrics
+from utils.matcher import KeywordMatcher, get_matcher, prune_matchers
+from utils.profiler import PROFILER
+from utils.seen_store import get_seen_store
+from utils.state import get_state_store
+
+ITEMS_FETCHED = metrics.counter("feed_items_fetched_total", "New items fetched from a source.", ["source"])
+ITEMS_MATCHED = metrics.counter("feed_items_matched_total", "New items that matched the keywords of at least one room.", ["source"])
+ITEMS_ROUTED = metrics.counter("feed_items_routed_total", "Messages queued for rooms, one per matching room and item.", ["source"])
+FETCH_DURATION = metrics.histogram("feed_fetch_duration_seconds", "Time to fetch the new items of a source.", ["source"])
+
+# Room id under which the seen-store keeps the high-water mark of everything routed from a source.
+ALL_ROOMS = "*"
+
+# Source config keys that only concern a subscription, changing them does not require a new checker.
+SUBSCRIPTION_KEYS = {"keywords", "whole_word", "mode", "check_interval", "timeout"}
+
+
+def checker_settings(source_config: Dict) -> Dict:
+    return {key: value for key, value in source_config.items() if key not in SUBSCRIPTION_KEYS}
+
+
+class Subscription:
+    """One room's interest in one source."""
+
+    __slots__ = ("user", "room_id", "checker_config", "source_config", "source_key", "matcher")
+
+    def __init__(self, user, checker_config, source_key, source_config):
+        self.user = user
+        self.room_id = user["matrix_room_id"]
+        self.checker_config = checker_config
+        # The forum stanza for Discourse, the checker stanza itself otherwise.
+        self.source_config = source_config
+        self.source_key = source_key
+        self.matcher = None
+        self.refresh()
+
+    @property
+    def keywords(self) -> List[str]:
+        return self.source_config["keywords"]
+
+    @property
+    def matcher_key(self) -> Tuple[str, str, str]:
+        return (self.user["name"], self.room_id, self.source_key)
+
+    @property
+    def whole_word(self) -> bool:
+        return self.source_config.get("whole_word", self.checker_config.get("whole_word", False))
+
+    def refresh(self) -> None:
+        """Pick up keywords changed in the config, e.g. by !set_keywords."""
+        self.matcher = get_matcher(self.matcher_key, self.keywords, whole_word=self.whole_word)
+
+
+class SourceFeed:
+    """
+    A source polled once per cycle on behalf of all its subscriptions.
+
+    Keeps an inverted index from every keyword to the subscriptions that use it, and one
+    matcher over the union of all their keywords, so each item is scanned once however
+    many rooms subscribe to the source.
+    """
+
+    def __init__(self, key: str, checker, checker_type: str):
+        self.key = key
+        self.checker = checker
+        self.checker_type = checker_type
+        self.subscriptions: List[Subscription] = []
+        self.keyword_index: Dict[str, List[Subscription]] = {}
+        self.matcher = KeywordMatcher([])
+        self._indexed_keywords = None
+
+    @property
+    def push_mode(self) -> bool:
+        """Whether a subscriber asked for new governance referenda to be pushed from chain events instead of polled."""
+        return self.checker_type == "governance" and any(
+            subscription.checker_config.get("mode") == "subscribe" for subscription in self.subscriptions)
+
+    def add(self, subscription: Subscription) -> None:
+        self.subscriptions.append(subscription)
+        self._indexed_keywords = None
+
+    def refresh_index(self) -> None:
+        for subscription in self.subscriptions:
+            subscription.refresh()
+        keywords = [tuple(subscription.keywords) for subscription in self.subscriptions]
+        if keywords == self._indexed_keywords:
+            return
+        self.keyword_index = {}
+        for subscription in self.subscriptions:
+            for keyword in dict.fromkeys(subscription.keywords):
+                self.keyword_index.setdefault(keyword, []).append(subscription)
+        self.matcher.update(list(self.keyword_index))
+        self._indexed_keywords = keywords
+
+    def route(self, item) -> Dict[str, List[str]]:
+        """
+        Match an item against every subscription at once.
+
+        Returns:
+            Dict: The matched keywords by room id, for every room the item should go to.
+        """
+        text = f"{item.title}\n{item.text}"
+        candidates = self.matcher.find_all(text)
+        routes = {}
+        checked = set()
+        for keyword in candidates:
+            for subscription in self.keyword_index[keyword]:
+                if id(subscription) in checked:
+                    continue
+                checked.add(id(subscription))
+                if subscription.whole_word:
+                    # The shared matcher matches substrings; confirm with the subscription's own rules.
+                    matched = subscription.matcher.find_all(text)
+                else:
+                    matched = [k for k in dict.fromkeys(subscription.keywords) if k in candidates]
+                if matched:
+                    room_keywords = routes.setdefault(subscription.room_id, [])
+                    room_keywords.extend(k for k in matched if k not in room_keywords)
+        return routes
+
+
+class SubscriptionRouter:
+    """
+    Routes new items of every configured source to the rooms subscribed to them.
+
+    The subscriptions of all users are grouped by source, so each Discourse forum, Stack
+    Exchange site and governance network is fetched once per cycle no matter how many
+    users watch it, and each fetched item is matched against all of them in one pass.
+    """
+
+    def __init__(self, config, checker_classes, logger, delivery=None, source_filter=None):
+        """
+        Args:
+            config (Dict): The bot configuration.
+            checker_classes (Dict): Checker class by checker type.
+            logger: The logger to report to.
+            delivery (optional): Where matched items are queued. Defaults to the process-wide DeliveryQueue.
+            source_filter (Callable, optional): Only sources whose key it accepts are set up, e.g. those of one shard.
+        """
+        self.logger = logger
+        self.checker_classes = checker_classes
+        self.source_filter = source_filter
+        self.delivery = delivery if delivery is not None else get_delivery_queue()
+        self.seen = get_seen_store()
+        self.state = get_state_store()
+        self.feeds: Dict[str, SourceFeed] = {}
+        self.update(config)
+
+    def update(self, config) -> Tuple[List[str], List[str]]:
+        """
+        Rebuild the subscriptions from a new config.
+
+        A source whose checker settings did not change keeps its checker and keyword matcher,
+        so its pooled connections, caches and cursors stay live; only its subscriptions are
+        replaced, and the matchers of those whose keywords changed are updated.
+
+        Args:
+            config (Dict): The bot configuration.
+
+        Returns:
+            Tuple[List[str], List[str]]: The keys of the sources that got a new checker, and of those no longer configured.
+        """
+        feeds: Dict[str, SourceFeed] = {}
+        created = []
+        for user in config["users"]:
+            for checker_config in user["checkers"]:
+                checker_type = checker_config.get("checker_type")
+                checker_class = self.checker_classes.get(checker_type)
+                if checker_class is None:
+                    self.logger.error(f"Skipping a checker of user {user['name']}: unknown or unavailable checker_type {checker_type}")
+                    continue
+                try:
+                    sources = checker_class.sources(checker_config)
+                except (KeyError, TypeError) as e:
+                    self.logger.error(f"Skipping the {checker_type} checker of user {user['name']}: missing setting {str(e)}")
+                    continue
+                for source_key, source_config in sources:
+                    if self.source_filter is not None and not self.source_filter(source_key):
+                        continue
+                    try:
+                        prepared = checker_class.prepare(source_config)
+                        subscription = Subscription(user, checker_config, source_key, source_config)
+                        if source_key not in feeds:
+                            feeds[source_key] = self._feed(source_key, checker_class, prepared, created)
+                    except Exception as e:
+                        # A bad stanza only disables its own subscription; another subscriber's stanza may still set up the source.
+                        self.logger.error(f"Skipping source {source_key} of user {user['name']}: {str(e)}")
+                        continue
+                    feeds[source_key].add(subscription)
+
+        removed = [source_key for source_key in self.feeds if source_key not in feeds]
+        # Checks already running keep the feed they started with.
+        self.feeds = feeds
+        prune_matchers(subscription.matcher_key for feed in feeds.values() for subscription in feed.subscriptions)
+        return created, removed
+
+    def _feed(self, source_key: str, checker_class, source_config, created: List[str]) -> SourceFeed:
+        """Return the feed of a source, reusing the current checker if its settings did not change."""
+        current = self.feeds.get(source_key)
+        if current is not None and current.checker_type == checker_class.checker_type and \
+                checker_settings(current.checker.source_config) == checker_settings(source_config):
+            feed = SourceFeed(source_key, current.checker, checker_class.checker_type)
+            feed.matcher = current.matcher
+            return feed
+        created.append(source_key)
+        return SourceFeed(source_key, checker_class(source_config, self.logger), checker_class.checker_type)
+
+    def legacy_cursor_keys(self, feed: SourceFeed) -> List[str]:
+        """Keys under which per-user cursors of this source were stored before sources were shared."""
+        keys = []
+        for subscription in feed.subscriptions:
+            user_name = subscription.user["name"]
+            forum_name = subscription.source_config.get("name")
+            if feed.checker_type == "discourse" and forum_name is not None:
+                keys.append(f"{user_name}_{feed.checker_type}_{forum_name}")
+            keys.append(f"{user_name}_{feed.checker_type}")
+        return keys
+
+    async def check_source(self, source_key: str) -> None:
+        """Fetch the new items of one source once and deliver them to every matching room."""
+        feed = self.feeds[source_key]
+        started = datetime.now()
+        last_check = self.state.get_last_check(f"source_{source_key}", fallback_keys=self.legacy_cursor_keys(feed))
+
+        # Every item up to this mark was already routed to all subscribers, so the source may stop reading there.
+        min_marker = self.seen.high_water(ALL_ROOMS, source_key)
+
+        # Route every batch as soon as it arrives, but only raise the high-water mark once the whole
+        # scan succeeded, so a failed scan is resumed from the same point.
+        max_marker = None
+        try:
+            with FETCH_DURATION.time(source=source_key):
+                async for items in PROFILER.iterate(f"fetch {source_key}", feed.checker.iter_new_items(last_check, min_marker)):
+                    with PROFILER.span(f"route {source_key}"):
+                        batch_marker = self.route(feed, items)
+                    if batch_marker is not None and (max_marker is None or batch_marker > max_marker):
+                        max_marker = batch_marker
+        finally:
+            PROFILER.source_checked(source_key)
+        if max_marker is not None:
+            self.seen.advance_high_water(ALL_ROOMS, feed.key, max_marker)
+        # Use the start of the run so that items created while it was running are picked up next time.
+        self.state.set_last_check(f"source_{source_key}", started)
+
+    async def check_indexes(self, source_key: str, indexes) -> None:
+        """Deliver the referenda with the given indexes, as reported by a ReferendaSubscription."""
+        feed = self.feeds.get(source_key)
+        if feed is None:
+            # The source was removed from the config since the referenda were reported.
+            return
+        items = await feed.checker.fetch_items_by_index(indexes)
+        await self.deliver(feed, items)
+
+    async def deliver(self, feed: SourceFeed, items) -> None:
+        max_marker = self.route(feed, items)
+        if max_marker is not None:
+            self.seen.advance_high_water(ALL_ROOMS, feed.key, max_marker)
+
+    def route(self, feed: SourceFeed, items) -> Optional[float]:
+        """
+        Queue messages for every room the items match.
+
+        Returns:
+            float: The largest marker of the items, or None if they have none.
+        """
+        feed.refresh_index()
+        ITEMS_FETCHED.inc(len(items), source=feed.key)
+        for item in items:
+            routes = feed.route(item)
+            if routes:
+                ITEMS_MATCHED.inc(source=feed.key)
+            for room_id, matched_keywords in routes.items():
+                if self.seen.is_seen(room_id, feed.key, item.item_id):
+                    continue
+                self.logger.debug(f"Queueing {item.link} for Matrix room {room_id}")
+                ITEMS_ROUTED.inc(source=feed.key)
+                self.delivery.enqueue(room_id, feed.key, item.item_id, feed.checker.format_message(item, matched_keywords), marker=item.marker)
+
+        # Queued messages are kept in the outbox until delivered, so the source may move past them.
+        markers = [item.marker for item in items if item.marker is not None]
+        return max(markers) if markers else None
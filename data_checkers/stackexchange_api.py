@@ -0,0 +1,174 @@
+# data_checkers/stackexchange_api.py
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from utils import metrics
+from utils.http_client import get_http_client
+
+API_URL = "https://api.stackexchange.com/2.3"
+# Questions per page, the most the API allows.
+PAGE_SIZE = 100
+
+# Only the fields a question message is built from, plus the wrapper fields used for paging and throttling.
+WRAPPER_FIELDS = [".backoff", ".has_more", ".items", ".quota_max", ".quota_remaining"]
+QUESTION_FIELDS = ["question.question_id", "question.title", "question.link", "question.creation_date",
+                   "question.tags", "question.owner", "shallow_user.display_name"]
+
+
+QUOTA_REMAINING = metrics.gauge("stackexchange_quota_remaining", "Stack Exchange API requests left today, as last reported by the API.", ["api_key"])
+BACKOFFS = metrics.counter("stackexchange_backoffs_total", "Backoffs requested by the Stack Exchange API.", ["site"])
+
+
+class QuotaExhausted(Exception):
+    pass
+
+
+class StackExchangeClient:
+    """
+    Stack Exchange API client shared by every site polled with the same API key.
+
+    The API allows a fixed number of requests per key per UTC day. The client keeps
+    track of the `quota_remaining` reported by every response, and of the requests it
+    made itself today when a `daily_budget` is configured, and refuses to send more once
+    either is used up. The `backoff` a response asks for is honored per site and method
+    before the next request to them.
+    """
+
+    def __init__(self, api_key: str, logger, daily_budget: Optional[int] = None, quota_reserve: int = 100, api_url: str = API_URL):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.logger = logger
+        self.daily_budget = daily_budget
+        self.quota_reserve = quota_reserve
+        self.http = get_http_client()
+        self.quota_remaining: Optional[int] = None
+        self.requests_today = 0
+        self._day = self._today()
+        self._backoff_until: Dict[str, float] = {}
+        self._filters: Dict[bool, str] = {}
+
+    @staticmethod
+    def _today():
+        return datetime.now(timezone.utc).date()
+
+    def _check_quota(self) -> None:
+        if self._today() != self._day:
+            self._day = self._today()
+            self.requests_today = 0
+            self.quota_remaining = None
+        if self.quota_remaining is not None and self.quota_remaining <= self.quota_reserve:
+            raise QuotaExhausted(f"Stack Exchange quota nearly used up ({self.quota_remaining} requests left today)")
+        if self.daily_budget is not None and self.requests_today >= self.daily_budget:
+            raise QuotaExhausted(f"Stack Exchange daily budget of {self.daily_budget} requests used up")
+
+    async def get(self, method: str, params: Dict, site: Optional[str] = None) -> Dict:
+        """
+        Call an API method, waiting out any backoff and counting it against the quota.
+
+        Args:
+            method (str): The method path, e.g. "questions".
+            params (Dict): Query string parameters, without the key.
+            site (str, optional): The site the method is called on.
+
+        Returns:
+            Dict: The decoded response wrapper.
+
+        Raises:
+            QuotaExhausted: If the daily quota or budget is used up.
+        """
+        self._check_quota()
+        backoff_key = f"{site}/{method}"
+        delay = self._backoff_until.get(backoff_key, 0) - time.monotonic()
+        if delay > 0:
+            self.logger.debug(f"Backing off {delay:.0f}s before calling {method} on {site}")
+            await asyncio.sleep(delay)
+
+        params = dict(params, key=self.api_key)
+        if site is not None:
+            params["site"] = site
+        self.requests_today += 1
+        # Quota accounting relies on seeing every response, so never reuse a cached one.
+        response = await self.http.get_json(f"{self.api_url}/{method}", params=params, cache_ttl=0)
+        if response.status != 200:
+            self.logger.error(f"Stack Exchange {method} failed: {response.data}")
+            response.raise_for_status()
+
+        data = response.data
+        if "quota_remaining" in data:
+            self.quota_remaining = data["quota_remaining"]
+            # Only expose the end of the key.
+            QUOTA_REMAINING.set(self.quota_remaining, api_key=f"...{self.api_key[-4:]}")
+        if data.get("backoff"):
+            self.logger.info(f"Stack Exchange asked to back off {method} on {site} for {data['backoff']}s")
+            self._backoff_until[backoff_key] = time.monotonic() + data["backoff"]
+            BACKOFFS.inc(site=str(site))
+        return data
+
+    async def question_filter(self, with_body: bool) -> str:
+        """Return the id of a filter that only includes the question fields we use, creating it on first use."""
+        if with_body not in self._filters:
+            include = WRAPPER_FIELDS + QUESTION_FIELDS + (["question.body_markdown"] if with_body else [])
+            data = await self.get("filters/create", {"include": ";".join(include), "base": "none", "unsafe": "false"})
+            self._filters[with_body] = data["items"][0]["filter"]
+            self.logger.info(f"Created Stack Exchange filter {self._filters[with_body]}")
+        return self._filters[with_body]
+
+    async def new_questions(self, site: str, fromdate: int, with_body: bool = True, max_pages: int = 10,
+                            todate: Optional[int] = None) -> Tuple[List[Dict], bool]:
+        """
+        Return the questions created on a site since `fromdate`, newest first.
+
+        Args:
+            site (str): The site name, e.g. "stackoverflow".
+            fromdate (int): Unix timestamp of the oldest question to return.
+            with_body (bool, optional): Whether to download question bodies for keyword matching.
+            max_pages (int, optional): The maximum number of pages of 100 questions to read.
+            todate (int, optional): Unix timestamp of the newest question to return.
+
+        Returns:
+            Tuple[List[Dict], bool]: The questions, and whether all of them were read before `max_pages` ran out.
+        """
+        params = {
+            "sort": "creation",
+            "order": "desc",
+            "fromdate": fromdate,
+            "pagesize": PAGE_SIZE,
+            "filter": await self.question_filter(with_body),
+        }
+        if todate is not None:
+            params["todate"] = todate
+        questions = []
+        for page in range(1, max_pages + 1):
+            data = await self.get("questions", dict(params, page=page), site=site)
+            questions.extend(data.get("items", []))
+            if not data.get("has_more"):
+                return questions, True
+        return questions, False
+
+
+_clients: Dict[tuple, StackExchangeClient] = {}
+
+
+def get_stackexchange_client(api_key: str, logger, daily_budget: Optional[int] = None, quota_reserve: int = 100,
+                             api_url: str = API_URL) -> StackExchangeClient:
+    """
+    Return the client for an API key, so that every site polled with it shares one quota.
+
+    The quota settings belong to the key, so every stanza using it should set the same
+    `daily_budget` and `quota_reserve`. If one differs, a warning is logged and the client
+    takes the settings of the checker created last, e.g. after the config was changed.
+    """
+    key = (api_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = StackExchangeClient(api_key, logger, daily_budget=daily_budget, quota_reserve=quota_reserve, api_url=api_url)
+    elif (client.daily_budget, client.quota_reserve) != (daily_budget, quota_reserve):
+        logger.warning(
+            f"Stack Exchange sites polled with the same API key share its quota, but their settings differ: "
+            f"changing daily_budget from {client.daily_budget} to {daily_budget} and quota_reserve from {client.quota_reserve} to {quota_reserve}")
+        client.daily_budget = daily_budget
+        client.quota_reserve = quota_reserve
+    return client
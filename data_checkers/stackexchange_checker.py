@@ -1,59 +1,101 @@
 # stack_exchange_checker.py
-import requests
-from data_checkers import DataChecker
+import html
+from datetime import datetime
+from data_checkers import DataChecker, FeedItem, resolve_secret
+from data_checkers.stackexchange_api import API_URL, PAGE_SIZE, get_stackexchange_client
+from utils.utils import strip_html
 
 class StackExchangeChecker(DataChecker):
-    def __init__(self, client, matrix_room_id, checker_config, logger, last_check):
-        super().__init__(client, matrix_room_id, checker_config, logger)
-        self.stack_exchange_site = checker_config["stack_exchange_site"]
-        self.stack_exchange_api_key = checker_config["stack_exchange_api_key"]
-        self.keywords = checker_config["keywords"]
-        self.last_check = last_check
-
-    async def check_new_data(self):
-        self.logger.debug("Checking new data for StackExchangeChecker")
-        for keyword in self.keywords:
-            await self.search_stack_exchange_posts(keyword)
-
-    async def search_stack_exchange_posts(self, keyword):
-        self.logger.debug(f"Searching {self.stack_exchange_site} posts for keyword: {keyword}")
-        url = f"https://api.stackexchange.com/2.3/search/advanced"
-        params = {
-            "key": self.stack_exchange_api_key,
-            "site": self.stack_exchange_site,
-            "sort": "creation",
-            "q": keyword,
-            "fromdate": int(self.last_check.timestamp()),
-            "filter": "withbody"
-        }
+    checker_type = "stackexchange"
+    required_settings = ("stack_exchange_site",)
+
+    def __init__(self, source_config, logger):
+        super().__init__(source_config, logger)
+        self.stack_exchange_site = source_config["stack_exchange_site"]
+        self.stack_exchange_api_key = source_config["stack_exchange_api_key"]
+        self.match_body = source_config.get("match_body", True)
+        self.max_pages = source_config.get("max_pages", 10)
+        # The (fromdate, todate) range of questions a check cut short by max_pages did not read yet.
+        self._gap = None
+        self.api = get_stackexchange_client(
+            self.stack_exchange_api_key,
+            logger,
+            daily_budget=source_config.get("daily_budget"),
+            quota_reserve=source_config.get("quota_reserve", 100),
+            api_url=source_config.get("stack_exchange_api_url", API_URL),
+        )
+
+    @classmethod
+    def prepare(cls, source_config):
+        return resolve_secret(super().prepare(source_config), "stack_exchange_api_key", "stack_exchange_api_key_env",
+                              default_env="STACK_EXCHANGE_API_KEY")
+
+    @staticmethod
+    def sources(checker_config):
+        return [(f"stackexchange:{checker_config['stack_exchange_site']}", checker_config)]
 
-        response = requests.get(url, params=params)
-        if response.status_code == 200:
-            results = response.json()
-            posts = results["items"]
-
-            if posts:
-                self.logger.debug(f"Found {len(posts)} new posts with keyword: {keyword}")
-                for post in posts:
-                    post_abstract = post['title'][:250] + "..." if len(post['title']) > 250 else post['title']
-                    post_link = post['link']
-                    formatted_message = f"🔍 <strong>Stack Exchange ({keyword})</strong><br><strong>{post['owner']['display_name']}</strong> - {post_abstract}<br><a href='{post_link}'>Read more</a>"
-                    self.logger.debug(f"Sending SE post to Matrix room: {post_link}")
-
-                    try:
-                        response = await self.client.room_send(
-                            self.matrix_room_id,
-                            "m.room.message",
-                            {
-                                "msgtype": "m.text",
-                                "format": "org.matrix.custom.html",
-                                "formatted_body": formatted_message,
-                                "body": f"{post['owner']['display_name']} - {post_abstract}\n{post_link}"
-                            }
-                        )
-                        #self.logger.debug(f"Matrix room_send response: {response}")
-                    except Exception as e:
-                        self.logger.error(f"Failed to send message to Matrix room: {str(e)}")
-        else:
-            self.logger.error("Failed to fetch search results from Stack Exchange.")
+    async def fetch_new_items(self, last_check, min_marker=None):
+        """
+        Return the questions created since `last_check`.
 
+        The router moves the source's last check forward after every check, so the questions a
+        check leaves unread because `max_pages` ran out are remembered and read by the next
+        checks, after the questions created in the meantime.
+        """
+        self.logger.debug(f"Fetching newest questions of {self.stack_exchange_site}")
+        fromdate = int(last_check.timestamp())
+        gap = self._gap
+        questions, complete = await self.api.new_questions(
+            self.stack_exchange_site,
+            fromdate,
+            with_body=self.match_body,
+            max_pages=self.max_pages,
+        )
+        if not complete:
+            gap = (gap[0] if gap is not None else fromdate, self._oldest(questions))
+        elif gap is not None:
+            pages = max(1, -(-len(questions) // PAGE_SIZE))
+            older, complete = await self.api.new_questions(
+                self.stack_exchange_site,
+                gap[0],
+                with_body=self.match_body,
+                max_pages=self.max_pages - pages,
+                todate=gap[1],
+            )
+            questions += older
+            gap = (gap[0], self._oldest(older) if older else gap[1])
+        self._gap = None if complete else gap
+        if not complete:
+            self.logger.warning(f"Stopped paging questions of {self.stack_exchange_site} after {self.max_pages} pages, "
+                                f"continuing with the questions created before {gap[1]} with the next check")
+
+        items = []
+        for question in questions:
+            text = [strip_html(question.get("body_markdown"))] if self.match_body else []
+            items.append(FeedItem(
+                item_id=question["question_id"],
+                title=strip_html(question["title"]),
+                text=" ".join(text + question.get("tags", [])),
+                link=question["link"],
+                author=strip_html(question.get("owner", {}).get("display_name")),
+                created_at=datetime.fromtimestamp(question["creation_date"]),
+            ))
+        self.logger.debug(f"Found {len(items)} new questions on {self.stack_exchange_site}, {self.api.quota_remaining} requests left today")
+        return items
+
+    @staticmethod
+    def _oldest(questions):
+        # todate is inclusive, so questions created in the same second as the oldest one are not skipped.
+        return questions[-1]["creation_date"]
+
+    def format_message(self, item, matched_keywords):
+        post_abstract = item.title[:250] + "..." if len(item.title) > 250 else item.title
+        # The title is unescaped by strip_html, so it has to be escaped again for the HTML body.
+        formatted_message = (f"🔍 <strong>Stack Exchange ({html.escape(', '.join(matched_keywords))})</strong><br>"
+                             f"<strong>{html.escape(item.author)}</strong> - {html.escape(post_abstract)}<br><a href='{html.escape(item.link)}'>Read more</a>")
+        return {
+            "msgtype": "m.text",
+            "format": "org.matrix.custom.html",
+            "formatted_body": formatted_message,
+            "body": f"{item.author} - {post_abstract}\n{item.link}"
+        }
@@ -1,76 +1,292 @@
+import argparse
 import asyncio
+import functools
+import multiprocessing
 import os
-from matrix.matrix_client import setup_matrix_client, handle_set_keywords
-from data_checkers.discourse_checker import DiscourseChecker
-from data_checkers.governance_checker import GovernanceChecker
-from data_checkers.stackexchange_checker import StackExchangeChecker
-from utils.utils import load_config, read_last_check, write_last_check
+import secrets
+import signal
+from matrix.matrix_client import setup_matrix_client, send_text, sync_forever
+from data_checkers.registry import CheckerRegistry
+from data_checkers.router import SubscriptionRouter
+from matrix.delivery import Outbox, setup_delivery_queue
+from utils.config_store import setup_config_store
+from utils.http_client import setup_http_client
+from utils.scheduler import PollScheduler
+from utils.metrics import setup_metrics_server
+from utils.profiler import PROFILER, setup_profiler
+from utils.sharding import HashRing, RemoteDelivery, ShardCoordinator
+from utils.seen_store import setup_seen_store
+from utils.state import setup_state_store
+from open_governance.substrate_pool import setup_substrate_pool
+from open_governance.referenda_events import ReferendaSubscription
+from open_governance.enrichment import setup_referendum_enricher
 from log.logger_setup import setup_logger
 
 logger = setup_logger()
 
-config = load_config()
+config_store = setup_config_store(logger)
+# The settings read at startup. Only the users and their checkers are applied on reload, see start_sources().
+config = config_store.config
 
-# Update the main config with the sensitive data from environment variables
-config["access_token"] = os.environ["MATRIX_ACCESS_TOKEN"]
-
-for user in config["users"]:
-    for checker in user["checkers"]:
-        if checker["checker_type"] == "discourse":
-            for forum in checker["forums"]:
-                api_key_env = forum["discourse_api_key_env"]
-                forum["discourse_api_key"] = os.environ[api_key_env]
-        elif checker["checker_type"] == "stackexchange":
-            checker["stack_exchange_api_key"] = os.environ["STACK_EXCHANGE_API_KEY"]
-
-checker_classes = {
-    "discourse": DiscourseChecker,
-    "governance": GovernanceChecker,
-    "stackexchange": StackExchangeChecker,
-}
+# Checker modules and their dependencies are only imported for the checker types that are configured.
+checker_classes = CheckerRegistry(logger)
 
 async def main():
     global client
-    client = await setup_matrix_client(config)
+    if "access_token" not in config:
+        logger.error("No Matrix access token, set MATRIX_ACCESS_TOKEN or access_token in the config")
+        return
+    sharding = config.get("sharding")
+    conflicts = sharding_port_conflicts(sharding) if sharding else []
+    if conflicts:
+        logger.error(f"Shard workers would serve their metrics on ports already in use ({conflicts}), set worker_base_port in the metrics config")
+        return
+    http_client = setup_http_client(config, logger)
+    seen_store = setup_seen_store(config, logger)
+    state = setup_state_store(config, logger)
+    substrate_pool = setup_substrate_pool(config, logger)
+    setup_referendum_enricher(config, logger)
+    setup_profiler(config, logger)
+    client = await setup_matrix_client(config, logger)
     logger.info("Bot started and connected to Matrix homeserver")
+    admin_room_id = config.get("profiling", {}).get("admin_room_id")
+    install_profile_signal(functools.partial(send_text, admin_room_id) if admin_room_id else None)
+
+    delivery = setup_delivery_queue(config, client, logger)
+    delivery.start()
+
+    scheduler, subscriptions, coordinator, workers = None, {}, None, []
+    if sharding:
+        # Sources are polled by the shard workers; this process only owns the Matrix connection.
+        coordinator = ShardCoordinator(
+            delivery,
+            logger,
+            host=sharding.get("coordinator_host", "127.0.0.1"),
+            port=sharding.get("coordinator_port", 9110),
+            auth_token=shard_auth_token(sharding, create=True),
+        )
+        await coordinator.start()
+        workers = start_local_workers(sharding)
+    else:
+        router = SubscriptionRouter(config, checker_classes, logger)
+        scheduler, subscriptions = start_sources(router)
+
+    asyncio.create_task(state.run())
+    # With sharding, every worker watches the config file itself.
+    asyncio.create_task(config_store.run())
+    metrics_server = setup_metrics_server(config, logger)
+    if metrics_server is not None:
+        await metrics_server.start()
+
+    try:
+        # Keep the bot synchronized with the Matrix homeserver
+        await sync_forever(client, timeout=30000)  # Synchronize every 30 seconds
+    finally:
+        if scheduler is not None:
+            scheduler.stop()
+        for subscription in subscriptions.values():
+            subscription.stop()
+        if coordinator is not None:
+            await coordinator.stop()
+        for worker in workers:
+            worker.terminate()
+        delivery.stop()
+        delivery.outbox.close()
+        state.flush()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await http_client.close()
+        seen_store.close()
+        substrate_pool.close()
+
+async def worker_main(shard):
+    sharding = config["sharding"]
+    shard_count = sharding["shards"]
+    ring = HashRing(range(shard_count))
+
+    http_client = setup_http_client(config, logger)
+    seen_store = setup_seen_store(config, logger)
+    state = setup_state_store(shard_config(shard, "state"), logger)
+    substrate_pool = setup_substrate_pool(config, logger)
+    setup_referendum_enricher(config, logger)
+    setup_profiler(config, logger)
+    # Results are written to disk and logged, workers have no Matrix connection to post them.
+    install_profile_signal()
+
+    # Messages wait in the shard's own outbox until the coordinator acknowledged them.
+    outbox = Outbox(shard_config(shard, "delivery")["delivery"].get("outbox_path", "data/outbox.db"))
+    delivery = RemoteDelivery(
+        logger,
+        shard,
+        outbox,
+        host=sharding.get("coordinator_host", "127.0.0.1"),
+        port=sharding.get("coordinator_port", 9110),
+        auth_token=shard_auth_token(sharding),
+    )
+    router = SubscriptionRouter(config, checker_classes, logger, delivery=delivery,
+                                source_filter=lambda source_key: ring.shard_for(source_key) == shard)
+    logger.info(f"Shard {shard} of {shard_count} started with {len(router.feeds)} sources")
+    scheduler, subscriptions = start_sources(router)
+
+    asyncio.create_task(state.run())
+    asyncio.create_task(config_store.run())
+    metrics_server = setup_metrics_server(shard_config(shard, "metrics"), logger)
+    if metrics_server is not None:
+        await metrics_server.start()
+
+    try:
+        await delivery.run()
+    finally:
+        scheduler.stop()
+        for subscription in subscriptions.values():
+            subscription.stop()
+        outbox.close()
+        state.flush()
+        if metrics_server is not None:
+            await metrics_server.stop()
+        await http_client.close()
+        seen_store.close()
+        substrate_pool.close()
+
+def run_worker(shard):
+    asyncio.run(worker_main(shard))
+
+def start_local_workers(sharding):
+    # Spawn rather than fork, the event loop of this process is already running.
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for shard in sharding.get("local_shards", range(sharding["shards"])):
+        worker = context.Process(target=run_worker, args=(shard,), name=f"shard-{shard}", daemon=True)
+        worker.start()
+        workers.append(worker)
+    return workers
+
+def shard_auth_token(sharding, create=False):
+    env_name = sharding.get("auth_token_env", "SHARD_AUTH_TOKEN")
+    if env_name not in os.environ:
+        if not create:
+            raise RuntimeError(f"Shard workers need the coordinator's auth token in ${env_name}")
+        # Inherited by the local workers.
+        os.environ[env_name] = secrets.token_hex(16)
+    return os.environ[env_name]
+
+def shard_config(shard, section):
+    """Return the config with the given section adjusted for one shard worker."""
+    settings = dict(config.get(section, {}))
+    if section == "state":
+        path = settings.get("path", "data/last_check.json")
+        root, ext = os.path.splitext(path)
+        settings["path"] = f"{root}.shard{shard}{ext}"
+        settings["fallback_path"] = path
+    elif section == "delivery":
+        root, ext = os.path.splitext(settings.get("outbox_path", "data/outbox.db"))
+        settings["outbox_path"] = f"{root}.shard{shard}{ext}"
+    elif section == "metrics":
+        settings["port"] = worker_metrics_port(shard)
+    return dict(config, **{section: settings})
+
+def worker_metrics_port(shard):
+    settings = config.get("metrics", {})
+    return settings.get("worker_base_port", settings.get("port", 9108) + 100) + shard
+
+def sharding_port_conflicts(sharding):
+    """Return the ports the coordinator and the workers on this host would both try to listen on."""
+    ports = {sharding.get("coordinator_port", 9110)}
+    conflicts = []
+    if config.get("metrics", {}).get("enabled", False):
+        ports.add(config["metrics"].get("port", 9108))
+        for shard in sharding.get("local_shards", range(sharding["shards"])):
+            port = worker_metrics_port(shard)
+            if port in ports:
+                conflicts.append(port)
+    return conflicts
+
+def install_profile_signal(on_done=None):
+    """Profile the next poll cycles on SIGUSR1, see the "profiling" config."""
+    if not hasattr(signal, "SIGUSR1"):
+        return
+
+    def on_signal():
+        if not PROFILER.start(config.get("profiling", {}).get("cycles", 1), on_done=on_done):
+            logger.warning("Ignoring SIGUSR1: a profiling session is already running or no sources are polled by this process")
+
+    asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_signal)
+
+def start_sources(router):
+    """
+    Start the poll jobs and referenda subscriptions of the router's sources, and keep them in
+    sync with the config as it is reloaded.
+
+    Returns:
+        Tuple: The PollScheduler, and the ReferendaSubscription by source key.
+    """
+    scheduler = PollScheduler(
+        logger,
+        max_parallel=config.get("max_parallel_jobs", 4),
+        jitter=config.get("schedule_jitter", 0.1),
+        default_timeout=config.get("job_timeout"),
+    )
+    subscriptions = {}
+    sync_sources(router, scheduler, subscriptions, config)
+    PROFILER.source_keys = lambda: [source_key for source_key, feed in router.feeds.items() if not feed.push_mode]
+    asyncio.create_task(scheduler.run())
+
+    async def on_config_change(new_config):
+        created, removed = router.update(new_config)
+        sync_sources(router, scheduler, subscriptions, new_config, restarted=created)
+        logger.info(f"Applied the new config: {len(created)} sources (re)created, {len(removed)} removed, {len(router.feeds)} in total")
+
+    config_store.add_listener(on_config_change)
+    return scheduler, subscriptions
+
+def sync_sources(router, scheduler, subscriptions, config, restarted=()):
+    """
+    Bring the poll jobs and referenda subscriptions in line with the router's sources.
+
+    Jobs and subscriptions whose settings did not change are left running. The jobs look their
+    feed up on every run, so they also pick up a feed whose checker was replaced.
+
+    Args:
+        router (SubscriptionRouter): The router, already updated to the config.
+        scheduler (PollScheduler): The scheduler running the poll jobs.
+        subscriptions (Dict): The running ReferendaSubscription by source key, updated in place.
+        config (Dict): The bot configuration.
+        restarted (Iterable, optional): Keys of the sources with a new checker, whose subscriptions must be restarted.
+    """
+    scheduler.default_timeout = config.get("job_timeout")
+    for source_key in list(scheduler.jobs):
+        feed = router.feeds.get(source_key)
+        if feed is None or feed.push_mode:
+            scheduler.remove_job(source_key)
+    for source_key in list(subscriptions):
+        feed = router.feeds.get(source_key)
+        if feed is None or not feed.push_mode or source_key in restarted:
+            subscriptions.pop(source_key).stop()
+
+    for source_key, feed in router.feeds.items():
+        if feed.push_mode:
+            if source_key not in subscriptions:
+                subscription = ReferendaSubscription(feed.checker.open_governance, logger)
+                subscription.add_handler(functools.partial(router.check_indexes, source_key))
+                subscription.start()
+                subscriptions[source_key] = subscription
+            continue
+
+        # A source shared by several users is polled as often as its most demanding subscriber asks for.
+        checker_configs = [subscription.checker_config for subscription in feed.subscriptions]
+        interval = min(checker_config.get("check_interval", config["global_check_interval"]) for checker_config in checker_configs)
+        timeouts = [checker_config["timeout"] for checker_config in checker_configs if "timeout" in checker_config]
+        timeout = min(timeouts) if timeouts else scheduler.default_timeout
+        job = scheduler.jobs.get(source_key)
+        if job is None or job.interval != interval or job.timeout != timeout:
+            scheduler.add_job(source_key, interval, functools.partial(router.check_source, source_key), timeout=timeout)
 
-    # Run check_new_data() as a background task
-    asyncio.create_task(check_new_data())
-
-    # Keep the bot synchronized with the Matrix homeserver
-    await client.sync_forever(timeout=30000)  # Synchronize every 30 seconds
-
-async def check_new_data():
-    while True:
-        await asyncio.sleep(config["global_check_interval"])
-        logger.debug("Woke up from sleep, checking for new data")
-        try:
-            for user in config["users"]:
-                user_name = user["name"]
-                matrix_room_id = user["matrix_room_id"]
-                logger.debug(f"Checking data for user: {user_name}")
-                for checker_config in user["checkers"]:
-                    checker_type = checker_config["checker_type"]
-                    checker_class = checker_classes.get(checker_type)
-                    if checker_class:
-                        logger.debug(f"Running checker of type: {checker_type}")
-                        last_check = read_last_check(user_name, checker_type, logger)
-                        if checker_type == "discourse":
-                            for forum_config in checker_config["forums"]:
-                                checker = checker_class(client, matrix_room_id, forum_config, logger, last_check)
-                                await checker.check_new_data()
-                        elif checker_type == "governance":
-                            checker = checker_class(client, matrix_room_id, checker_config, logger, last_check)
-                            await checker.check_new_data()
-                        else:
-                            checker = checker_class(client, matrix_room_id, checker_config, logger, last_check)
-                            await checker.check_new_data()
-                        write_last_check(user_name, checker_type, logger)
-                    else:
-                        logger.error(f"Unknown checker_type: {checker_type}")
-        except Exception as e:
-            logger.error(f"Error while checking for new data: {str(e)}")
-    
 if __name__ == "__main__":
-    asyncio.get_event_loop().run_until_complete(main())
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--worker", type=int, metavar="SHARD", help="Run as the worker of this shard, see the \"sharding\" config")
+    args = parser.parse_args()
+    if args.worker is not None:
+        run_worker(args.worker)
+    else:
+        asyncio.get_event_loop().run_until_complete(main())
     
@@ -0,0 +1,275 @@
+# matrix/delivery.py
+
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from nio import RoomSendError
+
+from utils import metrics
+from utils.seen_store import get_seen_store
+
+SEND_DURATION = metrics.histogram("matrix_send_duration_seconds", "Latency of Matrix room_send requests.")
+SENDS = metrics.counter("matrix_sends_total", "Matrix room_send requests by outcome.", ["outcome"])
+MESSAGES_DELIVERED = metrics.counter("matrix_messages_delivered_total", "Alerts delivered, counting every alert of a digest.")
+QUEUE_DEPTH = metrics.gauge("matrix_delivery_queue_depth", "Alerts waiting in the outbox.")
+
+
+class OutboxMessage:
+    """A message waiting in the outbox for delivery to one room."""
+
+    __slots__ = ("row_id", "room_id", "source", "item_id", "content", "marker", "txn_id", "attempts")
+
+    def __init__(self, row_id, room_id, source, item_id, content, marker=None, txn_id=None, attempts=0):
+        self.row_id = row_id
+        self.room_id = room_id
+        self.source = source
+        self.item_id = item_id
+        self.content = content
+        self.marker = marker
+        # Sent as the Matrix transaction id, so a retried send is deduplicated by the homeserver.
+        self.txn_id = txn_id
+        self.attempts = attempts
+
+
+class Outbox:
+    """
+    On-disk queue of messages not yet delivered, so pending alerts survive a restart.
+
+    A message is written before it is queued and deleted once the homeserver accepted
+    it. The same item is only ever queued once per room.
+    """
+
+    def __init__(self, path: str = "data/outbox.db"):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, room_id TEXT NOT NULL, source TEXT NOT NULL, item_id TEXT NOT NULL, "
+            "content TEXT NOT NULL, marker REAL, txn_id TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+            "UNIQUE (room_id, source, item_id))"
+        )
+        self.db.commit()
+
+    def add(self, room_id: str, source: str, item_id, content: Dict, marker: Optional[float] = None) -> Optional[OutboxMessage]:
+        """Store a message, returning None if the item is already waiting for this room."""
+        txn_id = uuid.uuid4().hex
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO outbox (room_id, source, item_id, content, marker, txn_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (room_id, source, str(item_id), json.dumps(content), marker, txn_id, time.time()),
+        )
+        self.db.commit()
+        if cursor.rowcount == 0:
+            return None
+        return OutboxMessage(cursor.lastrowid, room_id, source, str(item_id), content, marker, txn_id)
+
+    def pending(self) -> List[OutboxMessage]:
+        rows = self.db.execute(
+            "SELECT id, room_id, source, item_id, content, marker, txn_id, attempts FROM outbox ORDER BY id"
+        ).fetchall()
+        return [OutboxMessage(row[0], row[1], row[2], row[3], json.loads(row[4]), row[5], row[6], row[7]) for row in rows]
+
+    def record_attempt(self, messages: List[OutboxMessage]) -> None:
+        for message in messages:
+            message.attempts += 1
+        self.db.executemany("UPDATE outbox SET attempts = ? WHERE id = ?", [(message.attempts, message.row_id) for message in messages])
+        self.db.commit()
+
+    def remove(self, messages: List[OutboxMessage]) -> None:
+        self.db.executemany("DELETE FROM outbox WHERE id = ?", [(message.row_id,) for message in messages])
+        self.db.commit()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class DeliveryQueue:
+    """
+    Delivers alerts to Matrix rooms in the background.
+
+    Every room has its own queue and worker, so rooms are served concurrently (up to
+    `max_concurrent_sends` sends at a time) while messages to one room keep their order.
+    When the homeserver rate-limits a send, the worker waits the `retry_after_ms` it asks
+    for; other failures are retried with exponential backoff, up to `max_attempts` times.
+    With `digest` enabled, a burst of at least `digest_threshold` messages queued for a
+    room within `digest_delay` seconds is sent as a single digest message.
+
+    Items are marked as seen in the seen-item store only once they were delivered.
+    """
+
+    def __init__(self, client, logger, outbox: Outbox, max_concurrent_sends: int = 4, max_attempts: int = 10,
+                 retry_delay: float = 5, max_retry_delay: float = 300, digest: bool = False,
+                 digest_threshold: int = 5, digest_delay: float = 2):
+        self.client = client
+        self.logger = logger
+        self.outbox = outbox
+        self.seen = get_seen_store()
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.digest = digest
+        self.digest_threshold = digest_threshold
+        self.digest_delay = digest_delay
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(max_concurrent_sends)
+        QUEUE_DEPTH.set_function(lambda: len(self.outbox))
+
+    def start(self) -> None:
+        """Queue the messages left in the outbox by a previous run."""
+        pending = self.outbox.pending()
+        if pending:
+            self.logger.info(f"Resuming delivery of {len(pending)} messages from the outbox")
+        for message in pending:
+            self._queue(message)
+
+    def stop(self) -> None:
+        for worker in self._workers.values():
+            worker.cancel()
+        self._workers.clear()
+
+    def enqueue(self, room_id: str, source: str, item_id, content: Dict, marker: Optional[float] = None) -> None:
+        """
+        Queue a message for delivery to a room.
+
+        Args:
+            room_id (str): The Matrix room to send to.
+            source (str): The source the item came from.
+            item_id: The item's id within the source.
+            content (Dict): The m.room.message content.
+            marker (float, optional): The item's ordered marker, recorded in the seen-item store on delivery.
+        """
+        message = self.outbox.add(room_id, source, item_id, content, marker)
+        if message is not None:
+            self._queue(message)
+
+    def _queue(self, message: OutboxMessage) -> None:
+        if message.room_id not in self.queues:
+            self.queues[message.room_id] = asyncio.Queue()
+        self.queues[message.room_id].put_nowait(message)
+        if message.room_id not in self._workers:
+            self._workers[message.room_id] = asyncio.create_task(self._room_worker(message.room_id))
+
+    async def _room_worker(self, room_id: str) -> None:
+        queue = self.queues[room_id]
+        batch = []
+        try:
+            while True:
+                if not batch:
+                    batch.append(await queue.get())
+                    if self.digest:
+                        # Give the rest of the cycle's burst a moment to arrive.
+                        await asyncio.sleep(self.digest_delay)
+                while not queue.empty():
+                    batch.append(queue.get_nowait())
+
+                try:
+                    if self.digest and len(batch) >= self.digest_threshold:
+                        await self._deliver(room_id, batch, self._digest_content(batch), f"{batch[0].txn_id}-{len(batch)}")
+                        batch = []
+                    while batch:
+                        await self._deliver(room_id, batch[:1], batch[0].content, batch[0].txn_id)
+                        batch.pop(0)
+                except Exception as e:
+                    # E.g. the outbox could not be written. The rest of the batch is retried, with the same
+                    # transaction ids, so the homeserver drops a message that was already sent.
+                    self.logger.error(f"Delivering messages to Matrix room {room_id} failed, retrying in {self.retry_delay}s: {str(e)}")
+                    await asyncio.sleep(self.retry_delay)
+        finally:
+            if self._workers.get(room_id) is asyncio.current_task():
+                del self._workers[room_id]
+
+    @staticmethod
+    def _digest_content(messages: List[OutboxMessage]) -> Dict:
+        bodies = [message.content.get("body", "") for message in messages]
+        formatted_bodies = [message.content.get("formatted_body", message.content.get("body", "")) for message in messages]
+        return {
+            "msgtype": "m.text",
+            "format": "org.matrix.custom.html",
+            "formatted_body": f"<strong>{len(messages)} new matches</strong><br><br>" + "<br><br>".join(formatted_bodies),
+            "body": f"{len(messages)} new matches\n\n" + "\n\n".join(bodies),
+        }
+
+    async def _deliver(self, room_id: str, messages: List[OutboxMessage], content: Dict, txn_id: str) -> None:
+        while True:
+            retry_after_ms = None
+            async with self._semaphore:
+                try:
+                    with SEND_DURATION.time():
+                        response = await self.client.room_send(room_id, "m.room.message", content, tx_id=txn_id)
+                except Exception as e:
+                    SENDS.inc(outcome="error")
+                    error = str(e)
+                else:
+                    if not isinstance(response, RoomSendError):
+                        SENDS.inc(outcome="success")
+                        MESSAGES_DELIVERED.inc(len(messages))
+                        self.outbox.remove(messages)
+                        for message in messages:
+                            self.seen.mark_seen(room_id, message.source, message.item_id, marker=message.marker)
+                        return
+                    error = str(response)
+                    retry_after_ms = response.retry_after_ms
+                    SENDS.inc(outcome="rate_limited" if response.status_code == "M_LIMIT_EXCEEDED" else "error")
+
+            self.outbox.record_attempt(messages)
+            attempts = max(message.attempts for message in messages)
+            if attempts >= self.max_attempts:
+                self.logger.error(f"Giving up on {len(messages)} messages to Matrix room {room_id} after {attempts} attempts: {error}")
+                self.outbox.remove(messages)
+                return
+
+            if retry_after_ms is not None:
+                delay = retry_after_ms / 1000
+            else:
+                delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+            self.logger.warning(f"Failed to send message to Matrix room {room_id}, retrying in {delay:.1f}s: {error}")
+            await asyncio.sleep(delay)
+
+
+_delivery_queue: Optional[DeliveryQueue] = None
+
+
+def setup_delivery_queue(config: Dict, client, logger) -> DeliveryQueue:
+    """
+    Create the process-wide delivery queue from the optional "delivery" section of the config.
+
+    Args:
+        config (Dict): The bot configuration.
+        client: The Matrix client to send with.
+        logger: The logger to report delivery failures to.
+
+    Returns:
+        DeliveryQueue: The shared queue, also returned by `get_delivery_queue()` from now on.
+    """
+    global _delivery_queue
+    settings = config.get("delivery", {})
+    _delivery_queue = DeliveryQueue(
+        client,
+        logger,
+        Outbox(settings.get("outbox_path", "data/outbox.db")),
+        max_concurrent_sends=settings.get("max_concurrent_sends", 4),
+        max_attempts=settings.get("max_attempts", 10),
+        retry_delay=settings.get("retry_delay", 5),
+        max_retry_delay=settings.get("max_retry_delay", 300),
+        digest=settings.get("digest", False),
+        digest_threshold=settings.get("digest_threshold", 5),
+        digest_delay=settings.get("digest_delay", 2),
+    )
+    return _delivery_queue
+
+
+def get_delivery_queue() -> DeliveryQueue:
+    if _delivery_queue is None:
+        raise RuntimeError("Delivery queue has not been set up, call setup_delivery_queue() first")
+    return _delivery_queue
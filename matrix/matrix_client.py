@@ -1,15 +1,82 @@
-from nio import AsyncClient, RoomMessageText
+import functools
+import json
+import re
 
-async def setup_matrix_client(config):
+from nio import AsyncClient, RoomMessageText, SyncResponse, UploadFilterError
+
+from utils.config_store import get_config_store
+from utils.matcher import KeywordMatcher
+from utils.profiler import PROFILER
+from utils.state import get_state_store
+
+# The bot only reads the "!" commands posted to its rooms, so skip presence, account data,
+# receipts and typing notifications, lazy-load members and keep timelines short.
+SYNC_FILTER = {
+    "presence": {"not_types": ["*"]},
+    "account_data": {"not_types": ["*"]},
+    "room": {
+        "state": {"lazy_load_members": True},
+        "timeline": {"types": ["m.room.message"], "limit": 10, "lazy_load_members": True},
+        "ephemeral": {"not_types": ["*"]},
+        "account_data": {"not_types": ["*"]},
+    },
+}
+
+# The client that command replies are sent with, set by setup_matrix_client().
+_client = None
+
+async def setup_matrix_client(config, logger):
+    global _client
     client = AsyncClient(config["homeserver"], config["user_id"])
     client.access_token = config["access_token"]
     client.user_id = config["user_id"]
     client.device_id = "AAAAAAAAAA"
 
     client.add_event_callback(on_message, RoomMessageText)
+    client.add_response_callback(on_sync, SyncResponse)
+
+    state = get_state_store()
+    # Resume from the last sync instead of doing a full initial sync of every room.
+    client.next_batch = state.get("matrix_next_batch")
+    if client.next_batch:
+        logger.info("Resuming Matrix sync from the stored sync token")
+    await upload_sync_filter(client, logger)
 
+    _client = client
     return client
 
+async def upload_sync_filter(client, logger):
+    """
+    Upload SYNC_FILTER to the homeserver, unless an identical filter was uploaded before.
+
+    Args:
+        client (AsyncClient): The Matrix client.
+        logger: The logger to report failures to.
+
+    Returns:
+        str: The filter id, or None to sync unfiltered if the upload failed.
+    """
+    state = get_state_store()
+    stored = state.get("matrix_sync_filter")
+    definition = json.dumps(SYNC_FILTER, sort_keys=True)
+    if stored and stored["user_id"] == client.user_id and stored["definition"] == definition:
+        return stored["filter_id"]
+
+    response = await client.upload_filter(**SYNC_FILTER)
+    if isinstance(response, UploadFilterError):
+        logger.error(f"Failed to upload sync filter, syncing unfiltered: {response}")
+        return None
+    state.set("matrix_sync_filter", {"user_id": client.user_id, "definition": definition, "filter_id": response.filter_id})
+    return response.filter_id
+
+async def sync_forever(client, timeout=30000):
+    """Keep the client synced, using the stored sync filter and token."""
+    sync_filter = get_state_store().get("matrix_sync_filter")
+    await client.sync_forever(timeout=timeout, sync_filter=sync_filter["filter_id"] if sync_filter else None)
+
+async def on_sync(response):
+    get_state_store().set("matrix_next_batch", response.next_batch)
+
 
 async def on_message(room, event):
     if not event.body.startswith("!"):
@@ -20,35 +87,62 @@ async def on_message(room, event):
 
     if command == "set_keywords":
         checker_type, new_keywords = message_body.split(" ")[1], " ".join(message_body.split(" ")[2:])
-        await handle_set_keywords(event, checker_type, new_keywords)
-        
-async def handle_set_keywords(event, checker_type, new_keywords):
-    sender = event["sender"]
-    user_config = find_user_config_by_sender(sender)
+        await handle_set_keywords(room, event, checker_type, new_keywords)
+    elif command == "reload_config":
+        await handle_reload_config(room, event)
+    elif command == "profile":
+        await handle_profile(room, event, message_body.split(" ")[1:])
+
+async def send_text(room_id, body):
+    await _client.room_send(room_id, "m.room.message", {"msgtype": "m.text", "body": body})
+
+async def handle_set_keywords(room, event, checker_type, new_keywords):
+    config_store = get_config_store()
+    user_config = config_store.find_user(event.sender)
 
     if not user_config:
-        await client.room_send(user_config["matrix_room_id"], "m.room.message", {"msgtype": "m.text", "body": "You are not a registered user."})
+        await send_text(room.room_id, "You are not a registered user.")
         return
 
-    checker_config = find_checker_config(user_config, checker_type)
+    if config_store.config.get("sharding"):
+        # Overrides only live in this process, but the sources are matched by the shard workers.
+        await send_text(room.room_id, "Keywords cannot be changed by command while the bot is sharded, change them in the config file instead.")
+        return
 
-    if not checker_config:
-        await client.room_send(user_config["matrix_room_id"], "m.room.message", {"msgtype": "m.text", "body": f"No checker of type '{checker_type}' found."})
+    keywords = new_keywords.split(",")
+    try:
+        # An invalid keyword would make the router skip the subscription on the next reload.
+        KeywordMatcher(keywords)
+    except re.error as e:
+        await send_text(room.room_id, f"Invalid keyword, the keywords were not changed: {str(e)}")
         return
 
-    checker_config["keywords"] = new_keywords.split(",")
+    if not await config_store.set_keywords(user_config, checker_type, keywords):
+        await send_text(room.room_id, f"No checker of type '{checker_type}' found.")
+        return
+
+    await send_text(room.room_id, f"Keywords updated for {checker_type} checker: {new_keywords}")
 
-    await client.room_send(user_config["matrix_room_id"], "m.room.message", {"msgtype": "m.text", "body": f"Keywords updated for {checker_type} checker: {new_keywords}"})
+async def handle_reload_config(room, event):
+    config_store = get_config_store()
+    if not config_store.find_user(event.sender):
+        await send_text(room.room_id, "You are not a registered user.")
+        return
 
-def find_user_config_by_sender(sender):
-    for user in config["users"]:
-        if user["matrix_user_id"] == sender:
-            return user
-    return None
+    if await config_store.reload():
+        await send_text(room.room_id, "Configuration reloaded.")
+    else:
+        await send_text(room.room_id, "Configuration unchanged.")
 
-def find_checker_config(user_config, checker_type):
-    for checker_config in user_config["checkers"]:
-        if checker_config["checker_type"] == checker_type:
-            return checker_config
-    return None
+async def handle_profile(room, event, args):
+    if event.sender not in get_config_store().config.get("admin_user_ids", []):
+        await send_text(room.room_id, "Only admins can profile the bot.")
+        return
 
+    cycles = int(args[0]) if args and args[0].isdigit() else 1
+    if PROFILER.start(cycles, on_done=functools.partial(send_text, room.room_id)):
+        await send_text(room.room_id, f"Profiling the next {cycles} poll cycles, the results will be posted here.")
+    elif PROFILER.active:
+        await send_text(room.room_id, "A profiling session is already running.")
+    else:
+        await send_text(room.room_id, "No sources are polled by this process. With sharding, send SIGUSR1 to the shard workers.")
@@ -0,0 +1,119 @@
+import asyncio
+from typing import Any, Dict, Optional
+
+from utils import metrics
+from utils.http_client import get_http_client
+from utils.response_cache import LRUCache
+
+ENRICHMENT_LOOKUPS = metrics.counter(
+    "governance_enrichment_lookups_total", "Polkassembly lookups by how they were answered: hit, revalidated or fetched.", ["network", "result"])
+
+
+class ReferendumEnricher:
+    """
+    Fetches Polkassembly details of referenda, concurrently and with a shared cache.
+
+    At most `max_workers` requests run at the same time. Details are cached per
+    (network, referendum index) for every user watching that network. Once an entry is
+    older than `ttl` seconds it is revalidated with a conditional request, and a 304
+    answer keeps the cached details without downloading them again.
+    """
+
+    def __init__(self, logger, max_workers: int = 8, max_entries: int = 4096, ttl: float = 600):
+        self.logger = logger
+        self.max_workers = max_workers
+        self.cache = LRUCache(max_entries=max_entries, ttl=ttl)
+        self._semaphore = None
+
+    async def fetch(self, network: str, index, url: str) -> Dict[str, Any]:
+        """
+        Return the details of one referendum.
+
+        Args:
+            network (str): The network the referendum belongs to.
+            index: The referendum index.
+            url (str): The Polkassembly URL of the referendum.
+
+        Returns:
+            Dict: The title and content of the Polkassembly post. It is shared with other callers and must not be modified.
+
+        Raises:
+            HttpError: If Polkassembly answers with an error status.
+        """
+        key = (network, str(index))
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            ENRICHMENT_LOOKUPS.inc(network=network, result="hit")
+            return entry.value
+
+        headers = {"x-network": network}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.last_modified:
+                headers["If-Modified-Since"] = entry.last_modified
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        async with self._semaphore:
+            response = await get_http_client().get_json(
+                url, headers=headers, vary=("x-network", "If-None-Match", "If-Modified-Since"))
+
+        if response.status == 304 and entry is not None:
+            self.logger.debug("Polkassembly details of referendum %s on %s are unchanged", index, network)
+            self.cache.touch(key)
+            ENRICHMENT_LOOKUPS.inc(network=network, result="revalidated")
+            return entry.value
+
+        response.raise_for_status()
+        ENRICHMENT_LOOKUPS.inc(network=network, result="fetched")
+        if not isinstance(response.data, dict):
+            # Not cached, so a proxy error page or a half-deployed API does not stick for the whole TTL.
+            self.logger.warning(f"Polkassembly answered with no JSON object for referendum {index} on {network}")
+            return {"title": "None", "content": "Unable to retrieve details from both sources"}
+        # Only keep what messages are built from, not the comments, timeline and the rest of the post.
+        title = response.data.get("title", "None")
+        if title is None:
+            details = {"title": "None",
+                       "content": "Unable to retrieve details from both sources"}
+        else:
+            details = {"title": title, "content": response.data.get("content")}
+
+        self.cache.set(key, details, etag=response.headers.get("ETag"), last_modified=response.headers.get("Last-Modified"))
+        return details
+
+    async def fetch_all(self, network: str, urls: Dict[Any, str]) -> Dict[Any, Dict[str, Any]]:
+        """
+        Fetch the details of several referenda concurrently.
+
+        Args:
+            network (str): The network the referenda belong to.
+            urls (Dict): Polkassembly URL by referendum index.
+
+        Returns:
+            Dict: Details by referendum index, in the order of `urls`.
+        """
+        indexes = list(urls)
+        results = await asyncio.gather(*(self.fetch(network, index, urls[index]) for index in indexes))
+        return dict(zip(indexes, results))
+
+
+_referendum_enricher: Optional[ReferendumEnricher] = None
+
+
+def setup_referendum_enricher(config: Dict, logger) -> ReferendumEnricher:
+    global _referendum_enricher
+    settings = config.get("enrichment", {})
+    _referendum_enricher = ReferendumEnricher(
+        logger,
+        max_workers=settings.get("max_workers", 8),
+        max_entries=settings.get("max_entries", 4096),
+        ttl=settings.get("ttl", 600),
+    )
+    return _referendum_enricher
+
+
+def get_referendum_enricher() -> ReferendumEnricher:
+    if _referendum_enricher is None:
+        raise RuntimeError("Referendum enricher has not been set up, call setup_referendum_enricher() first")
+    return _referendum_enricher
@@ -1,127 +1,117 @@
-import yaml
-import json
-import requests
-import os
-import logging
-from typing import Union, Any, List, Dict
-from substrateinterface import SubstrateInterface
-from datetime import datetime
+from typing import AsyncIterator, List
+from datetime import datetime, timezone
+from utils.http_client import get_http_client, HttpError
+from open_governance.substrate_pool import get_substrate_pool
+from open_governance.enrichment import get_referendum_enricher
+from open_governance.referenda_state import ReferendaChanges, ReferendaState
+from utils import metrics
+
+SUBSQUARE_PAGES = metrics.counter("governance_subsquare_pages_total", "Pages of the Subsquare referenda list read.", ["network"])
+REFERENDA_FETCHED = metrics.counter("governance_referenda_fetched_total", "New referenda fetched and enriched.", ["network"])
+
+
+def parse_subsquare_time(value: str) -> datetime:
+    """Parse a Subsquare timestamp, e.g. "2024-01-31T12:00:00.000Z", as an aware UTC datetime."""
+    return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=timezone.utc)
+
+
+class ReferendumRecord:
+    """The parts of a referendum the bot uses, without the rest of the Subsquare and Polkassembly payloads."""
+
+    __slots__ = ("index", "title", "content", "created_at")
+
+    def __init__(self, index: int, title: str, content: str, created_at: datetime = None):
+        self.index = index
+        self.title = title
+        self.content = content
+        self.created_at = created_at
 
 
 class OpenGovernance2:
-    def __init__(self, substrate_wss, network, logger):
+    def __init__(self, substrate_wss, network, logger, subsquare_url=None, polkassembly_url="https://api.polkassembly.io"):
         self.network = network
-        self.substrate = SubstrateInterface(
-            url=substrate_wss,
-            ss58_format=2,
-            type_registry_preset=self.network
-        )
+        self.subsquare_url = subsquare_url or f"https://{network}.subsquare.io"
+        self.polkassembly_url = polkassembly_url
+        # Connections are shared by every checker watching the same node and opened on first use.
+        self.connection = get_substrate_pool().get(substrate_wss, network)
         self.logger = logger
+        self.referenda_state = ReferendaState(self.connection, logger)
+        self.http = get_http_client()
+        self.enricher = get_referendum_enricher()
         self.logger.debug("OpenGovernance2 initialized")
 
-    def referendumInfoFor(self, index=None):
+    @property
+    def substrate(self):
+        return self.connection.substrate
+
+    async def referenda_changes(self, block_hash=None) -> ReferendaChanges:
+        """
+        Sync the ongoing referenda to a block and report which were started, updated or ended since the last sync.
+
+        Cheap enough to call for every new block, see ReferendaState.
+        """
+        return await self.referenda_state.sync(block_hash)
+
+    def polkassembly_post_url(self, index) -> str:
+        return f"{self.polkassembly_url}/api/v1/posts/on-chain-post?postId={index}&proposalType=referendums_v2"
+
+    async def iter_new_referenda(self, last_check: datetime, min_index: int = None) -> AsyncIterator[List[ReferendumRecord]]:
         """
-        Get information regarding a specific referendum or all ongoing referendums.
+        Yield the referenda created since `last_check`, newest first, one enriched page at a time.
 
-        :param index: (optional) index of the specific referendum
-        :return: dictionary containing the information of the specific referendum or a dictionary of all ongoing referendums
-        :raises: ValueError if `index` is not None and not a valid index of any referendum
+        Paging stops at the first referendum created at or before `last_check` or with an index at or
+        below `min_index`. Only the slim records of the current page are kept, so scanning a long
+        backlog does not hold every Subsquare and Polkassembly payload in memory at once.
         """
-        self.logger.debug("Fetching referendum info for index: %s", index)
-        
-        referendum = {}
-        if index is not None:
-            info = self.substrate.query(
-                module='Referenda',
-                storage_function='ReferendumInfoFor',
-                params=[index]).serialize()
-            self.logger.debug("Referendum info for index %s: %s", index, info)
-            return info
-        else:
-            qmap = self.substrate.query_map(
-                module='Referenda',
-                storage_function='ReferendumInfoFor',
-                params=[])
-            for index, info in qmap:
-                if 'Ongoing' in info:
-                    referendum.update({int(index.value): info.value})
-
-            sort = json.dumps(referendum, sort_keys=True)
-            self.logger.debug("Some data here: %s", sort)
-            data = json.loads(sort)
-
-            return data
-
-    def fetch_all_referendum_data(self, network: str, last_check: datetime) -> List[Dict[str, Any]]:
         page = 1
         page_size = 100
-        all_referenda = []
-    
+        # Subsquare times are UTC, while last_check is a naive local time.
+        since = last_check.astimezone()
+
         while True:
-            url = f"https://{self.network}.subsquare.io/api/gov2/referendums?page={page}&pageSize={page_size}"
-            headers = {"x-network": network}
-    
+            url = f"{self.subsquare_url}/api/gov2/referendums?page={page}&pageSize={page_size}"
+            headers = {"x-network": self.network}
+
             try:
-                response = requests.get(url, headers=headers)
+                # The pages are read once per cycle by a single checker, so don't keep them in the response cache.
+                response = await self.http.get_json(url, headers=headers, cache_ttl=0)
                 response.raise_for_status()
-                json_response = response.json()
-                self.logger.debug("Trying to get info from %s", url)
-                referenda = json_response["items"]
-                total = json_response["total"]
-    
-                if not referenda:
-                    break
-    
-                for referendum in referenda:
-                    #self.logger.debug("JSON response: %s", json.dumps(referendum, indent=2))
-                    created_at = datetime.strptime(referendum['createdAt'], "%Y-%m-%dT%H:%M:%S.%fZ")
-                    if created_at < last_check:
-                        return all_referenda
-    
-                    index = str(referendum["referendumIndex"])
-                    polkassembly_url = f"https://api.polkassembly.io/api/v1/posts/on-chain-post?postId={index}&proposalType=referendums_v2"
-                    polkassembly_info = self.fetch_referendum_data(referendum_id=index, network=self.network, url=polkassembly_url)
-                    self.logger.debug("Polkassembly info: %s", json.dumps(polkassembly_info, indent=2))
-    
-                    if polkassembly_info:
-                        referendum.update(polkassembly_info)
-    
-                    all_referenda.append(referendum)
-    
-                if len(all_referenda) >= total:
-                    break
-    
-                page += 1
-    
-            except requests.exceptions.HTTPError as http_error:
+            except HttpError as http_error:
                 self.logger.error("HTTP exception occurred: %s", http_error)
-                raise Exception(f"HTTP exception occurred: {http_error}")
-    
-        return all_referenda
+                raise
+            SUBSQUARE_PAGES.inc(network=self.network)
+            self.logger.debug("Trying to get info from %s", url)
+            referenda = response.data["items"]
+            total = response.data["total"]
+
+            new_referenda = []
+            reached_last_check = False
+            for referendum in referenda:
+                index = int(referendum["referendumIndex"])
+                created_at = parse_subsquare_time(referendum["createdAt"])
+                if created_at <= since or (min_index is not None and index <= min_index):
+                    self.logger.debug("Referendum %s is not new: created at %s, last check %s", index, created_at, last_check)
+                    reached_last_check = True
+                    break
+                new_referenda.append((index, created_at))
+
+            if new_referenda:
+                yield await self.to_records(new_referenda)
+
+            if reached_last_check or page * page_size >= total:
+                return
+            page += 1
+
+    async def to_records(self, referenda) -> List[ReferendumRecord]:
+        """Enrich (index, created_at) pairs with their Polkassembly title and content, concurrently."""
+        polkassembly_infos = await self.enricher.fetch_all(
+            self.network, {str(index): self.polkassembly_post_url(index) for index, _ in referenda})
+        REFERENDA_FETCHED.inc(len(referenda), network=self.network)
+        return [
+            ReferendumRecord(index, polkassembly_infos[str(index)].get("title"), polkassembly_infos[str(index)].get("content"), created_at)
+            for index, created_at in referenda
+        ]
 
-    def fetch_referendum_data(self, referendum_id: int, network: str, url: str) -> Union[str, Any]:
-        self.logger.debug("Fetching referendum data for ID: %s, network: %s", referendum_id, network)
-    
-        headers = {"x-network": network}
-    
-        try:
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            json_response = response.json()
-    
-            if "title" not in json_response.keys():
-                json_response["title"] = "None"
-    
-            if json_response["title"] is None:
-                return {"title": "None",
-                        "content": "Unable to retrieve details from both sources"}
-    
-            return json_response
-    
-        except requests.exceptions.HTTPError as http_error:
-            self.logger.error("HTTP exception occurred: %s", http_error)
-            raise f"HTTP exception occurred: {http_error}"
-    
     def time_until_block(self, target_block: int) -> int:
         """
         Calculate the estimated time in minutes until the specified target block is reached on the network.
@@ -138,7 +128,7 @@ class OpenGovernance2:
         """
         try:
             # Get the current block number
-            current_block = self.substrate.get_block_number(block_hash=self.substrate.block_hash)
+            current_block = self.connection.call(lambda substrate: substrate.get_block_number(block_hash=substrate.block_hash))
             if target_block <= current_block:
                 print("The target block has already been reached.")
                 return False
@@ -160,45 +150,17 @@ class OpenGovernance2:
         except Exception as error:
             print(f"An error occurred while trying to calculate the remaining time until {target_block} is met... {error}")
 
-    def search_keywords(self, text, keywords):
-        for keyword in keywords:
-            if keyword.lower() in text.lower():
-                return keyword
-        return None
+    async def fetch_referenda(self, indexes) -> List[ReferendumRecord]:
+        """Fetch the given referenda, e.g. ones just seen in `Referenda.Submitted` events."""
+        referenda = []
+        for index in indexes:
+            url = f"{self.subsquare_url}/api/gov2/referendums/{index}"
+            response = await self.http.get_json(url, headers={"x-network": self.network})
+            # Raises until Subsquare has indexed a just submitted referendum, so the caller can retry later.
+            response.raise_for_status()
+            referenda.append((int(index), parse_subsquare_time(response.data["createdAt"])))
 
-        return any(keyword.lower() in text.lower() for keyword in keywords)
+        return await self.to_records(referenda)
 
-    def check_referendums(self, keywords, last_check):
-        all_referenda = self.fetch_all_referendum_data(network=self.network, last_check=last_check)
-        new_referenda = {}
-    
-        for referendum in all_referenda:
-            index = str(referendum["referendumIndex"])
-            created_at = datetime.strptime(referendum.get('createdAt', ''), "%Y-%m-%dT%H:%M:%S.%fZ")
-            #self.logger.debug("Referendum created at: %s", created_at)
-    
-            if created_at > last_check:
-                self.logger.debug("Found a new referendum")
-                new_referenda[index] = referendum
-            else:
-                self.logger.debug("Referendum is not new: %s is older than %s", created_at, last_check)
-
-        self.logger.debug("Checking %s referendums for keywords: %s", len(new_referenda.keys()), keywords)
-        filtered_referenda = {} 
-        for index, referendum_data in new_referenda.items():
-            title = referendum_data.get('title', '')
-            content = referendum_data.get('content', '')
-        
-            title_match = self.search_keywords(title, keywords)
-            content_match = self.search_keywords(content, keywords)
-        
-            if title_match or content_match:
-                matched_keyword = title_match or content_match
-                successful_url = f"https://{self.network}.subsquare.io/referenda/referendum/{index}"
-                referendum_data["successful_url"] = successful_url
-                referendum_data["matched_keyword"] = matched_keyword
-                referendum_data["content"] = content
-                filtered_referenda[index] = referendum_data
-    
-        return filtered_referenda
-    
+    def referendum_url(self, index):
+        return f"{self.subsquare_url}/referenda/referendum/{index}"
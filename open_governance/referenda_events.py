@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, List, Optional
+
+from open_governance.substrate_pool import SubstrateConnection
+
+
+class ReferendaSubscription:
+    """
+    Push-mode source of new referenda for one network.
+
+    A dedicated websocket subscribes to new block headers. That call blocks for as long
+    as the subscription lives, so it runs on its own thread and cannot share the pooled
+    connection. For every new block, the network's ReferendaState is synced to it over the
+    pooled connection of the same node, and the indexes of the referenda started since the
+    previously synced block are passed to every registered handler. A sync reads every
+    referendum created since the last block it synced, so the blocks missed while the
+    websocket was down, or whose sync failed, are caught up on with the next block.
+    Indexes whose handlers fail, e.g. because Subsquare has not indexed the referendum
+    yet, are retried after `retry_delay` seconds. A retry calls every handler again, which
+    relies on the seen-item store to skip the rooms that already got their message.
+    """
+
+    def __init__(self, open_governance, logger, retry_delay: float = 60, max_retries: int = 5):
+        self.open_governance = open_governance
+        self.connection = open_governance.connection
+        self.substrate_wss = self.connection.url
+        self.network = self.connection.network
+        self.logger = logger
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.listener = SubstrateConnection(self.substrate_wss, self.network, logger)
+        self.handlers: List[Callable[[List[int]], Awaitable]] = []
+        # The last block the referenda were synced to.
+        self.last_block: Optional[int] = None
+        self._stopped = threading.Event()
+        self._task = None
+        # The event loop only keeps weak references to tasks, so running dispatches are kept here.
+        self._dispatches = set()
+
+    def add_handler(self, handler: Callable[[List[int]], Awaitable]) -> None:
+        self.handlers.append(handler)
+
+    def start(self) -> asyncio.Task:
+        """Run the subscription in a background task until stop() is called."""
+        self._task = asyncio.create_task(self.run())
+        return self._task
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        blocks = asyncio.Queue()
+        thread = threading.Thread(target=self._listen, args=(loop, blocks), name=f"referenda-{self.network}", daemon=True)
+        thread.start()
+        self.logger.info(f"Subscribed to new {self.network} blocks for referendum submissions")
+        try:
+            while True:
+                block_number = await blocks.get()
+                # A sync covers every block up to the one it syncs to, so only the newest queued header is needed.
+                while not blocks.empty():
+                    block_number = blocks.get_nowait()
+                if self.last_block is not None and block_number <= self.last_block:
+                    continue
+                await self.process_block(block_number)
+        finally:
+            self._stopped.set()
+
+    async def process_block(self, block_number: int) -> None:
+        """Sync the referenda to a block and dispatch the ones started since the last synced block."""
+        try:
+            block_hash = await self.connection.run(lambda substrate: substrate.get_block_hash(block_number))
+            changes = await self.open_governance.referenda_changes(block_hash)
+        except Exception as e:
+            self.logger.error(f"Failed to sync {self.network} referenda to block {block_number}: {str(e)}")
+            return
+        previous, self.last_block = self.last_block, block_number
+        if previous is None:
+            # The first sync only learns which referenda are already ongoing.
+            return
+        if block_number > previous + 1:
+            self.logger.info(f"Caught up on {block_number - previous - 1} {self.network} blocks missed since block {previous}")
+        if changes.started:
+            self.logger.info(f"Referenda {changes.started} submitted in {self.network} by block {block_number}")
+            dispatch = asyncio.create_task(self._dispatch(changes.started, attempt=0))
+            self._dispatches.add(dispatch)
+            dispatch.add_done_callback(self._dispatches.discard)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _listen(self, loop: asyncio.AbstractEventLoop, blocks: asyncio.Queue) -> None:
+        def on_header(header, update_nr, subscription_id):
+            if self._stopped.is_set():
+                # Returning a value ends the subscription.
+                return True
+            loop.call_soon_threadsafe(blocks.put_nowait, header["header"]["number"])
+
+        while not self._stopped.is_set():
+            try:
+                self.listener.substrate.subscribe_block_headers(on_header)
+            except Exception as e:
+                self.logger.error(f"Block subscription to {self.substrate_wss} failed: {str(e)}")
+                try:
+                    self.listener.reconnect()
+                except Exception as e:
+                    # The next attempt opens a new connection.
+                    self.logger.error(f"Reconnecting to {self.substrate_wss} failed: {str(e)}")
+                self._stopped.wait(self.retry_delay)
+        self.listener.close()
+
+    async def _dispatch(self, indexes: List[int], attempt: int) -> None:
+        results = await asyncio.gather(*(handler(indexes) for handler in self.handlers), return_exceptions=True)
+        if any(isinstance(result, Exception) for result in results):
+            if attempt >= self.max_retries:
+                self.logger.error(f"Giving up on referenda {indexes} after {attempt + 1} attempts")
+                return
+            self.logger.warning(f"Checking referenda {indexes} failed, retrying in {self.retry_delay}s")
+            await asyncio.sleep(self.retry_delay)
+            await self._dispatch(indexes, attempt + 1)
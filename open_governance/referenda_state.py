@@ -0,0 +1,165 @@
+# open_governance/referenda_state.py
+
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from utils import metrics
+
+STORAGE_VALUES_READ = metrics.counter("governance_storage_values_read_total", "Raw Referenda.ReferendumInfoFor values read from the node.", ["network"])
+STORAGE_VALUES_DECODED = metrics.counter("governance_storage_values_decoded_total", "Referenda.ReferendumInfoFor values decoded.", ["network"])
+
+# Ongoing is the first variant of pallet_referenda's ReferendumInfo, so its SCALE encoding starts with 0x00.
+# Every other variant is final, so a referendum that left Ongoing never has to be read again.
+ONGOING_PREFIX = "0x00"
+
+
+class ReferendaChanges:
+    """What changed in the ongoing referenda between two synced blocks."""
+
+    __slots__ = ("block_hash", "started", "updated", "ended")
+
+    def __init__(self, block_hash: str, started: List[int], updated: List[int], ended: List[int]):
+        self.block_hash = block_hash
+        # Referenda that are ongoing now but were not at the previous block, e.g. just submitted.
+        self.started = started
+        # Ongoing referenda whose info changed, e.g. their tally, deciding status or track.
+        self.updated = updated
+        # Referenda that were ongoing at the previous block and no longer are.
+        self.ended = ended
+
+
+class ReferendaState:
+    """
+    The ongoing referenda of one network, read from `Referenda.ReferendumInfoFor` and kept
+    current block by block.
+
+    The first sync pages through the storage keys with `state_getKeysPaged` and reads the raw
+    values with `state_queryStorageAt`, `page_size` at a time, decoding only the ongoing ones.
+    After that, a sync only reads the referenda that were ongoing and the ones created since
+    (from `Referenda.ReferendumCount`), and decodes only the values whose raw bytes changed.
+    The ongoing referenda of the last `max_snapshots` synced blocks are kept by block hash,
+    so asking again for a block already synced costs no request at all.
+    """
+
+    def __init__(self, connection, logger, page_size: int = 1000, max_snapshots: int = 16):
+        self.connection = connection
+        self.network = connection.network
+        self.logger = logger
+        self.page_size = page_size
+        self.max_snapshots = max_snapshots
+        self.block_hash: Optional[str] = None
+        self.block_number: Optional[int] = None
+        self.ongoing: Dict[int, Dict] = {}
+        self._count: Optional[int] = None
+        self._raw: Dict[int, str] = {}
+        self._prefix: Optional[str] = None
+        self._snapshots: "OrderedDict[str, Dict[int, Dict]]" = OrderedDict()
+
+    async def ongoing_at(self, block_hash: str = None) -> Dict[int, Dict]:
+        """
+        Return the ongoing referenda at a block, by index.
+
+        Args:
+            block_hash (str, optional): The block to read. Defaults to the chain head.
+
+        Returns:
+            Dict: The decoded `ReferendumInfoFor` value of every ongoing referendum.
+        """
+        if block_hash is not None and block_hash in self._snapshots:
+            self._snapshots.move_to_end(block_hash)
+            return self._snapshots[block_hash]
+        await self.sync(block_hash)
+        return self.ongoing
+
+    async def sync(self, block_hash: str = None) -> ReferendaChanges:
+        """
+        Bring the ongoing referenda up to a block.
+
+        Args:
+            block_hash (str, optional): The block to sync to. Defaults to the chain head.
+
+        Returns:
+            ReferendaChanges: What changed since the previously synced block.
+        """
+        return await self.connection.run(lambda substrate: self.update(substrate, block_hash))
+
+    def update(self, substrate, block_hash: str = None) -> ReferendaChanges:
+        """Like `sync`, but blocking and with a SubstrateInterface already taken from the connection."""
+        if block_hash is None:
+            block_hash = substrate.get_chain_head()
+        if block_hash == self.block_hash:
+            return ReferendaChanges(block_hash, [], [], [])
+
+        block_number = substrate.get_block_number(block_hash)
+        count = substrate.query("Referenda", "ReferendumCount", block_hash=block_hash).value
+        if self._prefix is None:
+            self._prefix = substrate.create_storage_key("Referenda", "ReferendumInfoFor").to_hex()
+
+        if self._count is None or block_number < self.block_number or count < self._count:
+            # First sync, or a block before the synced one: referenda final since then may have been ongoing.
+            self.logger.debug(f"Scanning all {self.network} referenda at block {block_number}")
+            keys = self._all_keys(substrate, block_hash)
+        else:
+            indexes = list(self._raw) + list(range(self._count, count))
+            keys = [self._storage_key(index) for index in indexes]
+
+        raw_values = self._read_values(substrate, keys, block_hash)
+        value_type = None
+        ongoing = {}
+        raw = {}
+        started, updated = [], []
+        for key, value in raw_values.items():
+            if value is None or not value.startswith(ONGOING_PREFIX):
+                continue
+            index = self._index_of(key)
+            raw[index] = value
+            if self._raw.get(index) == value:
+                ongoing[index] = self.ongoing[index]
+                continue
+            if value_type is None:
+                value_type = substrate.get_metadata_storage_function("Referenda", "ReferendumInfoFor", block_hash=block_hash).get_value_type_string()
+            ongoing[index] = substrate.decode_scale(type_string=value_type, scale_bytes=value, block_hash=block_hash)
+            STORAGE_VALUES_DECODED.inc(network=self.network)
+            (updated if index in self._raw else started).append(index)
+        ended = [index for index in self._raw if index not in raw]
+
+        self.block_hash = block_hash
+        self.block_number = block_number
+        self.ongoing = ongoing
+        self._raw = raw
+        self._count = count
+        self._snapshots[block_hash] = ongoing
+        while len(self._snapshots) > self.max_snapshots:
+            self._snapshots.popitem(last=False)
+        return ReferendaChanges(block_hash, sorted(started), sorted(updated), sorted(ended))
+
+    def _all_keys(self, substrate, block_hash: str) -> List[str]:
+        keys = []
+        start_key = self._prefix
+        while True:
+            response = substrate.rpc_request("state_getKeysPaged", [self._prefix, self.page_size, start_key, block_hash])
+            page = response["result"]
+            keys.extend(page)
+            if len(page) < self.page_size:
+                return keys
+            start_key = page[-1]
+
+    def _read_values(self, substrate, keys: List[str], block_hash: str) -> Dict[str, Optional[str]]:
+        values = {}
+        for start in range(0, len(keys), self.page_size):
+            response = substrate.rpc_request("state_queryStorageAt", [keys[start:start + self.page_size], block_hash])
+            for change_set in response["result"]:
+                for key, value in change_set["changes"]:
+                    values[key] = value
+        STORAGE_VALUES_READ.inc(len(values), network=self.network)
+        return values
+
+    def _storage_key(self, index: int) -> str:
+        # ReferendumInfoFor is hashed with Blake2_128Concat: the hash of the SCALE encoded u32 index, then the index itself.
+        encoded = index.to_bytes(4, "little")
+        return self._prefix + hashlib.blake2b(encoded, digest_size=16).hexdigest() + encoded.hex()
+
+    @staticmethod
+    def _index_of(key: str) -> int:
+        return int.from_bytes(bytes.fromhex(key[-8:]), "little")
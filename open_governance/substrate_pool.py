@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple
+
+from utils import metrics
+from utils.profiler import PROFILER
+
+if TYPE_CHECKING:
+    from substrateinterface import SubstrateInterface
+
+try:
+    # Raised by a dropped websocket. websocket-client comes with substrate-interface, which is only needed for governance.
+    from websocket import WebSocketException
+    CONNECTION_ERRORS = (ConnectionError, OSError, WebSocketException)
+except ImportError:
+    CONNECTION_ERRORS = (ConnectionError, OSError)
+
+CALL_DURATION = metrics.histogram("substrate_call_duration_seconds", "Latency of calls over a Substrate websocket.", ["network"])
+RECONNECTS = metrics.counter("substrate_reconnects_total", "Reopened Substrate websockets.", ["network"])
+
+
+class SubstrateConnection:
+    """
+    A long-lived, lazily opened websocket to one Substrate node.
+
+    The underlying SubstrateInterface is created on first use and then kept for the
+    lifetime of the bot, so the type registry and the runtime metadata it caches are
+    loaded once instead of on every governance cycle. Before use, a connection that has
+    been idle for `health_check_interval` seconds is probed, and a dead websocket is
+    reopened on the same SubstrateInterface, which keeps its metadata cache.
+    """
+
+    def __init__(self, url: str, network: str, logger, ss58_format: int = 2, health_check_interval: float = 30):
+        self.url = url
+        self.network = network
+        self.logger = logger
+        self.ss58_format = ss58_format
+        self.health_check_interval = health_check_interval
+        self.reconnects = 0
+        self._substrate: Optional["SubstrateInterface"] = None
+        self._last_healthy = 0.0
+        # SubstrateInterface is not safe to share between threads.
+        self._lock = threading.RLock()
+
+    @property
+    def substrate(self) -> "SubstrateInterface":
+        with self._lock:
+            if self._substrate is None:
+                # Imported on first use, so bots without governance sources never load it.
+                from substrateinterface import SubstrateInterface
+
+                self.logger.info(f"Opening Substrate connection to {self.url}")
+                self._substrate = SubstrateInterface(
+                    url=self.url,
+                    ss58_format=self.ss58_format,
+                    type_registry_preset=self.network
+                )
+                self._last_healthy = time.monotonic()
+            elif time.monotonic() - self._last_healthy > self.health_check_interval:
+                self._check_health()
+            return self._substrate
+
+    def _check_health(self) -> None:
+        try:
+            self._substrate.rpc_request("system_health", [])
+        except Exception as e:
+            self.logger.warning(f"Substrate connection to {self.url} is unhealthy ({str(e)}), reconnecting")
+            self.reconnect()
+        self._last_healthy = time.monotonic()
+
+    def reconnect(self) -> None:
+        with self._lock:
+            if self._substrate is None:
+                return
+            try:
+                self._substrate.close()
+            except Exception:
+                pass
+            try:
+                self._substrate.connect_websocket()
+            except Exception:
+                # Drop the dead connection, so the next use opens a new one instead of failing on it again.
+                self._substrate = None
+                raise
+            self.reconnects += 1
+            RECONNECTS.inc(network=self.network)
+
+    def call(self, func: Callable[["SubstrateInterface"], Any]) -> Any:
+        """Run `func` with the connected SubstrateInterface, reconnecting and retrying once if the websocket fails."""
+        with self._lock, CALL_DURATION.time(network=self.network):
+            try:
+                return func(self.substrate)
+            except CONNECTION_ERRORS as e:
+                self.logger.warning(f"Substrate call to {self.url} failed ({str(e)}), reconnecting")
+                self.reconnect()
+                return func(self.substrate)
+
+    async def run(self, func: Callable[["SubstrateInterface"], Any]) -> Any:
+        """Like `call`, but runs in a worker thread so the blocking websocket I/O does not stall the event loop."""
+        with PROFILER.span(f"substrate {self.network}"):
+            return await asyncio.get_running_loop().run_in_executor(None, self.call, func)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._substrate is not None:
+                self._substrate.close()
+                self._substrate = None
+
+
+class SubstratePool:
+    """Process-wide registry of Substrate connections, one per (websocket URL, network)."""
+
+    def __init__(self, logger, health_check_interval: float = 30):
+        self.logger = logger
+        self.health_check_interval = health_check_interval
+        self._connections: Dict[Tuple[str, str], SubstrateConnection] = {}
+        self._lock = threading.Lock()
+
+    def get(self, url: str, network: str) -> SubstrateConnection:
+        with self._lock:
+            key = (url, network)
+            if key not in self._connections:
+                self._connections[key] = SubstrateConnection(
+                    url, network, self.logger, health_check_interval=self.health_check_interval)
+            return self._connections[key]
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections.clear()
+
+
+_substrate_pool: Optional[SubstratePool] = None
+
+
+def setup_substrate_pool(config: Dict, logger) -> SubstratePool:
+    global _substrate_pool
+    _substrate_pool = SubstratePool(logger, health_check_interval=config.get("substrate_health_check_interval", 30))
+    return _substrate_pool
+
+
+def get_substrate_pool() -> SubstratePool:
+    if _substrate_pool is None:
+        raise RuntimeError("Substrate pool has not been set up, call setup_substrate_pool() first")
+    return _substrate_pool
@@ -0,0 +1,48 @@
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+
+# The modules import each other by their top-level packages, as when the bot is run from the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.seen_store import setup_seen_store  # noqa: E402
+
+
+class FakeDelivery:
+    """Stands in for the delivery queue and records the messages it was given."""
+
+    def __init__(self, seen=None):
+        self.seen = seen
+        self.messages = []
+
+    def enqueue(self, room_id, source, item_id, content, marker=None):
+        self.messages.append((room_id, item_id, content.get("body")))
+
+
+async def wait_until(condition, timeout=2):
+    """Poll `condition` until it holds, failing the test after `timeout` seconds."""
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out waiting for the condition")
+
+
+@pytest.fixture
+def logger():
+    return logging.getLogger("test")
+
+
+@pytest.fixture
+def seen(tmp_path, logger):
+    store = setup_seen_store({"seen_store": {"path": str(tmp_path / "seen.db")}}, logger)
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def delivery(seen):
+    return FakeDelivery(seen)
@@ -0,0 +1,98 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from matrix import matrix_client
+from utils.config_store import setup_config_store
+
+
+def alice(keywords=("dot",)):
+    return {"name": "alice", "matrix_room_id": "!alice:example", "matrix_user_id": "@alice:example",
+            "checkers": [{"checker_type": "stackexchange", "stack_exchange_site": "stackoverflow", "keywords": list(keywords)}]}
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / "config.json"
+
+    def write(config):
+        path.write_text(config if isinstance(config, str) else json.dumps(config))
+
+    write.path = str(path)
+    return write
+
+
+def test_users_and_checkers_are_indexed(config_file, logger):
+    config_file({"users": [alice()]})
+    store = setup_config_store(logger, config_file.path)
+
+    user = store.find_user("@alice:example")
+    assert user["name"] == "alice"
+    assert store.find_checker(user, "stackexchange")["stack_exchange_site"] == "stackoverflow"
+    assert store.find_user("@bob:example") is None
+
+
+def test_malformed_entries_are_skipped(config_file, logger):
+    config_file({"users": [alice(), "bob", {"name": "carol"}, dict(alice(), name="dave", checkers=[{"keywords": []}])]})
+    store = setup_config_store(logger, config_file.path)
+
+    assert [user["name"] for user in store.config["users"]] == ["alice", "dave"]
+    assert store.config["users"][1]["checkers"] == []
+
+
+def test_listeners_get_the_reloaded_config(config_file, logger):
+    config_file({"users": [alice()]})
+    store = setup_config_store(logger, config_file.path)
+    received = []
+
+    async def listener(config):
+        received.append([user["name"] for user in config["users"]])
+
+    store.add_listener(listener)
+    config_file({"users": [alice(), dict(alice(), name="bob", matrix_user_id="@bob:example")]})
+
+    assert asyncio.run(store.reload())
+    assert not asyncio.run(store.reload())
+    assert received == [["alice", "bob"]]
+    assert store.find_user("@bob:example")["name"] == "bob"
+
+
+def test_a_broken_file_keeps_the_current_config(config_file, logger):
+    config_file({"users": [alice()]})
+    store = setup_config_store(logger, config_file.path)
+
+    config_file('{"users": [')
+
+    assert not asyncio.run(store.reload())
+    assert store.find_user("@alice:example") is not None
+
+
+def test_keyword_overrides_survive_a_reload(config_file, logger):
+    config_file({"users": [alice()], "global_check_interval": 60})
+    store = setup_config_store(logger, config_file.path)
+    user = store.find_user("@alice:example")
+
+    assert asyncio.run(store.set_keywords(user, "stackexchange", ["ksm"]))
+    config_file({"users": [alice()], "global_check_interval": 30})
+    asyncio.run(store.reload())
+
+    assert store.find_checker(store.find_user("@alice:example"), "stackexchange")["keywords"] == ["ksm"]
+
+
+def test_set_keywords_refuses_an_invalid_regex(config_file, logger, monkeypatch):
+    config_file({"users": [alice()]})
+    store = setup_config_store(logger, config_file.path)
+    replies = []
+
+    async def send_text(room_id, body):
+        replies.append(body)
+
+    monkeypatch.setattr(matrix_client, "send_text", send_text)
+    room, event = SimpleNamespace(room_id="!alice:example"), SimpleNamespace(sender="@alice:example")
+
+    asyncio.run(matrix_client.handle_set_keywords(room, event, "stackexchange", "dot,/[/"))
+
+    assert replies[0].startswith("Invalid keyword")
+    assert store.find_checker(store.find_user("@alice:example"), "stackexchange")["keywords"] == ["dot"]
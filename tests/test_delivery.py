@@ -0,0 +1,158 @@
+import asyncio
+import sqlite3
+
+import pytest
+from nio import RoomSendError, RoomSendResponse
+
+from conftest import wait_until
+from matrix.delivery import DeliveryQueue, Outbox
+
+
+class FakeClient:
+    """Answers room_send with the queued responses, then with success."""
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.sent = []
+
+    async def room_send(self, room_id, message_type, content, tx_id=None):
+        self.sent.append((room_id, content["body"], tx_id))
+        if self.responses:
+            response = self.responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return RoomSendResponse(f"$event{len(self.sent)}", room_id)
+
+
+@pytest.fixture
+def make_queue(tmp_path, logger):
+    def make_queue(client, **settings):
+        return DeliveryQueue(client, logger, Outbox(str(tmp_path / "outbox.db")), retry_delay=0.01, max_retry_delay=0.05, **settings)
+    return make_queue
+
+
+async def drain(queue):
+    await wait_until(lambda: not len(queue.outbox))
+
+
+def test_failed_sends_are_retried_with_the_same_transaction_id(make_queue, seen):
+    client = FakeClient([ConnectionError("homeserver down"), RoomSendError("busy", status_code="M_UNKNOWN")])
+    queue = make_queue(client)
+
+    async def scenario():
+        queue.enqueue("!room:example", "source", 1, {"body": "alert"}, marker=1)
+        await drain(queue)
+        queue.stop()
+
+    asyncio.run(scenario())
+
+    assert len(client.sent) == 3
+    assert len({tx_id for _, _, tx_id in client.sent}) == 1
+    assert seen.is_seen("!room:example", "source", 1)
+    assert seen.high_water("!room:example", "source") == 1
+
+
+def test_rate_limited_sends_wait_as_long_as_asked(make_queue, seen):
+    client = FakeClient([RoomSendError("slow down", status_code="M_LIMIT_EXCEEDED", retry_after_ms=100)])
+    queue = make_queue(client)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        queue.enqueue("!room:example", "source", 1, {"body": "alert"})
+        await drain(queue)
+        queue.stop()
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 0.1
+    assert len(client.sent) == 2
+
+
+def test_pending_messages_are_delivered_after_a_restart(make_queue, seen):
+    # The first run never reaches the homeserver before it stops.
+    first = make_queue(FakeClient([ConnectionError("homeserver down")] * 100), max_attempts=100)
+
+    async def first_run():
+        first.enqueue("!room:example", "source", 1, {"body": "first"})
+        first.enqueue("!room:example", "source", 2, {"body": "second"})
+        await asyncio.sleep(0.05)
+        first.stop()
+
+    asyncio.run(first_run())
+    first_tx_ids = {body: tx_id for _, body, tx_id in first.client.sent}
+    first.outbox.close()
+
+    client = FakeClient()
+    second = make_queue(client)
+
+    async def second_run():
+        second.start()
+        await drain(second)
+        second.stop()
+
+    asyncio.run(second_run())
+
+    assert [body for _, body, _ in client.sent] == ["first", "second"]
+    # Resent with the transaction id of the first attempt, so the homeserver can deduplicate it.
+    assert client.sent[0][2] == first_tx_ids["first"]
+    assert seen.is_seen("!room:example", "source", 2)
+
+
+def test_an_item_is_only_queued_once_per_room(make_queue, seen):
+    client = FakeClient()
+    queue = make_queue(client)
+
+    async def scenario():
+        queue.enqueue("!room:example", "source", 1, {"body": "alert"})
+        queue.enqueue("!room:example", "source", 1, {"body": "alert"})
+        queue.enqueue("!other:example", "source", 1, {"body": "alert"})
+        await drain(queue)
+        queue.stop()
+
+    asyncio.run(scenario())
+
+    assert sorted(room_id for room_id, _, _ in client.sent) == ["!other:example", "!room:example"]
+
+
+def test_messages_are_dropped_after_max_attempts(make_queue, seen):
+    client = FakeClient([ConnectionError("homeserver down")] * 3)
+    queue = make_queue(client, max_attempts=3)
+
+    async def scenario():
+        queue.enqueue("!room:example", "source", 1, {"body": "alert"})
+        await drain(queue)
+        queue.stop()
+
+    asyncio.run(scenario())
+
+    assert len(client.sent) == 3
+    assert not seen.is_seen("!room:example", "source", 1)
+
+
+def test_a_room_keeps_its_worker_when_the_outbox_fails(make_queue, seen):
+    client = FakeClient()
+    queue = make_queue(client)
+    remove = queue.outbox.remove
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_remove(messages):
+        if failures:
+            raise failures.pop()
+        remove(messages)
+
+    queue.outbox.remove = flaky_remove
+
+    async def scenario():
+        queue.enqueue("!room:example", "source", 1, {"body": "first"})
+        await drain(queue)
+        queue.enqueue("!room:example", "source", 2, {"body": "second"})
+        await drain(queue)
+        queue.stop()
+
+    asyncio.run(scenario())
+
+    # The first message was sent again with its transaction id, for the homeserver to deduplicate.
+    assert [body for _, body, _ in client.sent] == ["first", "first", "second"]
+    assert client.sent[0][2] == client.sent[1][2]
+    assert seen.is_seen("!room:example", "source", 2)
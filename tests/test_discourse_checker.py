@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from multidict import CIMultiDict
+
+from data_checkers.discourse_checker import DiscourseChecker
+from utils.http_client import HttpResponse, setup_http_client
+
+PAGE_SIZE = 5
+
+
+class FakeForum:
+    """Serves /posts.json newest first, PAGE_SIZE posts per page, paged with ?before=."""
+
+    def __init__(self):
+        self.posts = []
+        self.requests = 0
+
+    def publish(self, count):
+        start = len(self.posts) + 1
+        for post_id in range(start, start + count):
+            self.posts.append({
+                "id": post_id,
+                "topic_id": post_id,
+                "post_number": 1,
+                "topic_title": f"Post {post_id}",
+                "cooked": f"<p>Body of post {post_id}</p>",
+                "username": "alice",
+                "created_at": datetime(2024, 1, 1).isoformat() + "Z",
+            })
+
+    async def get_json(self, url, params=None, headers=None, vary=()):
+        self.requests += 1
+        before = (params or {}).get("before")
+        posts = [post for post in self.posts if before is None or post["id"] < before]
+        page = list(reversed(posts))[:PAGE_SIZE]
+        return HttpResponse(200, CIMultiDict(), {"latest_posts": page}, url)
+
+
+@pytest.fixture
+def forum(logger):
+    setup_http_client({}, logger)
+    return FakeForum()
+
+
+def make_checker(forum, logger, max_pages):
+    config = {"discourse_url": "https://forum.example", "discourse_api_key": "key", "discourse_api_user": "bot", "max_pages": max_pages}
+    checker = DiscourseChecker(config, logger)
+    checker.http = forum
+    return checker
+
+
+def check(checker, min_marker):
+    last_check = datetime.now() - timedelta(days=1)
+    return asyncio.run(checker.fetch_new_items(last_check, min_marker))
+
+
+def test_paging_stops_at_the_last_routed_post(forum, logger):
+    forum.publish(30)
+    checker = make_checker(forum, logger, max_pages=10)
+
+    items = check(checker, min_marker=18)
+
+    assert [item.item_id for item in items] == list(range(30, 18, -1))
+    assert [item.marker for item in items] == [item.item_id for item in items]
+    assert forum.requests == 3
+
+
+def test_a_truncated_scan_is_resumed_without_moving_the_marker_past_the_gap(forum, logger):
+    forum.publish(40)
+    checker = make_checker(forum, logger, max_pages=2)
+    min_marker = 10
+    fetched = []
+
+    items = check(checker, min_marker)
+    fetched += items
+    # Posts 11 to 30 were not read, so the high-water mark must not move.
+    assert [item.item_id for item in items] == list(range(40, 30, -1))
+    assert all(item.marker is None for item in items)
+
+    forum.publish(3)
+    for _ in range(5):
+        items = check(checker, min_marker)
+        fetched += items
+        markers = [item.marker for item in items if item.marker is not None]
+        if markers:
+            min_marker = max(markers)
+            break
+
+    # Every post of the gap was read; the newest one is handed back once more to carry the marker.
+    assert sorted(set(item.item_id for item in fetched)) == list(range(11, 44))
+    assert min_marker == 43
+    assert check(checker, min_marker) == []
+
+
+def test_post_text_is_escaped_in_the_html_body(forum, logger):
+    forum.publish(1)
+    forum.posts[0]["cooked"] = "<p>&lt;a href='https://evil.example'&gt;click&lt;/a&gt;</p>"
+    checker = make_checker(forum, logger, max_pages=1)
+    [item] = check(checker, min_marker=0)
+
+    content = checker.format_message(item, ["click"])
+
+    assert "<a href='https://evil.example'>" in content["body"]
+    assert "&lt;a href=&#x27;https://evil.example&#x27;&gt;click&lt;/a&gt;" in content["formatted_body"]
@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from open_governance import enrichment
+from open_governance.enrichment import ReferendumEnricher
+from open_governance.open_governance import OpenGovernance2
+from utils.http_client import HttpError, HttpResponse
+
+
+class FakeHttp:
+    """Answers every request with the next of the given responses."""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = 0
+
+    async def get_json(self, url, params=None, headers=None, **kwargs):
+        self.requests += 1
+        status, data = self.responses.pop(0)
+        return HttpResponse(status, {}, data, url)
+
+
+def test_non_json_polkassembly_body_is_not_cached(monkeypatch, logger):
+    http = FakeHttp((200, None), (200, {"title": "Treasury", "content": "Fund it"}))
+    monkeypatch.setattr(enrichment, "get_http_client", lambda: http)
+    enricher = ReferendumEnricher(logger)
+
+    first = asyncio.run(enricher.fetch("polkadot", 1, "https://polkassembly/1"))
+    second = asyncio.run(enricher.fetch("polkadot", 1, "https://polkassembly/1"))
+
+    assert first["title"] == "None"
+    assert second == {"title": "Treasury", "content": "Fund it"}
+    assert http.requests == 2
+
+
+def test_subsquare_http_errors_propagate(logger):
+    governance = object.__new__(OpenGovernance2)
+    governance.network = "polkadot"
+    governance.subsquare_url = "https://subsquare"
+    governance.logger = logger
+    governance.http = FakeHttp((502, None))
+
+    async def scan():
+        async for _ in governance.iter_new_referenda(datetime(2024, 1, 1)):
+            pass
+
+    with pytest.raises(HttpError) as error:
+        asyncio.run(scan())
+    assert error.value.status == 502
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from email.utils import formatdate
+
+import pytest
+
+from utils.host_policy import HostPolicy, HostUnavailable, TokenBucket, parse_retry_after
+
+
+def make_policy(logger, **settings):
+    return HostPolicy("api.example", logger, **dict({"failure_threshold": 2, "cooldown": 10, "max_cooldown": 30}, **settings))
+
+
+def end_cooldown(policy):
+    policy.open_until = time.monotonic() - 1
+
+
+def test_the_token_bucket_allows_a_burst_then_spaces_requests():
+    bucket = TokenBucket(rate=10, capacity=2)
+
+    assert [bucket.reserve() for _ in range(2)] == [0, 0]
+    # Reservations ahead of time queue up behind each other.
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_retry_after_is_read_as_seconds_or_as_a_date():
+    assert parse_retry_after("12") == 12
+    assert parse_retry_after(formatdate(time.time() + 60, usegmt=True)) == pytest.approx(60, abs=2)
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+def test_consecutive_failures_open_the_circuit(logger):
+    policy = make_policy(logger)
+    policy.record_failure()
+    asyncio.run(policy.acquire())
+
+    policy.record_response(503, {})
+
+    with pytest.raises(HostUnavailable):
+        asyncio.run(policy.acquire())
+
+
+def test_a_single_probe_is_let_through_after_the_cooldown(logger):
+    policy = make_policy(logger)
+    policy.record_failure()
+    policy.record_failure()
+    end_cooldown(policy)
+
+    asyncio.run(policy.acquire())
+    with pytest.raises(HostUnavailable, match="probe"):
+        asyncio.run(policy.acquire())
+
+    policy.record_response(200, {})
+    asyncio.run(policy.acquire())
+    assert policy.open_until is None
+
+
+def test_a_failed_probe_reopens_the_circuit_for_longer(logger):
+    policy = make_policy(logger)
+    policy.record_failure()
+    policy.record_failure()
+    end_cooldown(policy)
+
+    asyncio.run(policy.acquire())
+    policy.record_failure()
+
+    assert policy.cooldown == 20
+    with pytest.raises(HostUnavailable, match="paused"):
+        asyncio.run(policy.acquire())
+
+
+def test_a_probe_cancelled_while_throttled_lets_the_next_probe_through(logger):
+    policy = make_policy(logger)
+    policy.record_failure()
+    policy.record_failure()
+    end_cooldown(policy)
+    policy.blocked_until = time.monotonic() + 0.05
+
+    async def scenario():
+        probe = asyncio.create_task(policy.acquire())
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        await policy.acquire()
+
+    asyncio.run(scenario())
+
+
+def test_a_bare_429_halves_the_rate(logger):
+    policy = make_policy(logger, throttled_rate=4)
+
+    policy.record_response(429, {})
+    assert policy.bucket.rate == 4
+    policy.record_response(429, {})
+    assert policy.bucket.rate == 2
+
+
+def test_rate_limit_headers_spread_the_remaining_requests(logger):
+    policy = make_policy(logger)
+
+    policy.record_response(200, {"X-RateLimit-Remaining": "30", "X-RateLimit-Reset": "60"})
+
+    assert policy.bucket.rate == pytest.approx(0.5)
+
+
+def test_waiting_longer_than_max_wait_is_refused(logger):
+    policy = make_policy(logger, max_wait=1)
+
+    policy.record_response(429, {"Retry-After": "120"})
+
+    with pytest.raises(HostUnavailable, match="rate limited"):
+        asyncio.run(policy.acquire())
@@ -0,0 +1,100 @@
+import random
+import re
+
+import pytest
+
+from utils import matcher
+from utils.matcher import KeywordMatcher, get_matcher, prune_matchers
+
+
+def naive_find_all(keywords, text, whole_word=False):
+    """The matches KeywordMatcher has to agree with, one keyword at a time."""
+    matched = []
+    for keyword in dict.fromkeys(keywords):
+        if len(keyword) > 2 and keyword.startswith("/") and keyword.endswith("/"):
+            pattern = keyword[1:-1]
+        elif keyword.strip():
+            pattern = re.escape(keyword.casefold())
+            if whole_word:
+                pattern = rf"(?<![\w]){pattern}(?![\w])"
+        else:
+            continue
+        if re.search(pattern, text.casefold() if not keyword.startswith("/") else text, re.IGNORECASE):
+            matched.append(keyword)
+    return matched
+
+
+def test_overlapping_keywords_are_all_found():
+    keywords = ["he", "she", "hers", "his"]
+
+    assert KeywordMatcher(keywords).find_all("Ushers") == ["he", "she", "hers"]
+
+
+def test_matching_ignores_case_and_keeps_the_keywords_as_written():
+    assert KeywordMatcher(["Polkadot", "polkadot", "DOT"]).find_all("POLKADOT dot") == ["Polkadot", "polkadot", "DOT"]
+
+
+def test_whole_word_keywords_need_word_boundaries():
+    keyword_matcher = KeywordMatcher(["stak", "staking", "new year"], whole_word=True)
+
+    assert keyword_matcher.find_all("Staking in the new year!") == ["staking", "new year"]
+    assert keyword_matcher.find_all("unstaking_rewards, newyear") == []
+    # A later, whole-word occurrence still counts.
+    assert keyword_matcher.find_all("stakes and stak") == ["stak"]
+
+
+def test_regex_keywords():
+    keyword_matcher = KeywordMatcher(["/ref(erendum)? #?\\d+/", "dot"])
+
+    assert keyword_matcher.find_all("Vote on Referendum 42") == ["/ref(erendum)? #?\\d+/"]
+    assert keyword_matcher.find_all("ref #7 about dot") == ["/ref(erendum)? #?\\d+/", "dot"]
+
+
+def test_an_invalid_regex_is_rejected_without_changing_the_keywords():
+    keyword_matcher = KeywordMatcher(["dot"])
+
+    with pytest.raises(re.error):
+        keyword_matcher.update(["/[/"])
+    assert keyword_matcher.find_all("dot") == ["dot"]
+
+
+def test_update_adds_and_removes_keywords():
+    keyword_matcher = KeywordMatcher(["polkadot", "kusama"])
+
+    keyword_matcher.update(["kusama", "kus", "/para ?chain/"])
+
+    assert keyword_matcher.find_all("polkadot and kusama parachains") == ["kusama", "kus", "/para ?chain/"]
+    keyword_matcher.update([])
+    assert keyword_matcher.find_all("polkadot and kusama") == []
+
+
+def test_repeated_updates_do_not_grow_the_automaton():
+    keyword_matcher = KeywordMatcher([])
+
+    for round_number in range(100):
+        keyword_matcher.update([f"keyword{round_number}", f"other{round_number}"])
+
+    assert len(keyword_matcher._goto) < 100
+    assert keyword_matcher.find_all("keyword99 other99 keyword98") == ["keyword99", "other99"]
+
+
+def test_matches_agree_with_a_naive_search():
+    rng = random.Random(7)
+    alphabet = "ab c_"
+    for _ in range(300):
+        keywords = ["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        keyword_matcher = KeywordMatcher(keywords, whole_word=rng.random() < 0.5)
+        for _ in range(5):
+            keyword_matcher.update(rng.sample(keywords, rng.randint(0, len(keywords))))
+            text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 30)))
+            assert keyword_matcher.find_all(text) == naive_find_all(keyword_matcher.keywords, text, keyword_matcher.whole_word)
+
+
+def test_stale_matchers_are_pruned():
+    matcher._matchers.clear()
+    get_matcher(("alice", "!a", "source"), ["dot"])
+    get_matcher(("bob", "!b", "source"), ["ksm"])
+
+    assert prune_matchers([("alice", "!a", "source")]) == 1
+    assert list(matcher._matchers) == [("alice", "!a", "source")]
+    matcher._matchers.clear()
@@ -0,0 +1,86 @@
+import asyncio
+
+from conftest import wait_until
+from utils.profiler import CycleProfiler
+
+
+def make_profiler(tmp_path, logger, sources=("a", "b"), **kwargs):
+    profiler = CycleProfiler(output_dir=str(tmp_path / "profiles"), **kwargs)
+    profiler.logger = logger
+    profiler.source_keys = lambda: sources
+    return profiler
+
+
+async def pages():
+    for page in range(3):
+        await asyncio.sleep(0.001)
+        yield page
+
+
+def test_hooks_do_nothing_outside_a_session(tmp_path, logger):
+    profiler = make_profiler(tmp_path, logger)
+
+    async def main():
+        with profiler.span("request"):
+            await asyncio.sleep(0)
+        profiler.source_checked("a")
+        return [page async for page in profiler.iterate("fetch", pages())]
+
+    assert asyncio.run(main()) == [0, 1, 2]
+    assert profiler._spans == {}
+    assert not profiler.active
+
+
+def test_start_is_refused_without_sources_or_while_running(tmp_path, logger):
+    profiler = make_profiler(tmp_path, logger)
+    profiler.source_keys = None
+
+    async def main():
+        assert not profiler.start(1)
+        profiler.source_keys = lambda: ("a",)
+        assert profiler.start(1)
+        assert not profiler.start(1)
+        profiler.finish()
+
+    asyncio.run(main())
+
+
+def test_session_ends_once_every_source_was_checked(tmp_path, logger):
+    profiler = make_profiler(tmp_path, logger)
+    summaries = []
+
+    async def on_done(summary):
+        summaries.append(summary)
+
+    async def main():
+        assert profiler.start(2, on_done)
+        for _ in range(2):
+            async for _ in profiler.iterate("fetch a", pages()):
+                with profiler.span("route a"):
+                    pass
+            profiler.source_checked("a")
+        assert profiler.active
+        profiler.source_checked("b")
+        profiler.source_checked("b")
+        assert not profiler.active
+        await wait_until(lambda: summaries)
+
+    asyncio.run(main())
+    assert "Profiled 4 source checks" in summaries[0]
+    assert "fetch a" in summaries[0]
+    written = sorted(path.suffix for path in (tmp_path / "profiles").iterdir())
+    assert written == [".prof", ".txt"]
+    report = next((tmp_path / "profiles").glob("*.txt")).read_text()
+    assert "fetch a: 8," in report
+    assert "route a: 6," in report
+
+
+def test_session_ends_after_max_duration(tmp_path, logger):
+    profiler = make_profiler(tmp_path, logger, max_duration=0.05)
+
+    async def main():
+        profiler.start(100)
+        await wait_until(lambda: not profiler.active)
+
+    asyncio.run(main())
+    assert list((tmp_path / "profiles").glob("*.txt"))
@@ -0,0 +1,181 @@
+import asyncio
+
+from open_governance.referenda_events import ReferendaSubscription
+from open_governance.referenda_state import ReferendaState
+
+PREFIX = "0xprefix"
+
+
+class FakeSubstrate:
+    """Serves Referenda.ReferendumInfoFor from a dict of raw values by index, one state per block."""
+
+    def __init__(self):
+        self.values = {}
+        self.requests = []
+        self.read = []
+        self.decoded = []
+
+    def get_block_hash(self, block_number):
+        return f"0xblock{block_number}"
+
+    def get_chain_head(self):
+        return "0xblock1"
+
+    def get_block_number(self, block_hash):
+        return int(block_hash[len("0xblock"):])
+
+    def query(self, module, storage_function, block_hash=None):
+        return type("Value", (), {"value": max(self.values, default=-1) + 1})()
+
+    def create_storage_key(self, module, storage_function):
+        return type("StorageKey", (), {"to_hex": lambda self: PREFIX})()
+
+    def rpc_request(self, method, params):
+        self.requests.append(method)
+        keys = {ReferendaState._storage_key(self.state, index): value for index, value in self.values.items()}
+        if method == "state_getKeysPaged":
+            prefix, count, start_key, _ = params
+            return {"result": [key for key in sorted(keys) if key > start_key][:count]}
+        self.read.extend(ReferendaState._index_of(key) for key in params[0])
+        return {"result": [{"block": params[1], "changes": [[key, keys.get(key)] for key in params[0]]}]}
+
+    def get_metadata_storage_function(self, module, storage_function, block_hash=None):
+        return type("StorageFunction", (), {"get_value_type_string": lambda self: "ReferendumInfo"})()
+
+    def decode_scale(self, type_string, scale_bytes, block_hash=None):
+        self.decoded.append(scale_bytes)
+        return {"Ongoing": scale_bytes}
+
+
+class FakeConnection:
+    network = "kusama"
+    url = "ws://127.0.0.1:9944"
+
+    def __init__(self, substrate):
+        self.substrate = substrate
+
+    async def run(self, func):
+        return func(self.substrate)
+
+
+def make_state(logger, page_size=2):
+    substrate = FakeSubstrate()
+    state = ReferendaState(FakeConnection(substrate), logger, page_size=page_size)
+    state._prefix = PREFIX
+    substrate.state = state
+    return substrate, state
+
+
+def test_first_sync_pages_keys_and_decodes_only_ongoing(logger):
+    substrate, state = make_state(logger)
+    substrate.values = {0: "0x01aa", 1: "0x00bb", 2: "0x00cc", 3: "0x02dd", 4: "0x00ee"}
+
+    changes = asyncio.run(state.sync("0xblock1"))
+
+    assert sorted(state.ongoing) == [1, 2, 4]
+    assert changes.started == [1, 2, 4]
+    assert sorted(substrate.decoded) == ["0x00bb", "0x00cc", "0x00ee"]
+    assert substrate.requests.count("state_getKeysPaged") == 3
+
+
+def test_later_syncs_read_only_ongoing_and_new_referenda(logger):
+    substrate, state = make_state(logger)
+    substrate.values = {0: "0x01aa", 1: "0x00bb", 2: "0x00cc"}
+    asyncio.run(state.sync("0xblock1"))
+    substrate.requests.clear()
+    substrate.read.clear()
+    substrate.decoded.clear()
+
+    substrate.values.update({1: "0x01bb", 2: "0x00cd", 3: "0x00dd"})
+    changes = asyncio.run(state.sync("0xblock2"))
+
+    assert (changes.started, changes.updated, changes.ended) == ([3], [2], [1])
+    # Referenda 1 and 2 were ongoing and 3 is new; 0 is final and never read again.
+    assert "state_getKeysPaged" not in substrate.requests
+    assert sorted(substrate.read) == [1, 2, 3]
+    assert sorted(substrate.decoded) == ["0x00cd", "0x00dd"]
+
+
+def test_synced_blocks_are_answered_from_the_cache(logger):
+    substrate, state = make_state(logger)
+    substrate.values = {0: "0x00aa"}
+    asyncio.run(state.sync("0xblock1"))
+    substrate.values[1] = "0x00bb"
+    asyncio.run(state.sync("0xblock2"))
+    substrate.requests.clear()
+
+    assert list(asyncio.run(state.ongoing_at("0xblock1"))) == [0]
+    assert substrate.requests == []
+
+
+class FakeOpenGovernance:
+    def __init__(self, connection, state):
+        self.connection = connection
+        self.referenda_state = state
+
+    async def referenda_changes(self, block_hash=None):
+        return await self.referenda_state.sync(block_hash)
+
+
+def test_push_mode_catches_up_on_missed_blocks(logger):
+    substrate, state = make_state(logger)
+    subscription = ReferendaSubscription(FakeOpenGovernance(state.connection, state), logger)
+    dispatched = []
+
+    async def handler(indexes):
+        dispatched.append(indexes)
+
+    subscription.add_handler(handler)
+
+    async def scenario():
+        substrate.values = {0: "0x00aa"}
+        await subscription.process_block(1)
+        substrate.values[1] = "0x00bb"
+        await subscription.process_block(2)
+        # Blocks 3 to 9 were missed while the websocket was down.
+        substrate.values.update({0: "0x01aa", 2: "0x00cc", 3: "0x00dd"})
+        await subscription.process_block(10)
+        await asyncio.sleep(0)
+
+    asyncio.run(scenario())
+
+    # Referendum 0 was already ongoing when the subscription started.
+    assert dispatched == [[1], [2, 3]]
+    assert subscription.last_block == 10
+
+
+class FlakyListener:
+    """A block subscription that fails, cannot reconnect once, and then delivers one header."""
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+        self.attempts = 0
+        self.substrate = self
+
+    def subscribe_block_headers(self, on_header):
+        self.attempts += 1
+        if self.attempts < 3:
+            raise ConnectionError("websocket closed")
+        on_header({"header": {"number": 5}}, 0, "sub")
+        self.subscription._stopped.set()
+
+    def reconnect(self):
+        raise ConnectionError("node unreachable")
+
+    def close(self):
+        pass
+
+
+def test_the_block_listener_survives_failed_reconnects(logger):
+    _, state = make_state(logger)
+    subscription = ReferendaSubscription(FakeOpenGovernance(state.connection, state), logger, retry_delay=0.01)
+    subscription.listener = FlakyListener(subscription)
+
+    async def scenario():
+        blocks = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, subscription._listen, loop, blocks)
+        return await asyncio.wait_for(blocks.get(), 1)
+
+    assert asyncio.run(scenario()) == 5
+    assert subscription.listener.attempts == 3
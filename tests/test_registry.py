@@ -0,0 +1,58 @@
+import sys
+
+import pytest
+
+from data_checkers import DataChecker, SourceConfigError
+from data_checkers.registry import CheckerRegistry
+
+
+class FakeLogger:
+    def __init__(self):
+        self.errors = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+
+def test_checker_modules_are_imported_on_first_lookup(monkeypatch):
+    monkeypatch.delitem(sys.modules, "data_checkers.discourse_checker", raising=False)
+    registry = CheckerRegistry(FakeLogger())
+
+    assert set(registry) == {"discourse", "governance", "stackexchange"}
+    assert "data_checkers.discourse_checker" not in sys.modules
+    assert registry["discourse"].checker_type == "discourse"
+    assert "data_checkers.discourse_checker" in sys.modules
+
+
+def test_unavailable_checkers_are_none_and_reported_once():
+    logger = FakeLogger()
+    registry = CheckerRegistry(logger, {
+        "missing_module": "data_checkers.no_such_checker:NoSuchChecker",
+        "missing_class": "data_checkers.discourse_checker:NoSuchChecker",
+    })
+
+    assert registry.get("missing_module") is None
+    assert registry.get("missing_module") is None
+    assert registry.get("missing_class") is None
+    assert registry.get("unknown") is None
+    assert len(logger.errors) == 2
+
+
+class ForumChecker(DataChecker):
+    required_settings = ("forum_url",)
+
+
+@pytest.mark.parametrize("source_config, error", [
+    ({"forum_url": "https://forum"}, "missing keywords"),
+    ({"keywords": ["dot"]}, "missing forum_url"),
+    ({"keywords": "dot", "forum_url": "https://forum"}, "keywords must be a list of strings"),
+    ({"keywords": ["dot", 1], "forum_url": "https://forum"}, "keywords must be a list of strings"),
+])
+def test_prepare_rejects_unusable_stanzas(source_config, error):
+    with pytest.raises(SourceConfigError, match=error):
+        ForumChecker.prepare(source_config)
+
+
+def test_prepare_accepts_a_complete_stanza():
+    source_config = {"keywords": ["dot"], "forum_url": "https://forum"}
+    assert ForumChecker.prepare(source_config) == source_config
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from utils.response_cache import SingleFlightCache
+
+
+def test_concurrent_callers_share_one_fetch():
+    cache = SingleFlightCache(ttl=0)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "result"
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(scenario()) == ["result"] * 5
+    assert len(calls) == 1
+
+
+def test_cancelling_the_fetching_caller_does_not_cancel_the_waiters():
+    cache = SingleFlightCache(ttl=0)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def scenario():
+        owner = asyncio.create_task(cache.get("key", fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get("key", fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+        return await asyncio.gather(*waiters)
+
+    # The first waiter fetched again and the others shared its request.
+    assert asyncio.run(scenario()) == [2, 2, 2]
+    assert len(calls) == 2
+    assert cache._in_flight == {}
+
+
+def test_cancelling_a_waiter_leaves_the_fetch_running():
+    cache = SingleFlightCache(ttl=0)
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "result"
+
+    async def scenario():
+        owner = asyncio.create_task(cache.get("key", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get("key", fetch))
+        await asyncio.sleep(0.005)
+        waiter.cancel()
+        return await owner
+
+    assert asyncio.run(scenario()) == "result"
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    cache = SingleFlightCache(ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("upstream failed")
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get("key", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+    asyncio.run(scenario())
+    assert len(calls) == 2
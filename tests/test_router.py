@@ -0,0 +1,156 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from data_checkers import DataChecker, FeedItem
+from data_checkers.discourse_checker import DiscourseChecker
+from data_checkers.router import SubscriptionRouter
+from utils import matcher
+from utils.http_client import setup_http_client
+from utils.state import setup_state_store
+
+
+class FakeChecker(DataChecker):
+    """Serves the items of `FakeChecker.items` and records the cursors it was asked for."""
+
+    checker_type = "fake"
+    required_settings = ("site",)
+    items = []
+    calls = []
+
+    def __init__(self, source_config, logger):
+        self.source_config = source_config
+        self.logger = logger
+
+    @staticmethod
+    def sources(checker_config):
+        return [(f"fake:{checker_config['site']}", checker_config)]
+
+    async def fetch_new_items(self, last_check, min_marker=None):
+        self.calls.append((last_check, min_marker))
+        return list(self.items)
+
+    def format_message(self, item, matched_keywords):
+        return {"msgtype": "m.text", "body": f"{item.title} ({', '.join(matched_keywords)})"}
+
+
+@pytest.fixture
+def stores(tmp_path, logger, seen):
+    config = {"state": {"path": str(tmp_path / "state.json")}}
+    # Checkers take the shared client when created; its session is only opened by a request.
+    setup_http_client(config, logger)
+    state = setup_state_store(config, logger)
+    FakeChecker.items = []
+    FakeChecker.calls = []
+    return seen, state
+
+
+def user(name, keywords, **checker_settings):
+    checker_config = dict({"checker_type": "fake", "site": "example", "keywords": keywords}, **checker_settings)
+    return {"name": name, "matrix_room_id": f"!{name}:example", "checkers": [checker_config]}
+
+
+def test_items_are_routed_to_every_matching_room_once(stores, delivery, logger):
+    config = {"users": [
+        user("alice", ["polkadot", "staking"]),
+        user("bob", ["staking"]),
+        user("carol", ["kusama"]),
+        user("dave", ["stak"], whole_word=True),
+    ]}
+    router = SubscriptionRouter(config, {"fake": FakeChecker}, logger, delivery=delivery)
+    FakeChecker.items = [
+        FeedItem(1, "Polkadot staking update", "", "https://example/1", marker=1),
+        FeedItem(2, "Unrelated", "nothing to see", "https://example/2", marker=2),
+    ]
+
+    asyncio.run(router.check_source("fake:example"))
+
+    # One feed for the shared source, fetched once for all four subscribers.
+    assert list(router.feeds) == ["fake:example"]
+    assert len(FakeChecker.calls) == 1
+    assert sorted(delivery.messages) == [
+        ("!alice:example", 1, "Polkadot staking update (polkadot, staking)"),
+        ("!bob:example", 1, "Polkadot staking update (staking)"),
+    ]
+
+
+def test_rooms_that_already_got_an_item_are_skipped(stores, delivery, logger):
+    seen, _ = stores
+    seen.mark_seen("!alice:example", "fake:example", 1)
+    router = SubscriptionRouter({"users": [user("alice", ["dot"]), user("bob", ["dot"])]}, {"fake": FakeChecker}, logger, delivery=delivery)
+    FakeChecker.items = [FeedItem(1, "dot", "", "https://example/1")]
+
+    asyncio.run(router.check_source("fake:example"))
+
+    assert [message[0] for message in delivery.messages] == ["!bob:example"]
+
+
+def test_the_high_water_mark_is_passed_to_the_next_check(stores, delivery, logger):
+    router = SubscriptionRouter({"users": [user("alice", ["dot"])]}, {"fake": FakeChecker}, logger, delivery=delivery)
+    FakeChecker.items = [FeedItem(7, "dot", "", "https://example/7", marker=7)]
+
+    asyncio.run(router.check_source("fake:example"))
+    asyncio.run(router.check_source("fake:example"))
+
+    assert [min_marker for _, min_marker in FakeChecker.calls] == [None, 7]
+
+
+def test_per_user_cursors_are_used_until_the_source_has_its_own(stores, delivery, logger):
+    _, state = stores
+    state.set_last_check("alice_fake", datetime(2024, 1, 2))
+    state.set_last_check("bob_fake", datetime(2024, 1, 1))
+    router = SubscriptionRouter({"users": [user("alice", ["dot"]), user("bob", ["dot"])]}, {"fake": FakeChecker}, logger, delivery=delivery)
+
+    asyncio.run(router.check_source("fake:example"))
+    asyncio.run(router.check_source("fake:example"))
+
+    # The earliest per-user cursor first, then the source's own cursor set by the first check.
+    first, second = [last_check for last_check, _ in FakeChecker.calls]
+    assert first == datetime(2024, 1, 1)
+    assert second > first
+
+
+def test_legacy_discourse_cursor_keys(stores, delivery, logger):
+    forum = {"discourse_url": "https://forum.example", "discourse_api_key": "key", "discourse_api_user": "bot", "keywords": ["dot"]}
+    config = {"users": [
+        {"name": "alice", "matrix_room_id": "!alice:example", "checkers": [{"checker_type": "discourse", "forums": [dict(forum, name="Forum")]}]},
+        # A forum without a name has no per-forum cursor to fall back to.
+        {"name": "bob", "matrix_room_id": "!bob:example", "checkers": [{"checker_type": "discourse", "forums": [forum]}]},
+    ]}
+    router = SubscriptionRouter(config, {"discourse": DiscourseChecker}, logger, delivery=delivery)
+
+    [feed] = router.feeds.values()
+    assert router.legacy_cursor_keys(feed) == ["alice_discourse_Forum", "alice_discourse", "bob_discourse"]
+
+
+def test_discourse_forums_are_only_shared_with_the_same_credentials(stores, delivery, logger):
+    forum = {"discourse_url": "https://forum.example", "discourse_api_key": "key", "discourse_api_user": "bot", "keywords": ["dot"]}
+    config = {"users": [
+        {"name": "alice", "matrix_room_id": "!alice:example", "checkers": [{"checker_type": "discourse", "forums": [forum]}]},
+        {"name": "bob", "matrix_room_id": "!bob:example", "checkers": [{"checker_type": "discourse", "forums": [forum]}]},
+        {"name": "carol", "matrix_room_id": "!carol:example", "checkers": [{"checker_type": "discourse", "forums": [dict(forum, discourse_api_user="carol")]}]},
+    ]}
+    router = SubscriptionRouter(config, {"discourse": DiscourseChecker}, logger, delivery=delivery)
+
+    assert sorted(len(feed.subscriptions) for feed in router.feeds.values()) == [1, 2]
+
+
+def test_a_bad_stanza_only_skips_its_own_subscription(stores, delivery, logger):
+    config = {"users": [
+        user("alice", ["dot"]),
+        {"name": "bob", "matrix_room_id": "!bob:example", "checkers": [{"checker_type": "fake", "site": "example"}]},
+        user("carol", "dot"),
+        {"name": "dave", "matrix_room_id": "!dave:example", "checkers": [{"checker_type": "missing", "keywords": ["dot"]}]},
+    ]}
+    router = SubscriptionRouter(config, {"fake": FakeChecker}, logger, delivery=delivery)
+
+    assert [subscription.user["name"] for subscription in router.feeds["fake:example"].subscriptions] == ["alice"]
+
+
+def test_matchers_of_removed_subscriptions_are_dropped_on_reload(stores, delivery, logger):
+    router = SubscriptionRouter({"users": [user("alice", ["dot"]), user("bob", ["ksm"])]}, {"fake": FakeChecker}, logger, delivery=delivery)
+
+    router.update({"users": [user("alice", ["dot"])]})
+
+    assert [key[0] for key in matcher._matchers] == ["alice"]
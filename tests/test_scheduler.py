@@ -0,0 +1,97 @@
+import asyncio
+
+from conftest import wait_until
+from utils.scheduler import PollScheduler
+
+
+def run_scheduler(scheduler, until):
+    async def main():
+        runner = asyncio.create_task(scheduler.run())
+        try:
+            await wait_until(until)
+        finally:
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+
+    asyncio.run(main())
+
+
+def test_failing_job_keeps_running(logger):
+    scheduler = PollScheduler(logger, jitter=0)
+
+    async def fail():
+        raise RuntimeError("boom")
+
+    job = scheduler.add_job("failing", 0.01, fail)
+    run_scheduler(scheduler, lambda: job.runs >= 3)
+
+    assert job.failures == job.runs
+
+
+def test_hung_job_times_out_without_delaying_others(logger):
+    scheduler = PollScheduler(logger, jitter=0)
+
+    async def hang():
+        await asyncio.sleep(10)
+
+    async def poll():
+        pass
+
+    hung = scheduler.add_job("hung", 0.01, hang, timeout=0.05)
+    fast = scheduler.add_job("fast", 0.01, poll)
+    run_scheduler(scheduler, lambda: hung.timeouts >= 1 and fast.runs >= 5)
+
+    assert fast.failures == 0
+
+
+def test_cancellation_from_within_a_job_is_a_failure(logger):
+    scheduler = PollScheduler(logger, jitter=0)
+
+    async def cancelled_inner_task():
+        inner = asyncio.ensure_future(asyncio.sleep(10))
+        inner.cancel()
+        await inner
+
+    job = scheduler.add_job("cancelled", 0.01, cancelled_inner_task)
+    run_scheduler(scheduler, lambda: job.runs >= 2)
+
+    assert job.failures == job.runs
+
+
+def test_parallel_runs_are_bounded(logger):
+    scheduler = PollScheduler(logger, max_parallel=2, jitter=0)
+    running = []
+    peak = []
+
+    async def poll():
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.02)
+        running.pop()
+
+    jobs = [scheduler.add_job(f"job{i}", 0.01, poll) for i in range(5)]
+    run_scheduler(scheduler, lambda: all(job.runs >= 2 for job in jobs))
+
+    assert max(peak) == 2
+
+
+def test_removed_job_stops(logger):
+    scheduler = PollScheduler(logger, jitter=0)
+    calls = []
+
+    async def poll():
+        calls.append(1)
+
+    async def main():
+        runner = asyncio.create_task(scheduler.run())
+        scheduler.add_job("removed", 0.01, poll)
+        await wait_until(lambda: len(calls) >= 2)
+        scheduler.remove_job("removed")
+        stopped_at = len(calls)
+        await asyncio.sleep(0.05)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        return stopped_at
+
+    stopped_at = asyncio.run(main())
+    assert len(calls) == stopped_at
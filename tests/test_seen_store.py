@@ -0,0 +1,63 @@
+from utils import seen_store
+from utils.seen_store import SeenStore
+
+
+def test_items_are_seen_per_room_and_source(seen):
+    seen.mark_seen("!a", "discourse:x", 1)
+
+    assert seen.is_seen("!a", "discourse:x", 1)
+    assert seen.is_seen("!a", "discourse:x", "1")
+    assert not seen.is_seen("!b", "discourse:x", 1)
+    assert not seen.is_seen("!a", "discourse:y", 1)
+
+
+def test_high_water_mark_only_rises(seen):
+    assert seen.high_water("*", "governance:polkadot") is None
+
+    seen.mark_seen("*", "governance:polkadot", 5, marker=5)
+    seen.advance_high_water("*", "governance:polkadot", 3)
+    assert seen.high_water("*", "governance:polkadot") == 5
+
+    seen.advance_high_water("*", "governance:polkadot", 7)
+    assert seen.high_water("*", "governance:polkadot") == 7
+
+
+def test_store_survives_reopening(tmp_path, logger):
+    path = str(tmp_path / "data" / "seen.db")
+    store = SeenStore(logger, path=path)
+    store.mark_seen("!a", "stackexchange:so", 42, marker=42)
+    store.close()
+
+    store = SeenStore(logger, path=path)
+    assert store.is_seen("!a", "stackexchange:so", 42)
+    assert store.high_water("!a", "stackexchange:so") == 42
+    store.close()
+
+
+def test_old_entries_are_evicted(tmp_path, logger, monkeypatch):
+    store = SeenStore(logger, path=str(tmp_path / "seen.db"), retention_days=1)
+    now = [1_000_000.0]
+    monkeypatch.setattr(seen_store.time, "time", lambda: now[0])
+    store.mark_seen("!a", "s", "old")
+    now[0] += 2 * 86400
+    store.mark_seen("!a", "s", "new")
+
+    store.evict()
+
+    assert not store.is_seen("!a", "s", "old")
+    assert store.is_seen("!a", "s", "new")
+    store.close()
+
+
+def test_store_is_capped_at_max_items(tmp_path, logger, monkeypatch):
+    store = SeenStore(logger, path=str(tmp_path / "seen.db"), max_items=3)
+    now = [1_000_000.0]
+    monkeypatch.setattr(seen_store.time, "time", lambda: now[0])
+    for item_id in range(5):
+        now[0] += 1
+        store.mark_seen("!a", "s", item_id)
+
+    store.evict()
+
+    assert [store.is_seen("!a", "s", item_id) for item_id in range(5)] == [False, False, True, True, True]
+    store.close()
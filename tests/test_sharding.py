@@ -0,0 +1,139 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+from conftest import wait_until
+from matrix.delivery import Outbox
+from utils.sharding import HashRing, RelayBacklogFull, RemoteDelivery, ShardCoordinator
+
+TOKEN = "secret"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def make_worker(tmp_path, logger):
+    def make_worker(port, auth_token=TOKEN, **settings):
+        outbox = Outbox(str(tmp_path / "outbox.shard0.db"))
+        return RemoteDelivery(logger, 0, outbox, port=port, auth_token=auth_token, retry_delay=0.02, **settings)
+    return make_worker
+
+
+def delivered(delivery):
+    return [item_id for _, item_id, _ in delivery.messages]
+
+
+def test_messages_survive_a_coordinator_restart(make_worker, delivery, logger):
+    port = free_port()
+    worker = make_worker(port=port)
+
+    async def scenario():
+        coordinator = ShardCoordinator(delivery, logger, port=port, auth_token=TOKEN)
+        await coordinator.start()
+        relay = asyncio.create_task(worker.run())
+        for item_id in range(3):
+            worker.enqueue("!room:example", "source", item_id, {"body": str(item_id)})
+        await wait_until(lambda: len(delivery.messages) == 3)
+
+        await coordinator.stop()
+        # Queued while the coordinator is down.
+        for item_id in range(3, 6):
+            worker.enqueue("!room:example", "source", item_id, {"body": str(item_id)})
+        await asyncio.sleep(0.1)
+        assert len(worker.outbox) == 3
+
+        coordinator = ShardCoordinator(delivery, logger, port=port, auth_token=TOKEN)
+        await coordinator.start()
+        await wait_until(lambda: len(worker.outbox) == 0)
+        relay.cancel()
+        await coordinator.stop()
+
+    asyncio.run(scenario())
+
+    assert delivered(delivery) == ["0", "1", "2", "3", "4", "5"]
+
+
+def test_messages_survive_a_worker_restart(make_worker, delivery, logger):
+    port = free_port()
+    # Nothing listens yet, so the message stays in the worker's outbox.
+    first = make_worker(port=port)
+    first.enqueue("!room:example", "source", 1, {"body": "alert"})
+    first.outbox.close()
+
+    async def scenario():
+        coordinator = ShardCoordinator(delivery, logger, port=port, auth_token=TOKEN)
+        await coordinator.start()
+        second = make_worker(port=port)
+        relay = asyncio.create_task(second.run())
+        await wait_until(lambda: delivered(delivery) == ["1"])
+        relay.cancel()
+        await coordinator.stop()
+
+    asyncio.run(scenario())
+
+
+def test_a_full_backlog_pushes_back_instead_of_dropping(make_worker):
+    worker = make_worker(port=free_port(), max_pending=2)
+    worker.enqueue("!room:example", "source", 1, {"body": "1"})
+    worker.enqueue("!room:example", "source", 2, {"body": "2"})
+
+    with pytest.raises(RelayBacklogFull):
+        worker.enqueue("!room:example", "source", 3, {"body": "3"})
+    assert [message.item_id for message in worker.outbox.pending()] == ["1", "2"]
+
+
+def test_a_message_resent_after_a_lost_ack_is_not_delivered_twice(delivery, seen, logger):
+    seen.mark_seen("!room:example", "source", "1")
+
+    async def scenario():
+        coordinator = ShardCoordinator(delivery, logger, port=free_port(), auth_token=TOKEN)
+        await coordinator.start()
+        reader, writer = await asyncio.open_connection(coordinator.host, coordinator.port)
+        writer.write(json.dumps({"auth": TOKEN, "shard": 0}).encode() + b"\n")
+        for row_id, item_id in ((7, "1"), (8, "2")):
+            message = {"id": row_id, "room_id": "!room:example", "source": "source", "item_id": item_id, "content": {}, "marker": None}
+            writer.write(json.dumps(message).encode() + b"\n")
+        await writer.drain()
+        replies = [json.loads(await reader.readline()) for _ in range(3)]
+        writer.close()
+        await coordinator.stop()
+        return replies
+
+    assert asyncio.run(scenario()) == ["ok", {"ack": 7}, {"ack": 8}]
+    assert delivered(delivery) == ["2"]
+
+
+def test_workers_with_a_bad_token_are_rejected(make_worker, delivery, logger):
+    port = free_port()
+    worker = make_worker(auth_token="wrong", port=port)
+    worker.enqueue("!room:example", "source", 1, {"body": "alert"})
+
+    async def scenario():
+        coordinator = ShardCoordinator(delivery, logger, port=port, auth_token=TOKEN)
+        await coordinator.start()
+        relay = asyncio.create_task(worker.run())
+        await asyncio.sleep(0.1)
+        relay.cancel()
+        await coordinator.stop()
+
+    asyncio.run(scenario())
+
+    assert delivery.messages == []
+    assert len(worker.outbox) == 1
+
+
+def test_adding_a_shard_moves_only_a_share_of_the_sources():
+    keys = [f"source{i}" for i in range(1000)]
+    before = HashRing(range(4))
+    after = HashRing(range(5))
+
+    moved = sum(before.shard_for(key) != after.shard_for(key) for key in keys)
+
+    assert moved < 350
+    assert all(after.shard_for(key) in (before.shard_for(key), 4) for key in keys)
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from datetime import datetime
+
+import pytest
+from multidict import CIMultiDict
+
+from data_checkers import stackexchange_api, stackexchange_checker
+from data_checkers.stackexchange_api import QuotaExhausted, StackExchangeClient, get_stackexchange_client
+from utils.http_client import HttpResponse, setup_http_client
+
+
+class FakeApi:
+    """Serves /questions newest first with fromdate, todate and page, and a fixed filter."""
+
+    def __init__(self):
+        self.questions = []
+        self.requests = []
+        self.quota_remaining = 10000
+        self.backoff = None
+
+    def publish(self, count, since):
+        start = len(self.questions) + 1
+        for question_id in range(start, start + count):
+            self.questions.append({"question_id": question_id, "title": f"Question {question_id}", "link": f"https://so.example/q/{question_id}",
+                                   "creation_date": since + question_id, "tags": ["dot"]})
+
+    async def get_json(self, url, params=None, headers=None, vary=(), cache_ttl=None):
+        method = url.split("/2.3/", 1)[1]
+        self.requests.append((method, params))
+        data = {"quota_remaining": self.quota_remaining, "backoff": self.backoff}
+        if method == "filters/create":
+            data["items"] = [{"filter": "!test"}]
+        elif method == "questions":
+            questions = [question for question in reversed(self.questions)
+                         if params["fromdate"] <= question["creation_date"] <= params.get("todate", 2 ** 62)]
+            page, page_size = params["page"], params["pagesize"]
+            data["items"] = questions[(page - 1) * page_size:page * page_size]
+            data["has_more"] = len(questions) > page * page_size
+        return HttpResponse(200, CIMultiDict(), data, url)
+
+
+@pytest.fixture
+def api(logger):
+    setup_http_client({}, logger)
+    stackexchange_api._clients.clear()
+    yield FakeApi()
+    stackexchange_api._clients.clear()
+
+
+def make_client(api, logger, **settings):
+    client = StackExchangeClient("key1234", logger, **settings)
+    client.http = api
+    return client
+
+
+def test_requests_stop_at_the_quota_reserve(api, logger):
+    client = make_client(api, logger, quota_reserve=100)
+    api.quota_remaining = 100
+
+    asyncio.run(client.get("info", {}, site="stackoverflow"))
+
+    with pytest.raises(QuotaExhausted):
+        asyncio.run(client.get("info", {}, site="stackoverflow"))
+
+
+def test_requests_stop_at_the_daily_budget(api, logger):
+    client = make_client(api, logger, daily_budget=2)
+
+    asyncio.run(client.get("info", {}, site="stackoverflow"))
+    asyncio.run(client.get("info", {}, site="stackoverflow"))
+
+    with pytest.raises(QuotaExhausted, match="daily budget"):
+        asyncio.run(client.get("info", {}, site="stackoverflow"))
+
+
+def test_a_requested_backoff_is_waited_out(api, logger):
+    client = make_client(api, logger)
+    api.backoff = 0.1
+
+    async def scenario():
+        await client.get("info", {}, site="stackoverflow")
+        api.backoff = None
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await client.get("info", {}, site="stackoverflow")
+        return loop.time() - started
+
+    assert asyncio.run(scenario()) >= 0.09
+
+
+def test_stanzas_sharing_a_key_share_one_client(api, logger, caplog):
+    first = get_stackexchange_client("key", logger, daily_budget=100)
+
+    with caplog.at_level(logging.WARNING):
+        second = get_stackexchange_client("key", logger, daily_budget=200)
+
+    assert first is second
+    assert second.daily_budget == 200
+    assert "settings differ" in caplog.text
+    assert get_stackexchange_client("other", logger) is not first
+
+
+def test_questions_left_unread_by_max_pages_are_read_by_the_next_checks(api, logger, monkeypatch):
+    monkeypatch.setattr(stackexchange_api, "PAGE_SIZE", 2)
+    monkeypatch.setattr(stackexchange_checker, "PAGE_SIZE", 2)
+    checker = stackexchange_checker.StackExchangeChecker({"stack_exchange_site": "stackoverflow", "stack_exchange_api_key": "key", "max_pages": 3}, logger)
+    checker.api.http = api
+    last_check = datetime.fromtimestamp(1000)
+    api.publish(10, since=1000)
+    fetched = []
+    for check in range(10):
+        fetched += asyncio.run(checker.fetch_new_items(last_check))
+        if checker._gap is None:
+            break
+        # The router moves the last check forward after every check.
+        last_check = datetime.fromtimestamp(2000 + check)
+
+    assert sorted(set(item.item_id for item in fetched)) == list(range(1, 11))
+    assert checker._gap is None
+
+
+def test_titles_are_escaped_in_the_html_body(api, logger):
+    checker = stackexchange_checker.StackExchangeChecker({"stack_exchange_site": "stackoverflow", "stack_exchange_api_key": "key"}, logger)
+    checker.api.http = api
+    api.publish(1, since=1000)
+    api.questions[0]["title"] = "Why does &lt;script&gt; run?"
+
+    [item] = asyncio.run(checker.fetch_new_items(datetime.fromtimestamp(1000)))
+    content = checker.format_message(item, ["script"])
+
+    assert "Why does <script> run?" in content["body"]
+    assert "Why does &lt;script&gt; run?" in content["formatted_body"]
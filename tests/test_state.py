@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+
+from conftest import wait_until
+from utils.state import StateStore
+
+
+def test_flush_writes_only_changed_state(tmp_path, logger):
+    path = tmp_path / "data" / "last_check.json"
+    store = StateStore(logger, path=str(path))
+    store.flush()
+    assert not path.exists()
+
+    store.set_last_check("source_a", datetime(2024, 1, 1, 12))
+    store.flush()
+    assert json.loads(path.read_text()) == {"source_a": "2024-01-01T12:00:00"}
+    assert not os.path.exists(f"{path}.tmp")
+
+    mtime = path.stat().st_mtime_ns
+    store.set_last_check("source_a", datetime(2024, 1, 1, 12))
+    store.flush()
+    assert path.stat().st_mtime_ns == mtime
+
+    assert StateStore(logger, path=str(path)).get_last_check("source_a") == datetime(2024, 1, 1, 12)
+
+
+def test_own_state_overrides_the_fallback(tmp_path, logger):
+    fallback = tmp_path / "last_check.json"
+    fallback.write_text(json.dumps({"a": "2024-01-01T00:00:00", "b": "2024-01-01T00:00:00"}))
+    path = tmp_path / "shard-0.json"
+    path.write_text(json.dumps({"b": "2024-02-01T00:00:00"}))
+
+    store = StateStore(logger, path=str(path), fallback_path=str(fallback))
+
+    assert store.get("a") == "2024-01-01T00:00:00"
+    assert store.get("b") == "2024-02-01T00:00:00"
+
+
+def test_last_check_falls_back_to_the_earliest_legacy_key(tmp_path, logger):
+    store = StateStore(logger, path=str(tmp_path / "last_check.json"))
+    store.set("alice_discourse", "2024-03-01T00:00:00")
+    store.set("bob_discourse", "2024-02-01T00:00:00")
+
+    last_check = store.get_last_check("source_x", fallback_keys=["alice_discourse", "bob_discourse", "carol_discourse"])
+
+    assert last_check == datetime(2024, 2, 1)
+
+
+def test_missing_last_check_starts_now(tmp_path, logger):
+    store = StateStore(logger, path=str(tmp_path / "last_check.json"))
+    before = datetime.now()
+
+    last_check = store.get_last_check("source_x")
+
+    assert last_check >= before
+    assert store.get("source_x") == last_check.isoformat()
+
+
+def test_run_flushes_in_the_background_and_retries_failed_writes(tmp_path, logger):
+    blocker = tmp_path / "blocker"
+    blocker.write_text("")
+    store = StateStore(logger, path=str(blocker / "last_check.json"), flush_interval=0.01)
+    store.set("a", "2024-01-01T00:00:00")
+
+    async def main():
+        runner = asyncio.create_task(store.run())
+        await asyncio.sleep(0.05)
+        # The directory could not be created, so the state is still waiting to be written.
+        assert store._dirty
+        store.path = str(tmp_path / "last_check.json")
+        await wait_until(lambda: os.path.exists(store.path))
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+
+    asyncio.run(main())
+    assert json.loads((tmp_path / "last_check.json").read_text()) == {"a": "2024-01-01T00:00:00"}
@@ -0,0 +1,46 @@
+import pytest
+
+from open_governance.substrate_pool import SubstrateConnection
+
+
+class FakeSubstrate:
+    def __init__(self, reconnect_error=None):
+        self.reconnect_error = reconnect_error
+        self.calls = 0
+
+    def close(self):
+        pass
+
+    def connect_websocket(self):
+        if self.reconnect_error:
+            raise self.reconnect_error
+
+    def rpc_request(self, method, params):
+        self.calls += 1
+        if self.calls == 1:
+            raise ConnectionError("websocket closed")
+        return {"result": method}
+
+
+def make_connection(logger, substrate):
+    connection = SubstrateConnection("ws://127.0.0.1:9944", "kusama", logger)
+    connection._substrate = substrate
+    connection._last_healthy = float("inf")
+    return connection
+
+
+def test_a_dropped_websocket_is_reopened_and_the_call_retried(logger):
+    connection = make_connection(logger, FakeSubstrate())
+
+    assert connection.call(lambda substrate: substrate.rpc_request("chain_getHead", [])) == {"result": "chain_getHead"}
+    assert connection.reconnects == 1
+
+
+def test_a_failed_reconnect_drops_the_connection_and_is_not_counted(logger):
+    connection = make_connection(logger, FakeSubstrate(reconnect_error=ConnectionError("node unreachable")))
+
+    with pytest.raises(ConnectionError):
+        connection.reconnect()
+
+    assert connection.reconnects == 0
+    assert connection._substrate is None
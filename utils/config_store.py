@@ -0,0 +1,176 @@
+# utils/config_store.py
+
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from utils.utils import load_config
+
+
+class ConfigStore:
+    """
+    The bot configuration, indexed for lookups and reloaded when the file changes.
+
+    Users are indexed by their Matrix user id, and checker stanzas by (user name, checker
+    type), so commands do not scan the config. A malformed user or checker entry is
+    logged and left out, so it cannot take the others down with it. The file is checked for changes
+    every `reload_interval` seconds; after a reload, or after `set_keywords`, every
+    registered listener is called with the new config so it can rebuild what changed.
+
+    Keywords set with `set_keywords` are kept across reloads until the bot restarts.
+    """
+
+    def __init__(self, logger, path: str = "config/config.json", reload_interval: float = 10):
+        self.logger = logger
+        self.path = path
+        self.reload_interval = reload_interval
+        self.config: Dict = {}
+        self.users_by_matrix_id: Dict[str, Dict] = {}
+        self.checkers: Dict[Tuple[str, str], Dict] = {}
+        self._keyword_overrides: Dict[Tuple[str, str], List[str]] = {}
+        self._listeners: List[Callable[[Dict], Awaitable]] = []
+        self._mtime = None
+        self._load()
+
+    def _load(self) -> None:
+        self._mtime = os.path.getmtime(self.path)
+        config = load_config(self.path)
+        if not isinstance(config, dict):
+            raise ValueError("the config is not a JSON object")
+        config["users"] = self._valid_users(config.get("users"))
+        users_by_matrix_id = {}
+        checkers = {}
+        for user in config["users"]:
+            if "matrix_user_id" in user:
+                users_by_matrix_id[user["matrix_user_id"]] = user
+            for checker_config in user["checkers"]:
+                checkers.setdefault((user["name"], checker_config["checker_type"]), checker_config)
+        for (user_name, checker_type), keywords in self._keyword_overrides.items():
+            checker_config = checkers.get((user_name, checker_type))
+            if checker_config is not None:
+                self._apply_keywords(checker_config, keywords)
+        # Only replaced once the whole config was read, so a failed reload keeps the current one.
+        self.config = config
+        self.users_by_matrix_id = users_by_matrix_id
+        self.checkers = checkers
+
+    def _valid_users(self, users) -> List[Dict]:
+        """Return the well-formed user entries with their well-formed checkers, logging the others."""
+        if not isinstance(users, list):
+            self.logger.error(f"{self.path} has no list of users")
+            return []
+        valid = []
+        for number, user in enumerate(users, 1):
+            if not isinstance(user, dict):
+                self.logger.error(f"Skipping user #{number} of {self.path}: not an object")
+                continue
+            missing = [key for key in ("name", "matrix_room_id") if key not in user]
+            if missing:
+                self.logger.error(f"Skipping user #{number} of {self.path}: missing {', '.join(missing)}")
+                continue
+            if not isinstance(user.get("checkers", []), list):
+                self.logger.error(f"Skipping user {user['name']}: checkers is not a list")
+                continue
+            checkers = []
+            for checker_config in user.get("checkers", []):
+                if isinstance(checker_config, dict) and "checker_type" in checker_config:
+                    checkers.append(checker_config)
+                else:
+                    self.logger.error(f"Skipping a checker of user {user['name']}: missing checker_type")
+            valid.append(dict(user, checkers=checkers))
+        return valid
+
+    def find_user(self, matrix_user_id: str) -> Optional[Dict]:
+        return self.users_by_matrix_id.get(matrix_user_id)
+
+    def find_checker(self, user: Dict, checker_type: str) -> Optional[Dict]:
+        return self.checkers.get((user["name"], checker_type))
+
+    def add_listener(self, listener: Callable[[Dict], Awaitable]) -> None:
+        """Call `listener` with the new config whenever it changes."""
+        self._listeners.append(listener)
+
+    @staticmethod
+    def _apply_keywords(checker_config: Dict, keywords: List[str]) -> None:
+        checker_config["keywords"] = keywords
+        # Discourse keywords are set per forum.
+        for forum in checker_config.get("forums", []):
+            forum["keywords"] = keywords
+
+    async def set_keywords(self, user: Dict, checker_type: str, keywords: List[str]) -> bool:
+        """
+        Replace the keywords of a user's checker.
+
+        Returns:
+            bool: False if the user has no checker of that type.
+        """
+        checker_config = self.find_checker(user, checker_type)
+        if checker_config is None:
+            return False
+        self._keyword_overrides[(user["name"], checker_type)] = keywords
+        self._apply_keywords(checker_config, keywords)
+        await self._notify()
+        return True
+
+    async def reload(self) -> bool:
+        """
+        Reload the config file.
+
+        Returns:
+            bool: Whether the config changed. A config that fails to load is logged and ignored.
+        """
+        previous = self.config
+        try:
+            self._load()
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Failed to reload {self.path}, keeping the current config: {str(e)}")
+            return False
+        if self.config == previous:
+            return False
+        self.logger.info(f"Reloaded {self.path}")
+        await self._notify()
+        return True
+
+    async def _notify(self) -> None:
+        for listener in self._listeners:
+            try:
+                await listener(self.config)
+            except Exception as e:
+                self.logger.error(f"Failed to apply the new config: {str(e)}")
+
+    async def run(self) -> None:
+        """Reload the config whenever the file's modification time changes, until cancelled."""
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                changed = os.path.getmtime(self.path) != self._mtime
+            except OSError:
+                continue
+            if changed:
+                await self.reload()
+
+
+_config_store: Optional[ConfigStore] = None
+
+
+def setup_config_store(logger, path: str = "config/config.json") -> ConfigStore:
+    """
+    Load the process-wide config store.
+
+    Args:
+        logger: The logger to report reloads to.
+        path (str, optional): The config file.
+
+    Returns:
+        ConfigStore: The shared store, also returned by `get_config_store()` from now on.
+    """
+    global _config_store
+    _config_store = ConfigStore(logger, path)
+    _config_store.reload_interval = _config_store.config.get("config_reload_interval", 10)
+    return _config_store
+
+
+def get_config_store() -> ConfigStore:
+    if _config_store is None:
+        raise RuntimeError("Config store has not been set up, call setup_config_store() first")
+    return _config_store
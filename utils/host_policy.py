@@ -0,0 +1,226 @@
+# utils/host_policy.py
+
+import asyncio
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+from utils import metrics
+
+CIRCUIT_OPEN = metrics.gauge("feed_http_circuit_open", "Whether requests to a host are paused after repeated failures.", ["host"])
+THROTTLE_WAIT = metrics.counter("feed_http_throttle_wait_seconds_total", "Time requests waited for a host's rate limit.", ["host"])
+REJECTED = metrics.counter("feed_http_requests_rejected_total", "Requests not sent because a host was paused or rate limited for too long.", ["host"])
+
+
+class HostUnavailable(Exception):
+    """A request was not sent because its host is paused or rate limited for longer than a request may wait."""
+
+    def __init__(self, host: str, retry_in: float, reason: str):
+        super().__init__(f"{host} is unavailable for {retry_in:.0f}s: {reason}")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, with bursts of up to `capacity` requests."""
+
+    def __init__(self, rate: float, capacity: float, tokens: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until the next token is available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self) -> float:
+        """
+        Take a token, possibly ahead of time.
+
+        Returns:
+            float: Seconds to wait before using it. Later reservations wait behind earlier ones.
+        """
+        delay = self.delay()
+        self.tokens -= 1
+        return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Return the seconds a Retry-After header asks to wait, given either as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostPolicy:
+    """
+    Rate limit and circuit breaker of one upstream host.
+
+    Requests are unlimited until the host asks otherwise. A `Retry-After` header pauses the
+    host for that long; `X-RateLimit-Remaining`/`X-RateLimit-Reset` (or `RateLimit-*`)
+    headers set a token bucket that spreads the remaining requests over the rest of the
+    window; a 429 without either halves the learned rate, starting at `throttled_rate`.
+    A learned limit is dropped after `relax_after` seconds without throttling, falling back
+    to the `rate` and `burst` configured for the host, if any.
+
+    After `failure_threshold` consecutive failures (no response, or a 5xx), the circuit
+    opens and requests fail right away with HostUnavailable for `cooldown` seconds. Then
+    a single probe request is let through: success closes the circuit, failure opens it
+    again for twice as long, up to `max_cooldown`. A request that would have to wait more
+    than `max_wait` seconds for the rate limit fails right away as well, so a throttled
+    host does not hold up the job polling it.
+    """
+
+    def __init__(self, host: str, logger, rate: Optional[float] = None, burst: Optional[float] = None,
+                 failure_threshold: int = 5, cooldown: float = 30, max_cooldown: float = 600, max_wait: float = 60,
+                 throttled_rate: float = 1, relax_after: float = 300):
+        self.host = host
+        self.logger = logger
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.max_wait = max_wait
+        self.throttled_rate = throttled_rate
+        self.relax_after = relax_after
+        self.configured_bucket = TokenBucket(rate, burst or max(1.0, rate)) if rate else None
+        self.bucket = self.configured_bucket
+        self.blocked_until = 0.0
+        self.failures = 0
+        self.cooldown = cooldown
+        self.open_until: Optional[float] = None
+        self._probing = False
+        self._throttled_at = None
+
+    async def acquire(self) -> None:
+        """
+        Wait until a request may be sent to the host.
+
+        Raises:
+            HostUnavailable: If the circuit is open, or the rate limit asks to wait longer than `max_wait`.
+        """
+        now = time.monotonic()
+        probe = self.open_until is not None
+        if probe:
+            if now < self.open_until:
+                REJECTED.inc(host=self.host)
+                raise HostUnavailable(self.host, self.open_until - now, f"paused after {self.failures} consecutive failures")
+            if self._probing:
+                REJECTED.inc(host=self.host)
+                raise HostUnavailable(self.host, self.cooldown, "waiting for a probe request to succeed")
+            self._probing = True
+
+        if self.bucket is not None and self._throttled_at is not None and now - self._throttled_at > self.relax_after:
+            self.logger.info(f"Lifting the learned rate limit of {self.host}")
+            self.bucket = self.configured_bucket
+            self._throttled_at = None
+
+        wait = max(self.blocked_until - now, self.bucket.delay() if self.bucket is not None else 0.0)
+        if wait > self.max_wait:
+            self._probing = False
+            REJECTED.inc(host=self.host)
+            raise HostUnavailable(self.host, wait, "rate limited")
+        if self.bucket is not None:
+            wait = max(self.blocked_until - now, self.bucket.reserve())
+        if wait > 0:
+            THROTTLE_WAIT.inc(wait, host=self.host)
+            try:
+                await asyncio.sleep(wait)
+            except BaseException:
+                # A probe cancelled before it was sent must not keep the next one out.
+                if probe:
+                    self._probing = False
+                raise
+
+    def record_response(self, status: int, headers: Mapping[str, str]) -> None:
+        now = time.monotonic()
+        retry_after = parse_retry_after(headers.get("Retry-After"))
+        if retry_after is not None and status in (429, 503):
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            self._throttled_at = now
+        learned = self._learn_rate_limit(headers, now)
+        if status == 429 and retry_after is None and not learned:
+            rate = self.bucket.rate / 2 if self.bucket is not None else self.throttled_rate
+            self.bucket = TokenBucket(rate, 1, tokens=0)
+            self._throttled_at = now
+            self.logger.warning(f"{self.host} is rate limiting requests, slowing down to {rate:.2f} requests/s")
+
+        if status >= 500 and retry_after is None:
+            self.record_failure()
+        elif status < 500 and status != 429:
+            self._record_success()
+
+    def _learn_rate_limit(self, headers: Mapping[str, str], now: float) -> bool:
+        remaining = headers.get("X-RateLimit-Remaining", headers.get("RateLimit-Remaining"))
+        reset = headers.get("X-RateLimit-Reset", headers.get("RateLimit-Reset"))
+        try:
+            remaining, reset = float(remaining), float(reset)
+        except (TypeError, ValueError):
+            return False
+        # Either an epoch timestamp or seconds from now.
+        reset_in = reset - time.time() if reset > 1e9 else reset
+        if reset_in <= 0:
+            return False
+        if remaining < 1:
+            self.blocked_until = max(self.blocked_until, now + reset_in)
+        else:
+            self.bucket = TokenBucket(remaining / reset_in, remaining, tokens=remaining)
+        self._throttled_at = now
+        return True
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing:
+            self._probing = False
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+            self._open("the probe request failed")
+        elif self.open_until is None and self.failures >= self.failure_threshold:
+            self._open(f"{self.failures} consecutive failures")
+
+    def _open(self, reason: str) -> None:
+        self.open_until = time.monotonic() + self.cooldown
+        CIRCUIT_OPEN.set(1, host=self.host)
+        self.logger.warning(f"Pausing requests to {self.host} for {self.cooldown:.0f}s after {reason}")
+
+    def _record_success(self) -> None:
+        self.failures = 0
+        self._probing = False
+        if self.open_until is not None:
+            self.open_until = None
+            self.cooldown = self.base_cooldown
+            CIRCUIT_OPEN.set(0, host=self.host)
+            self.logger.info(f"Resuming requests to {self.host}")
+
+    def end_request(self) -> None:
+        """Let another probe through if this one ended without a result, e.g. because it was cancelled."""
+        self._probing = False
+
+
+class HostPolicies:
+    """The HostPolicy of every host, created on first use from shared defaults and per-host overrides."""
+
+    def __init__(self, logger, settings: Optional[Dict] = None):
+        settings = dict(settings or {})
+        self.logger = logger
+        self.hosts: Dict[str, Dict] = settings.pop("hosts", {})
+        self.defaults = settings
+        self._policies: Dict[str, HostPolicy] = {}
+
+    def get(self, host: str) -> HostPolicy:
+        policy = self._policies.get(host)
+        if policy is None:
+            policy = self._policies[host] = HostPolicy(host, self.logger, **dict(self.defaults, **self.hosts.get(host, {})))
+        return policy
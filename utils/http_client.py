@@ -0,0 +1,178 @@
+# utils/http_client.py
+
+import asyncio
+from collections import namedtuple
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+from multidict import CIMultiDict
+
+from utils import metrics
+from utils.host_policy import HostPolicies
+from utils.profiler import PROFILER
+from utils.response_cache import SingleFlightCache
+
+REQUEST_DURATION = metrics.histogram("feed_http_request_duration_seconds", "Latency of upstream HTTP requests.", ["host"])
+REQUESTS = metrics.counter("feed_http_requests_total", "Upstream HTTP requests by response status.", ["host", "status"])
+REQUEST_ERRORS = metrics.counter("feed_http_request_errors_total", "Upstream HTTP requests that failed without a response.", ["host"])
+RATE_LIMITED = metrics.counter("feed_http_rate_limited_total", "Upstream HTTP requests answered with 429 Too Many Requests.", ["host"])
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, url: str):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.url = url
+
+
+class HttpResponse(namedtuple("HttpResponse", ["status", "headers", "data", "url"])):
+    __slots__ = ()
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def raise_for_status(self) -> None:
+        if self.status >= 400:
+            raise HttpError(self.status, self.url)
+
+
+class HttpClient:
+    """
+    Shared asynchronous HTTP client used by every checker.
+
+    A single aiohttp session is kept for the lifetime of the bot. Its connector keeps
+    a keep-alive pool per host, so repeated polls of the same forum or API reuse the
+    already established TLS connections instead of doing a fresh handshake per request.
+
+    Identical GET requests are coalesced: concurrent callers share one in-flight request,
+    and successful responses are reused for `cache_ttl` seconds. Responses are shared
+    between callers, so their data must be treated as read-only.
+
+    Every host has its own HostPolicy, which rate limits requests as the host asks and
+    pauses a failing host, so one unhealthy upstream does not slow down the others.
+    """
+
+    def __init__(self, logger, timeout: float = 30, connect_timeout: float = 10, max_connections: int = 100,
+                 max_connections_per_host: int = 10, keepalive_timeout: float = 60, max_concurrency: int = 20, cache_ttl: float = 30,
+                 host_policies: Optional[HostPolicies] = None):
+        self.logger = logger
+        self.host_policies = host_policies if host_policies is not None else HostPolicies(logger)
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.max_concurrency = max_concurrency
+        self.cache = SingleFlightCache(ttl=cache_ttl)
+        self._session = None
+        self._semaphore = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # The session has to be created from inside the running event loop.
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def get_json(self, url: str, params: Optional[Dict] = None, headers: Optional[Dict] = None,
+                       vary: Iterable[str] = (), cache_ttl: Optional[float] = None) -> HttpResponse:
+        """
+        Perform a GET request and decode the JSON body.
+
+        Args:
+            url (str): The URL to fetch.
+            params (Dict, optional): Query string parameters.
+            headers (Dict, optional): Extra request headers. They are not part of the cache key unless listed in `vary`.
+            vary (Iterable[str], optional): Names of headers whose values change the response, e.g. credentials.
+            cache_ttl (float, optional): Seconds to reuse a successful response. Defaults to the client's `cache_ttl`, 0 disables caching.
+
+        Returns:
+            HttpResponse: The status, headers and decoded body. `data` is None if the body is not JSON.
+        """
+        headers = headers or {}
+        key = (
+            url,
+            tuple(sorted((str(name), str(value)) for name, value in (params or {}).items())),
+            tuple((name, headers.get(name)) for name in vary),
+        )
+        return await self.cache.get(
+            key,
+            lambda: self._get_json(url, params, headers),
+            cacheable=lambda response: response.ok,
+            ttl=cache_ttl,
+        )
+
+    async def _get_json(self, url: str, params: Optional[Dict], headers: Dict) -> HttpResponse:
+        session = self._get_session()
+        host = urlsplit(url).hostname
+        policy = self.host_policies.get(host)
+        # Wait for the host's rate limit before taking a concurrency slot, so other hosts are not held up.
+        await policy.acquire()
+        try:
+            async with self._semaphore:
+                try:
+                    with REQUEST_DURATION.time(host=host), PROFILER.span(f"http {host}"):
+                        async with session.get(url, params=params, headers=headers) as response:
+                            self.logger.debug(f"GET {response.url} -> {response.status}")
+                            try:
+                                data = await response.json(content_type=None)
+                            except ValueError:
+                                data = None
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    REQUEST_ERRORS.inc(host=host)
+                    policy.record_failure()
+                    raise
+            policy.record_response(response.status, response.headers)
+        finally:
+            policy.end_request()
+        REQUESTS.inc(host=host, status=response.status)
+        if response.status == 429:
+            RATE_LIMITED.inc(host=host)
+        return HttpResponse(response.status, CIMultiDict(response.headers), data, str(response.url))
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+_http_client: Optional[HttpClient] = None
+
+
+def setup_http_client(config: Dict, logger) -> HttpClient:
+    """
+    Create the process-wide HTTP client from the optional "http" section of the config.
+
+    Args:
+        config (Dict): The bot configuration.
+        logger: The logger to report requests to.
+
+    Returns:
+        HttpClient: The shared client, also returned by `get_http_client()` from now on.
+    """
+    global _http_client
+    settings = config.get("http", {})
+    _http_client = HttpClient(
+        logger,
+        timeout=settings.get("timeout", 30),
+        connect_timeout=settings.get("connect_timeout", 10),
+        max_connections=settings.get("max_connections", 100),
+        max_connections_per_host=settings.get("max_connections_per_host", 10),
+        keepalive_timeout=settings.get("keepalive_timeout", 60),
+        max_concurrency=settings.get("max_concurrency", 20),
+        cache_ttl=settings.get("cache_ttl", 30),
+        host_policies=HostPolicies(logger, settings.get("host_policy")),
+    )
+    return _http_client
+
+
+def get_http_client() -> HttpClient:
+    if _http_client is None:
+        raise RuntimeError("HTTP client has not been set up, call setup_http_client() first")
+    return _http_client
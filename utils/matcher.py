@@ -0,0 +1,178 @@
+# utils/matcher.py
+
+import re
+from collections import deque
+from typing import Dict, Hashable, Iterable, List, Optional
+
+
+class KeywordMatcher:
+    """
+    Finds every keyword of a set in a text in a single pass.
+
+    Literal keywords, including multi-word phrases, are compiled into an Aho-Corasick
+    automaton and matched case-insensitively. With `whole_word`, a literal only matches
+    when it is not directly preceded or followed by a letter, digit or underscore.
+    Keywords written as "/pattern/" are treated as case-insensitive regular expressions.
+    """
+
+    def __init__(self, keywords: Iterable[str], whole_word: bool = False):
+        self.whole_word = whole_word
+        self.keywords: List[str] = []
+        # Trie nodes: transitions, failure link, and the literal ending at the node.
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._terminal: List[Optional[str]] = [None]
+        self._outputs: List[List[str]] = [[]]
+        self._literals: Dict[str, List[str]] = {}
+        self._regexes: List[tuple] = []
+        self.update(keywords)
+
+    def update(self, keywords: Iterable[str]) -> None:
+        """
+        Replace the keyword set.
+
+        Literals already in the automaton keep their trie nodes; only new literals are inserted
+        and removed ones are unmarked, after which the failure links are recomputed. Once most
+        nodes belong to removed literals, the automaton is rebuilt from scratch.
+        """
+        keywords = list(keywords)
+        if keywords == self.keywords:
+            return
+
+        literals: Dict[str, List[str]] = {}
+        regexes = []
+        for keyword in keywords:
+            if len(keyword) > 2 and keyword.startswith("/") and keyword.endswith("/"):
+                regexes.append((keyword, re.compile(keyword[1:-1], re.IGNORECASE)))
+            elif keyword.strip():
+                literals.setdefault(keyword.casefold(), []).append(keyword)
+
+        if len(self._goto) > 2 * (1 + sum(len(literal) for literal in literals)):
+            # Mostly nodes of removed literals, start over.
+            self._goto, self._fail, self._terminal, self._outputs = [{}], [0], [None], [[]]
+            self._literals = {}
+        for literal in self._literals.keys() - literals.keys():
+            self._terminal[self._find_node(literal)] = None
+        for literal in literals.keys() - self._literals.keys():
+            self._terminal[self._insert(literal)] = literal
+
+        self.keywords = keywords
+        self._literals = literals
+        self._regexes = regexes
+        self._build_links()
+
+    def _find_node(self, literal: str) -> int:
+        node = 0
+        for char in literal:
+            node = self._goto[node][char]
+        return node
+
+    def _insert(self, literal: str) -> int:
+        node = 0
+        for char in literal:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._terminal.append(None)
+                self._outputs.append([])
+                self._goto[node][char] = next_node
+            node = next_node
+        return node
+
+    def _build_links(self) -> None:
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        self._outputs[0] = []
+        while queue:
+            node = queue.popleft()
+            own = [self._terminal[node]] if self._terminal[node] is not None else []
+            self._outputs[node] = own + self._outputs[self._fail[node]]
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                queue.append(child)
+
+    def find_all(self, text: Optional[str]) -> List[str]:
+        """
+        Return every keyword found in `text`, in the order of the keyword set.
+
+        Args:
+            text (str): The text to search.
+
+        Returns:
+            List[str]: The matched keywords, each listed once.
+        """
+        if not text:
+            return []
+        found = set()
+        folded = text.casefold()
+        node = 0
+        for position, char in enumerate(folded):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for literal in self._outputs[node]:
+                if literal in found:
+                    continue
+                if self.whole_word and not self._is_whole_word(folded, position - len(literal) + 1, position + 1):
+                    continue
+                found.add(literal)
+
+        matched = set()
+        for literal in found:
+            matched.update(self._literals[literal])
+        for keyword, regex in self._regexes:
+            if regex.search(text):
+                matched.add(keyword)
+        return [keyword for keyword in dict.fromkeys(self.keywords) if keyword in matched]
+
+    @staticmethod
+    def _is_whole_word(text: str, start: int, end: int) -> bool:
+        before = text[start - 1] if start > 0 else " "
+        after = text[end] if end < len(text) else " "
+        return not (before.isalnum() or before == "_") and not (after.isalnum() or after == "_")
+
+
+_matchers: Dict[Hashable, KeywordMatcher] = {}
+
+
+def get_matcher(key: Hashable, keywords: Iterable[str], whole_word: bool = False) -> KeywordMatcher:
+    """
+    Return the compiled matcher of one subscription, updating it if its keywords changed.
+
+    Args:
+        key (Hashable): Identifies the subscription, e.g. (room id, source).
+        keywords (Iterable[str]): The subscription's current keywords.
+        whole_word (bool, optional): Whether literals must match whole words.
+
+    Returns:
+        KeywordMatcher: The matcher, compiled once and then updated incrementally.
+    """
+    matcher = _matchers.get(key)
+    if matcher is None or matcher.whole_word != whole_word:
+        matcher = _matchers[key] = KeywordMatcher(keywords, whole_word=whole_word)
+    else:
+        matcher.update(keywords)
+    return matcher
+
+
+def prune_matchers(live_keys: Iterable[Hashable]) -> int:
+    """
+    Drop the matchers of subscriptions that no longer exist, e.g. after a config reload.
+
+    Args:
+        live_keys (Iterable[Hashable]): The keys of every current subscription.
+
+    Returns:
+        int: The number of matchers dropped.
+    """
+    stale = _matchers.keys() - set(live_keys)
+    for key in stale:
+        del _matchers[key]
+    return len(stale)
@@ -0,0 +1,180 @@
+# utils/profiler.py
+
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+
+
+class CycleProfiler:
+    """
+    Profiles the next poll cycles on demand.
+
+    A session, started by `start()`, lasts until every polled source completed `cycles`
+    checks, or `max_duration` seconds. During a session, cProfile records the CPU time of
+    everything the event loop thread runs, tracemalloc records allocations, and `span()` adds up the wall
+    clock time of the awaits it wraps, e.g. every HTTP request and page fetch, by name.
+    When the session ends, the full results are written to `output_dir` and a short
+    summary of the top offenders is handed to the session's callback.
+
+    Outside of a session every hook returns right away.
+    """
+
+    def __init__(self, output_dir: str = "data/profiles", max_duration: float = 3600, top: int = 5):
+        self.logger = None
+        self.output_dir = output_dir
+        self.max_duration = max_duration
+        self.top = top
+        # Returns the keys of the sources checked every cycle, set once sources are started.
+        self.source_keys: Optional[Callable[[], Iterable[str]]] = None
+        self.active = False
+        self._cycles = 0
+        self._runs: Counter = Counter()
+        self._spans: Dict[str, list] = {}
+        self._profile: Optional[cProfile.Profile] = None
+        self._snapshot = None
+        self._started = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._on_done: Optional[Callable[[str], Awaitable]] = None
+
+    def start(self, cycles: int, on_done: Optional[Callable[[str], Awaitable]] = None) -> bool:
+        """
+        Start a profiling session.
+
+        Args:
+            cycles (int): How many checks of every polled source to capture.
+            on_done (Callable, optional): Coroutine function called with the summary when the session ends.
+
+        Returns:
+            bool: False if a session is already running or no sources are polled in this process.
+        """
+        if self.active or self.source_keys is None:
+            return False
+        self.active = True
+        self._cycles = cycles
+        self._runs = Counter()
+        self._spans = {}
+        self._on_done = on_done
+        self._started = time.perf_counter()
+        tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        # CPU time of the event loop thread, so waiting for I/O in the selector does not top the list.
+        self._profile = cProfile.Profile(time.thread_time)
+        self._profile.enable()
+        self._timer = asyncio.get_running_loop().call_later(self.max_duration, self.finish)
+        self.logger.info(f"Profiling the next {cycles} poll cycles")
+        return True
+
+    @contextmanager
+    def span(self, name: str):
+        """Add the wall clock time of the wrapped block to the span `name`."""
+        if not self.active:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            totals = self._spans.setdefault(name, [0, 0.0])
+            totals[0] += 1
+            totals[1] += time.perf_counter() - started
+
+    async def iterate(self, name: str, iterator: AsyncIterator) -> AsyncIterator:
+        """Yield from an async iterator, adding the wait for every item to the span `name`."""
+        iterator = iterator.__aiter__()
+        while True:
+            with self.span(name):
+                try:
+                    item = await iterator.__anext__()
+                except StopAsyncIteration:
+                    return
+            yield item
+
+    def source_checked(self, source_key: str) -> None:
+        """Count a completed check, ending the session once every polled source was checked often enough."""
+        if not self.active:
+            return
+        self._runs[source_key] += 1
+        if all(self._runs[key] >= self._cycles for key in self.source_keys()):
+            self.finish()
+
+    def finish(self) -> None:
+        if not self.active:
+            return
+        self.active = False
+        self._profile.disable()
+        if self._timer is not None:
+            self._timer.cancel()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        duration = time.perf_counter() - self._started
+
+        try:
+            summary = self._report(snapshot, duration)
+        except OSError as e:
+            summary = f"Profiling finished after {duration:.1f}s, but writing the results failed: {str(e)}"
+        self.logger.info(summary)
+        self._profile = self._snapshot = None
+        if self._on_done is not None:
+            asyncio.get_running_loop().create_task(self._on_done(summary))
+
+    def _report(self, snapshot, duration: float) -> str:
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}")
+        self._profile.dump_stats(f"{path}.prof")
+
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream).sort_stats("cumulative")
+        stats.print_stats(50)
+        memory = snapshot.compare_to(self._snapshot, "lineno")
+        spans = sorted(self._spans.items(), key=lambda span: span[1][1], reverse=True)
+        with open(f"{path}.txt", "w") as f:
+            f.write(f"Profiled {sum(self._runs.values())} source checks in {duration:.1f}s\n\n")
+            f.write("Wall clock spans (name, count, total seconds):\n")
+            for name, (count, total) in spans:
+                f.write(f"  {name}: {count}, {total:.3f}\n")
+            f.write("\nAllocations grown during the session:\n")
+            for stat in memory[:50]:
+                f.write(f"  {stat}\n")
+            f.write("\n")
+            f.write(stream.getvalue())
+
+        # The functions that took the most time themselves, rather than through their callees.
+        own_time = sorted(stats.stats.items(), key=lambda stat: stat[1][2], reverse=True)
+        lines = [f"Profiled {sum(self._runs.values())} source checks in {duration:.1f}s, results in {path}.txt"]
+        lines.append("Slowest awaits: " + ", ".join(f"{name} {total:.2f}s/{count}" for name, (count, total) in spans[:self.top]))
+        lines.append("Most CPU time: " + ", ".join(
+            f"{os.path.basename(filename)}:{line} {function} {own:.2f}s" for (filename, line, function), (_, _, own, _, _) in own_time[:self.top]))
+        lines.append("Most memory grown: " + ", ".join(
+            f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno} {stat.size_diff / 1024:+.0f} KiB"
+            for stat in memory[:self.top]))
+        return "\n".join(lines)
+
+
+PROFILER = CycleProfiler()
+
+
+def setup_profiler(config: Dict, logger) -> CycleProfiler:
+    """
+    Configure the process-wide profiler from the optional "profiling" section of the config.
+
+    Args:
+        config (Dict): The bot configuration.
+        logger: The logger to report sessions to.
+
+    Returns:
+        CycleProfiler: The shared profiler, also available as `PROFILER`.
+    """
+    settings = config.get("profiling", {})
+    PROFILER.logger = logger
+    PROFILER.output_dir = settings.get("output_dir", "data/profiles")
+    PROFILER.max_duration = settings.get("max_duration", 3600)
+    PROFILER.top = settings.get("top", 5)
+    return PROFILER
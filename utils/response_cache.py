@@ -0,0 +1,142 @@
+# utils/response_cache.py
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+
+class _FetchAbandoned(Exception):
+    """The caller running a coalesced fetch was cancelled before it finished."""
+
+
+class SingleFlightCache:
+    """
+    Coalesces identical requests.
+
+    While a request for a key is in flight, every other caller asking for the same key
+    awaits the same result instead of starting its own request. Results accepted by
+    `cacheable` are then kept for `ttl` seconds, so all subscribers polling the same
+    query within one cycle share a single upstream request.
+
+    If the caller running the request is cancelled, e.g. by its job's timeout, the callers
+    waiting for it are not: the first of them starts the request again and the others
+    wait for that one instead.
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: Dict[Hashable, Tuple[float, Any]] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]],
+                  cacheable: Callable[[Any], bool] = lambda result: True, ttl: Optional[float] = None) -> Any:
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+
+        while True:
+            in_flight = self._in_flight.get(key)
+            if in_flight is None:
+                break
+            try:
+                result = await asyncio.shield(in_flight)
+            except _FetchAbandoned:
+                continue
+            self.hits += 1
+            return result
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            # Only this caller is cancelled, the others fetch again.
+            future.set_exception(_FetchAbandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting for it.
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            if ttl > 0 and cacheable(result):
+                self._store(key, result, ttl)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def _store(self, key: Hashable, value: Any, ttl: float) -> None:
+        now = time.monotonic()
+        if len(self._entries) >= self.max_entries:
+            for stale_key in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[stale_key]
+        if len(self._entries) >= self.max_entries:
+            # Still full: drop the entry that expires first.
+            del self._entries[min(self._entries, key=lambda k: self._entries[k][0])]
+        self._entries[key] = (now + ttl, value)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+class CacheEntry:
+    __slots__ = ("value", "expires", "etag", "last_modified")
+
+    def __init__(self, value: Any, expires: float, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.value = value
+        self.expires = expires
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires > time.monotonic()
+
+
+class LRUCache:
+    """
+    Size-bounded LRU cache whose entries expire after `ttl` seconds.
+
+    Expired entries are not dropped on read: they are returned with `fresh` set to False,
+    together with the validators (ETag, Last-Modified) of the response they came from, so
+    the caller can revalidate them with a conditional request.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, CacheEntry]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: Hashable, value: Any, etag: Optional[str] = None, last_modified: Optional[str] = None) -> CacheEntry:
+        entry = CacheEntry(value, time.monotonic() + self.ttl, etag, last_modified)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry
+
+    def touch(self, key: Hashable) -> None:
+        """Mark an entry as fresh again, after the upstream confirmed it is unchanged."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires = time.monotonic() + self.ttl
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,139 @@
+# utils/scheduler.py
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from utils import metrics
+
+JOB_DURATION = metrics.histogram("feed_job_duration_seconds", "Duration of poll job runs.", ["job"])
+JOB_LAG = metrics.gauge("feed_job_lag_seconds", "Delay between the scheduled and the actual start of the last run of a poll job.", ["job"])
+JOB_RUNS = metrics.counter("feed_job_runs_total", "Poll job runs by outcome.", ["job", "outcome"])
+
+
+class ScheduledJob:
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable], timeout: Optional[float] = None):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.timeout = timeout
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.last_duration = 0.0
+
+
+class PollScheduler:
+    """
+    Runs every poll job on its own interval.
+
+    Each job has its own loop, so a slow or hung source only delays itself. At most
+    `max_parallel` jobs run at the same time, each start is spread by a random jitter of
+    up to `jitter` times the job interval, and a job that runs longer than its timeout is
+    cancelled. The lag between the scheduled and the actual start is logged for every run.
+    """
+
+    def __init__(self, logger, max_parallel: int = 4, jitter: float = 0.1, default_timeout: Optional[float] = None):
+        self.logger = logger
+        self.max_parallel = max_parallel
+        self.jitter = jitter
+        self.default_timeout = default_timeout
+        self.jobs: Dict[str, ScheduledJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._semaphore = None
+
+    def add_job(self, name: str, interval: float, func: Callable[[], Awaitable], timeout: Optional[float] = None) -> ScheduledJob:
+        """
+        Register a job, replacing any job of the same name. If the scheduler is already running,
+        the job is started right away.
+
+        Args:
+            name (str): Unique job name, used in logs.
+            interval (float): Seconds between two scheduled runs.
+            func (Callable): Coroutine function called on every run.
+            timeout (float, optional): Seconds after which a run is cancelled. Defaults to `default_timeout`.
+
+        Returns:
+            ScheduledJob: The registered job, which also holds its run statistics.
+        """
+        self.remove_job(name)
+        job = ScheduledJob(name, interval, func, timeout if timeout is not None else self.default_timeout)
+        self.jobs[name] = job
+        if self._semaphore is not None:
+            self._tasks[name] = asyncio.create_task(self._run_job(job))
+        return job
+
+    def remove_job(self, name: str) -> None:
+        """Unregister a job, cancelling it if it is running."""
+        self.jobs.pop(name, None)
+        task = self._tasks.pop(name, None)
+        if task is not None:
+            task.cancel()
+
+    async def run(self) -> None:
+        self._semaphore = asyncio.Semaphore(self.max_parallel)
+        for name, job in self.jobs.items():
+            self._tasks[name] = asyncio.create_task(self._run_job(job))
+        self.logger.info(f"Scheduler started with {len(self.jobs)} jobs")
+        try:
+            # Jobs are added and removed while the scheduler runs, so wait to be cancelled instead of for the job tasks.
+            await asyncio.get_running_loop().create_future()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    def _is_stopping(self, job: ScheduledJob) -> bool:
+        """Whether the task of `job` is being cancelled, by `remove_job`, `stop` or its owner."""
+        task = asyncio.current_task()
+        # Task.cancelling() only exists since Python 3.11.
+        cancelling = getattr(task, "cancelling", None)
+        return self._tasks.get(job.name) is not task or (cancelling is not None and cancelling() > 0)
+
+    async def _run_job(self, job: ScheduledJob) -> None:
+        loop = asyncio.get_running_loop()
+        next_run = loop.time() + job.interval
+        while True:
+            scheduled = next_run + random.uniform(0, self.jitter * job.interval)
+            await asyncio.sleep(max(0.0, scheduled - loop.time()))
+
+            async with self._semaphore:
+                job.last_lag = loop.time() - scheduled
+                job.max_lag = max(job.max_lag, job.last_lag)
+                JOB_LAG.set(job.last_lag, job=job.name)
+                self.logger.debug(f"Running job {job.name}, {job.last_lag:.3f}s behind schedule")
+                started = time.monotonic()
+                outcome = "success"
+                try:
+                    await asyncio.wait_for(job.func(), timeout=job.timeout)
+                except asyncio.TimeoutError:
+                    job.timeouts += 1
+                    outcome = "timeout"
+                    self.logger.error(f"Job {job.name} timed out after {job.timeout}s")
+                except asyncio.CancelledError:
+                    if self._is_stopping(job):
+                        raise
+                    # A cancellation escaping from the job itself, e.g. of a task it was waiting for.
+                    job.failures += 1
+                    outcome = "failure"
+                    self.logger.error(f"Job {job.name} failed: it was cancelled from within")
+                except Exception as e:
+                    job.failures += 1
+                    outcome = "failure"
+                    self.logger.error(f"Job {job.name} failed: {str(e)}")
+                job.runs += 1
+                job.last_duration = time.monotonic() - started
+                JOB_DURATION.observe(job.last_duration, job=job.name)
+                JOB_RUNS.inc(job=job.name, outcome=outcome)
+
+            # Skip the slots that were missed while the job was overrunning instead of running them back to back.
+            next_run += job.interval
+            now = loop.time()
+            if next_run < now:
+                next_run += ((now - next_run) // job.interval + 1) * job.interval
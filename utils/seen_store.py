@@ -0,0 +1,139 @@
+# utils/seen_store.py
+
+import os
+import sqlite3
+import time
+from typing import Dict, Optional
+
+
+class SeenStore:
+    """
+    On-disk record of which items were already delivered to which Matrix room.
+
+    Items are keyed by (room, source, item id), where the source names the upstream
+    feed, e.g. "stackexchange:stackoverflow". Every (room, source) pair also keeps
+    a high-water mark, the largest ordered marker (such as a referendum index) delivered
+    so far, which checkers use to stop reading upstream pages early. Entries older than
+    `retention_days` are evicted, and the table is capped at `max_items` rows.
+    """
+
+    EVICT_EVERY = 3600
+
+    def __init__(self, logger, path: str = "data/seen.db", retention_days: float = 30, max_items: int = 100000):
+        self.logger = logger
+        self.path = path
+        self.retention = retention_days * 86400
+        self.max_items = max_items
+        self._last_evict = 0.0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Shard workers share the store, so wait for their writes instead of failing.
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS seen_items ("
+            "room_id TEXT NOT NULL, source TEXT NOT NULL, item_id TEXT NOT NULL, seen_at REAL NOT NULL, "
+            "PRIMARY KEY (room_id, source, item_id)) WITHOUT ROWID"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS seen_items_seen_at ON seen_items (seen_at)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS high_water ("
+            "room_id TEXT NOT NULL, source TEXT NOT NULL, value REAL NOT NULL, "
+            "PRIMARY KEY (room_id, source)) WITHOUT ROWID"
+        )
+        self.db.commit()
+        self.evict()
+
+    def is_seen(self, room_id: str, source: str, item_id) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM seen_items WHERE room_id = ? AND source = ? AND item_id = ?",
+            (room_id, source, str(item_id)),
+        ).fetchone()
+        return row is not None
+
+    def mark_seen(self, room_id: str, source: str, item_id, marker: Optional[float] = None) -> None:
+        """
+        Record that an item was delivered to a room.
+
+        Args:
+            room_id (str): The Matrix room the item was sent to.
+            source (str): The upstream source the item came from.
+            item_id: The item's id within the source.
+            marker (float, optional): An ordered value for the item; raises the high-water mark if larger.
+        """
+        self.db.execute(
+            "INSERT OR REPLACE INTO seen_items (room_id, source, item_id, seen_at) VALUES (?, ?, ?, ?)",
+            (room_id, source, str(item_id), time.time()),
+        )
+        if marker is not None:
+            self._raise_high_water(room_id, source, marker)
+        self.db.commit()
+        if time.monotonic() - self._last_evict > self.EVICT_EVERY:
+            self.evict()
+
+    def advance_high_water(self, room_id: str, source: str, marker: float) -> None:
+        """Raise the high-water mark of a (room, source) pair without recording an item."""
+        self._raise_high_water(room_id, source, marker)
+        self.db.commit()
+
+    def _raise_high_water(self, room_id: str, source: str, marker: float) -> None:
+        self.db.execute(
+            "INSERT INTO high_water (room_id, source, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (room_id, source) DO UPDATE SET value = MAX(value, excluded.value)",
+            (room_id, source, marker),
+        )
+
+    def high_water(self, room_id: str, source: str) -> Optional[float]:
+        row = self.db.execute(
+            "SELECT value FROM high_water WHERE room_id = ? AND source = ?",
+            (room_id, source),
+        ).fetchone()
+        return row[0] if row else None
+
+    def evict(self) -> None:
+        self._last_evict = time.monotonic()
+        deleted = self.db.execute("DELETE FROM seen_items WHERE seen_at < ?", (time.time() - self.retention,)).rowcount
+        row = self.db.execute(
+            "SELECT seen_at FROM seen_items ORDER BY seen_at DESC LIMIT 1 OFFSET ?", (self.max_items,)
+        ).fetchone()
+        if row:
+            deleted += self.db.execute("DELETE FROM seen_items WHERE seen_at <= ?", (row[0],)).rowcount
+        self.db.commit()
+        if deleted:
+            self.logger.info(f"Evicted {deleted} entries from the seen-item store")
+
+    def close(self) -> None:
+        self.db.close()
+
+
+_seen_store: Optional[SeenStore] = None
+
+
+def setup_seen_store(config: Dict, logger) -> SeenStore:
+    """
+    Open the process-wide seen-item store from the optional "seen_store" section of the config.
+
+    Args:
+        config (Dict): The bot configuration.
+        logger: The logger to report evictions to.
+
+    Returns:
+        SeenStore: The shared store, also returned by `get_seen_store()` from now on.
+    """
+    global _seen_store
+    settings = config.get("seen_store", {})
+    _seen_store = SeenStore(
+        logger,
+        path=settings.get("path", "data/seen.db"),
+        retention_days=settings.get("retention_days", 30),
+        max_items=settings.get("max_items", 100000),
+    )
+    return _seen_store
+
+
+def get_seen_store() -> SeenStore:
+    if _seen_store is None:
+        raise RuntimeError("Seen-item store has not been set up, call setup_seen_store() first")
+    return _seen_store
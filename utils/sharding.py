@@ -0,0 +1,165 @@
+# utils/sharding.py
+
+import asyncio
+import bisect
+import hashlib
+import hmac
+import json
+from typing import Dict, Iterable, Optional
+
+
+class HashRing:
+    """
+    Consistent hashing of source keys onto shards.
+
+    Every shard owns `replicas` points on the ring and a key belongs to the shard owning
+    the next point after the key's hash. Changing the number of shards only moves the
+    sources whose points changed hands, about 1/N of them, instead of reshuffling all.
+    """
+
+    def __init__(self, shards: Iterable, replicas: int = 64):
+        ring = sorted((self._hash(f"{shard}#{replica}"), shard) for shard in shards for replica in range(replicas))
+        self._hashes = [point for point, _ in ring]
+        self._shards = [shard for _, shard in ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    def shard_for(self, key: str):
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._shards[index]
+
+
+class ShardCoordinator:
+    """
+    Receives the messages routed by shard workers and hands them to the delivery queue.
+
+    Workers connect over TCP and send newline-delimited JSON: a hello line carrying the
+    shared auth token and the worker's shard, answered with an "ok" line, then one line
+    per message to deliver. Every message is acknowledged with an {"ack": id} line once it
+    is in the outbox. A message sent again because its ack was lost is only queued if it
+    was neither delivered nor is still waiting.
+    """
+
+    def __init__(self, delivery, logger, host: str = "127.0.0.1", port: int = 9110, auth_token: str = ""):
+        self.delivery = delivery
+        self.logger = logger
+        self.host = host
+        self.port = port
+        self.auth_token = auth_token
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers = set()
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=2 ** 24)
+        self.logger.info(f"Waiting for shard workers on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Closing the server does not end the connections it accepted.
+            for writer in self._writers:
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info("peername")
+        self._writers.add(writer)
+        try:
+            hello = json.loads(await reader.readline() or "{}")
+            if not hmac.compare_digest(str(hello.get("auth", "")), self.auth_token):
+                self.logger.error(f"Rejected shard worker connection from {peer}: bad auth token")
+                return
+            shard = hello.get("shard")
+            writer.write(b'"ok"\n')
+            await writer.drain()
+            self.logger.info(f"Shard worker {shard} connected from {peer}")
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if not self.delivery.seen.is_seen(message["room_id"], message["source"], message["item_id"]):
+                    self.delivery.enqueue(message["room_id"], message["source"], message["item_id"], message["content"], marker=message.get("marker"))
+                writer.write(json.dumps({"ack": message["id"]}).encode() + b"\n")
+                await writer.drain()
+            self.logger.warning(f"Shard worker {shard} disconnected")
+        except (ConnectionError, ValueError) as e:
+            self.logger.error(f"Shard worker connection from {peer} failed: {str(e)}")
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class RelayBacklogFull(Exception):
+    """A shard worker cannot take more messages until the coordinator accepted some of those waiting."""
+
+
+class RemoteDelivery:
+    """
+    Stand-in for the DeliveryQueue in a shard worker: relays messages to the coordinator.
+
+    `enqueue` writes the message to the worker's own outbox; `run` keeps the connection to
+    the coordinator open, reconnecting after `retry_delay` seconds, and sends the outbox in
+    order. A message is only removed from the outbox once the coordinator acknowledged it,
+    so no message is lost when either process restarts. When `max_pending` messages are
+    waiting, `enqueue` raises RelayBacklogFull: the source check fails before its cursor
+    moves, and the items are fetched again once the backlog has drained.
+    """
+
+    def __init__(self, logger, shard, outbox, host: str = "127.0.0.1", port: int = 9110, auth_token: str = "",
+                 retry_delay: float = 5, max_pending: int = 10000):
+        self.logger = logger
+        self.shard = shard
+        self.outbox = outbox
+        self.host = host
+        self.port = port
+        self.auth_token = auth_token
+        self.retry_delay = retry_delay
+        self.max_pending = max_pending
+        self._wakeup = asyncio.Event()
+
+    def enqueue(self, room_id: str, source: str, item_id, content: Dict, marker: Optional[float] = None) -> None:
+        pending = len(self.outbox)
+        if pending >= self.max_pending:
+            raise RelayBacklogFull(f"{pending} messages are waiting for the coordinator")
+        if self.outbox.add(room_id, source, item_id, content, marker) is not None:
+            self._wakeup.set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError as e:
+                self.logger.warning(f"Cannot reach the coordinator at {self.host}:{self.port} ({str(e)}), retrying in {self.retry_delay}s")
+                await asyncio.sleep(self.retry_delay)
+                continue
+
+            try:
+                writer.write(json.dumps({"auth": self.auth_token, "shard": self.shard}).encode() + b"\n")
+                await writer.drain()
+                if json.loads(await reader.readline() or "null") != "ok":
+                    raise ConnectionError("the coordinator rejected the auth token")
+                while True:
+                    self._wakeup.clear()
+                    messages = self.outbox.pending()
+                    if not messages:
+                        await self._wakeup.wait()
+                        continue
+                    for message in messages:
+                        writer.write(json.dumps({
+                            "id": message.row_id, "room_id": message.room_id, "source": message.source,
+                            "item_id": message.item_id, "content": message.content, "marker": message.marker,
+                        }).encode() + b"\n")
+                    await writer.drain()
+                    for message in messages:
+                        if json.loads(await reader.readline() or "null") != {"ack": message.row_id}:
+                            raise ConnectionError("the coordinator did not acknowledge a message")
+                        self.outbox.remove([message])
+            except (ConnectionError, ValueError) as e:
+                self.logger.warning(f"Lost the connection to the coordinator ({str(e)}), reconnecting in {self.retry_delay}s")
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                writer.close()
@@ -0,0 +1,134 @@
+# utils/state.py
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+
+class StateStore:
+    """
+    In-memory cursor state, flushed to disk in batches.
+
+    The state file is read once at startup. Reads and writes only touch memory; a
+    background task writes the whole state every `flush_interval` seconds if anything
+    changed. Every flush goes to a temporary file that is fsynced and then renamed over
+    the state file, so a crash leaves either the old or the new state, never a torn file.
+    """
+
+    def __init__(self, logger, path: str = "data/last_check.json", flush_interval: float = 5, fallback_path: Optional[str] = None):
+        self.logger = logger
+        self.path = path
+        # Read-only state to start from, e.g. the single-process state when a shard worker first starts.
+        self.fallback_path = fallback_path
+        self.flush_interval = flush_interval
+        self._data: Dict[str, Any] = {}
+        self._dirty = False
+        self.load()
+
+    def load(self) -> None:
+        for path in (self.fallback_path, self.path):
+            if path and os.path.exists(path):
+                with open(path, "r") as f:
+                    self._data.update(json.load(f))
+                self.logger.info(f"Loaded {len(self._data)} state entries from {path}")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def set(self, key: str, value: Any) -> None:
+        if self._data.get(key) != value:
+            self._data[key] = value
+            self._dirty = True
+
+    def get_last_check(self, key: str, fallback_keys: Iterable[str] = ()) -> datetime:
+        """
+        Return the time of the last check of a source.
+
+        Args:
+            key (str): The cursor key.
+            fallback_keys (Iterable[str], optional): Older keys to fall back to, e.g. from before a
+                cursor was renamed. The earliest of them is used.
+
+        Returns:
+            datetime: The last check time, initialized to now if there is none.
+        """
+        value = self.get(key)
+        if value is None:
+            fallbacks = [self.get(fallback_key) for fallback_key in fallback_keys]
+            fallbacks = [fallback for fallback in fallbacks if fallback is not None]
+            if fallbacks:
+                value = min(fallbacks, key=datetime.fromisoformat)
+        if value is not None:
+            return datetime.fromisoformat(value)
+
+        last_check = datetime.now()
+        self.set_last_check(key, last_check)
+        self.logger.info(f"Initializing last check for {key}.")
+        return last_check
+
+    def set_last_check(self, key: str, when: Optional[datetime] = None) -> None:
+        when = when or datetime.now()
+        self.set(key, when.isoformat())
+        self.logger.debug(f"Updated last check for {key} to {when}.")
+
+    async def run(self) -> None:
+        """Flush changed state every `flush_interval` seconds until cancelled."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if self._dirty:
+                snapshot = json.dumps(self._data)
+                self._dirty = False
+                try:
+                    await loop.run_in_executor(None, self._write, snapshot)
+                except OSError as e:
+                    self._dirty = True
+                    self.logger.error(f"Failed to write state to {self.path}: {str(e)}")
+
+    def flush(self) -> None:
+        if self._dirty:
+            self._write(json.dumps(self._data))
+            self._dirty = False
+
+    def _write(self, snapshot: str) -> None:
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(snapshot)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+_state_store: Optional[StateStore] = None
+
+
+def setup_state_store(config: Dict, logger) -> StateStore:
+    """
+    Load the process-wide state store from the optional "state" section of the config.
+
+    Args:
+        config (Dict): The bot configuration.
+        logger: The logger to report state changes to.
+
+    Returns:
+        StateStore: The shared store, also returned by `get_state_store()` from now on.
+    """
+    global _state_store
+    settings = config.get("state", {})
+    _state_store = StateStore(
+        logger,
+        path=settings.get("path", "data/last_check.json"),
+        flush_interval=settings.get("flush_interval", 5),
+        fallback_path=settings.get("fallback_path"),
+    )
+    return _state_store
+
+
+def get_state_store() -> StateStore:
+    if _state_store is None:
+        raise RuntimeError("State store has not been set up, call setup_state_store() first")
+    return _state_store